@@ -0,0 +1,229 @@
+"""
+Пакетная публикация сообщений с подтверждениями (publisher confirms).
+
+BatchPublisher открывает отдельный канал с включёнными подтверждениями и держит
+ограниченное окно неподтверждённых публикаций, не дожидаясь ответа брокера на каждое сообщение.
+"""
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, Optional, Union
+
+from aio_pika import Message
+from aio_pika.abc import AbstractChannel, AbstractExchange, TimeoutType
+from pamqp.commands import Basic
+
+from asyncmq.worker import QueueRabbitClient
+from compression import DEFAULT_MIN_SIZE, compress
+from metrics import get_metrics
+from rate_limit import PublishBlockedError, PublishThrottle
+from sharding import Sharding
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+PublishItem = Union[Message, tuple[Message, str]]
+
+
+@dataclass
+class PublishOutcome:
+    """
+    Результат публикации одного сообщения.
+
+    :param index: Порядковый номер сообщения в переданной последовательности.
+    :param confirmed: True, если брокер подтвердил сообщение (Basic.Ack).
+    :param error: Исключение, если публикация не удалась.
+    """
+    index: int
+    confirmed: bool
+    error: Optional[BaseException] = None
+
+
+class BatchPublisher:
+    """
+    Публикует сообщения в обменник, удерживая до `window` неподтверждённых сообщений одновременно.
+
+    Пример:
+        async with BatchPublisher(client, "test_exchange", window=512) as publisher:
+            outcomes = await publisher.publish_many(messages, routing_key="test_key")
+    """
+
+    def __init__(
+            self,
+            client: QueueRabbitClient,
+            exchange_name: str = "",
+            window: int = 256,
+            timeout: TimeoutType = None,
+            compression: Optional[str] = None,
+            compress_min_size: int = DEFAULT_MIN_SIZE,
+            throttle: Optional[PublishThrottle] = None,
+    ):
+        """
+        :param client: Подключённый QueueRabbitClient, на соединении которого открывается канал.
+        :param exchange_name: Имя обменника ("" - обменник по умолчанию).
+        :param window: Максимальное количество неподтверждённых публикаций.
+        :param timeout: Максимальное время ожидания подтверждения одного сообщения.
+        :param compression: Алгоритм сжатия тел сообщений (None - без сжатия).
+        :param compress_min_size: Минимальный размер тела для сжатия.
+        :param throttle: Если задан, публикации ограничиваются по скорости и по количеству
+            неподтверждённых сообщений (общему для всех publisher'ов с этим throttle).
+        """
+        if window < 1:
+            raise ValueError("window must be greater than 0")
+        self.client = client
+        self.exchange_name = exchange_name
+        self.window = window
+        self.timeout = timeout
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.throttle = throttle
+        self.channel: Optional[AbstractChannel] = None
+        self.exchange: Optional[AbstractExchange] = None
+
+    async def open(self) -> None:
+        """Открывает канал с подтверждениями публикации и получает обменник."""
+        if self.client.pool:
+            # Каналы publisher'ов пула открываются с publisher_confirms=True и не используются consumer'ами.
+            self.channel = await self.client.pool.channels(self.client.connection, publisher=True).get()
+        else:
+            self.channel = await self.client.connection.channel(publisher_confirms=True)
+        if self.exchange_name:
+            self.exchange = await self.channel.get_exchange(self.exchange_name)
+        else:
+            self.exchange = self.channel.default_exchange
+
+    async def close(self) -> None:
+        if not self.channel:
+            return
+        if self.client.pool:
+            await self.client.pool.put_channel(self.client.connection, self.channel, publisher=True)
+        else:
+            await self.channel.close()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def publish(self, message: Message, routing_key: str = "", index: int = 0) -> PublishOutcome:
+        """
+        Публикует одно сообщение и ждёт подтверждения брокера.
+
+        :param message: Сообщение для отправки.
+        :param routing_key: Ключ маршрутизации.
+        :param index: Номер сообщения, который попадёт в результат.
+        :return: PublishOutcome - результат публикации.
+        """
+        if self.compression and not message.content_encoding:
+            body, content_encoding = compress(message.body, self.compression, self.compress_min_size)
+            if content_encoding:
+                message.body = body
+                message.content_encoding = content_encoding
+        tracer = get_tracer()
+        if tracer.enabled:
+            message.headers = tracer.inject(message.headers)
+        metrics = get_metrics()
+        if self.throttle is not None:
+            # Пока брокер не подтверждает публикации, новые не отправляются и не копятся в буфере клиента.
+            try:
+                await self.throttle.acquire()
+            except PublishBlockedError as e:
+                logger.warning("Message %d was not published: %s", index, e)
+                metrics.publish_failed.inc(exchange=self.exchange_name)
+                return PublishOutcome(index=index, confirmed=False, error=e)
+        started = time.perf_counter()
+        try:
+            confirmation = await self.exchange.publish(
+                message=message,
+                routing_key=routing_key,
+                timeout=self.timeout,
+            )
+        except Exception as e:
+            logger.warning("Message %d was not published: %s", index, e)
+            metrics.publish_failed.inc(exchange=self.exchange_name)
+            return PublishOutcome(index=index, confirmed=False, error=e)
+        finally:
+            if self.throttle is not None:
+                self.throttle.confirmed()
+        elapsed = time.perf_counter() - started
+        metrics.publish_confirm_seconds.observe(elapsed, exchange=self.exchange_name)
+        tracer.published(message.headers, elapsed, exchange=self.exchange_name)
+        confirmed = isinstance(confirmation, Basic.Ack)
+        if confirmed:
+            metrics.published.inc(exchange=self.exchange_name)
+        else:
+            logger.warning("Message %d was rejected by the broker (Basic.Nack)", index)
+            metrics.publish_failed.inc(exchange=self.exchange_name)
+        return PublishOutcome(index=index, confirmed=confirmed)
+
+    async def publish_sharded(
+            self, sharding: Sharding, key: Union[str, bytes, int], message: Message, index: int = 0,
+    ) -> PublishOutcome:
+        """
+        Публикует сообщение в шард, соответствующий ключу (см. `QueueRabbitClient.consume_shards`).
+
+        Publisher должен быть открыт для обменника шардов:
+            await client.declare_topology(sharding.topology())
+            async with BatchPublisher(client, sharding.exchange) as publisher:
+                await publisher.publish_sharded(sharding, user_id, message)
+
+        :param sharding: Описание шардированной очереди.
+        :param key: Ключ сообщения; сообщения с одним ключом попадают в один шард.
+        :param message: Сообщение для отправки.
+        :param index: Номер сообщения, который попадёт в результат.
+        :return: PublishOutcome - результат публикации.
+        """
+        exchange, routing_key = sharding.route(key)
+        if exchange != self.exchange_name:
+            raise ValueError(f"publisher is bound to exchange {self.exchange_name!r}, not {exchange!r}")
+        if message.message_id is None:
+            # Ключ дедупликации consumer'ов шардов.
+            message.message_id = uuid.uuid4().hex
+        return await self.publish(message, routing_key, index=index)
+
+    async def publish_many(self, messages: Iterable[PublishItem], routing_key: str = "") -> list[PublishOutcome]:
+        """
+        Публикует последовательность сообщений конвейером.
+
+        Новое сообщение берётся из messages и отправляется, как только в окне освобождается место,
+        подтверждения собираются асинхронно. Генератор сообщений вызывается только при свободном
+        месте в окне, поэтому не создаёт сообщения заранее.
+
+        :param messages: Сообщения или пары (сообщение, ключ маршрутизации).
+        :param routing_key: Ключ маршрутизации для сообщений без собственного ключа.
+        :return: Список результатов в порядке исходных сообщений.
+        """
+        semaphore = asyncio.Semaphore(self.window)
+        outcomes: list[Optional[PublishOutcome]] = []
+        pending: set[asyncio.Task] = set()
+
+        async def send(index: int, message: Message, key: str) -> None:
+            try:
+                outcomes[index] = await self.publish(message, key, index=index)
+            finally:
+                semaphore.release()
+
+        items = iter(messages)
+        for index in itertools.count():
+            await semaphore.acquire()
+            item = next(items, None)
+            if item is None:
+                semaphore.release()
+                break
+            if isinstance(item, tuple):
+                message, key = item
+            else:
+                message, key = item, routing_key
+            outcomes.append(None)
+            task = asyncio.create_task(send(index, message, key))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.gather(*pending)
+        return outcomes  # type: ignore
@@ -1,10 +1,15 @@
 """Asynchronous consumer client implementation."""
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import aio_pika
 from aio_pika.abc import AbstractChannel
 import logging
 
+from memory_broker.broker import MEMORY_URL_SCHEME
+
+if TYPE_CHECKING:
+    from asyncmq.pool import ConnectionPool
+
 logger = logging.getLogger(__name__)
 
 HOST = "0.0.0.0"
@@ -13,17 +18,39 @@ USER = "user"
 PASSWORD = "password"
 
 
+async def open_connection(amqp_url: str) -> aio_pika.RobustConnection:
+    """
+    Открывает robust-соединение с RabbitMQ.
+
+    URL вида `memory://<имя>` подключает к брокеру в памяти процесса (без сети).
+    """
+    if amqp_url.startswith(MEMORY_URL_SCHEME):
+        from memory_broker.aio import connect_robust
+        return await connect_robust(amqp_url)  # type: ignore
+    return await aio_pika.connect_robust(amqp_url)
+
+
 class RabbitMQClient:
-    def __init__(self, amqp_url: str):
+    def __init__(self, amqp_url: str, pool: Optional["ConnectionPool"] = None):
         self.amqp_url = amqp_url
+        self.pool = pool
         self.connection: aio_pika.RobustConnection | None = None
         self.channel: Optional["AbstractChannel"] = None
 
     async def connect(self):
-        self.connection = await aio_pika.connect_robust(self.amqp_url)
+        if self.pool:
+            # Соединение общее для процесса, канал берётся из пула каналов consumer'ов этого соединения.
+            self.connection = await self.pool.get_connection()
+            self.channel = await self.pool.channels(self.connection).get()
+            return
+        self.connection = await open_connection(self.amqp_url)
         self.channel = await self.connection.channel()
 
     async def disconnect(self):
+        if self.pool:
+            if self.channel:
+                await self.pool.put_channel(self.connection, self.channel)
+            return
         if self.channel:
             await self.channel.close()
         if self.connection:
@@ -1,21 +1,20 @@
 import asyncio
 import logging
 import random
-import sys
-import os
 
 from aio_pika.abc import AbstractIncomingMessage
 
 from asyncmq.worker import QueueRabbitClient
+from dedup import MemoryDedupStore
+from prefetch import AdaptivePrefetch
+from rabbitmq_conf import EventLogger, config_logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+events = EventLogger(logger, sample_rates={"message_processed": 0.1})
 
 
 async def process_message(message: AbstractIncomingMessage):
-    tag: int = 0
-    if message.delivery_tag:
-        tag = message.delivery_tag
     long_task = random.randint(0, 4)
     await asyncio.sleep(long_task)
     if long_task == 0:
@@ -35,9 +34,10 @@ async def process_message(message: AbstractIncomingMessage):
 
     else:
 
-        await message.channel.basic_ack(delivery_tag=tag)  # подтверждает что сообщение успешно обработано
+        # Подтверждение через сообщение: consume узнаёт об ack (дедупликация, метрики, слот in-flight).
+        await message.ack()  # подтверждает что сообщение успешно обработано
         # message.delivery_tag для чего нужны тэги и как их использовать?
-        logger.info(f"Сообщение обработано: {message.body.decode()}, spent time: {long_task}")
+        events.info("message_processed", body=message.body, spent=long_task)
 
 
 async def main():
@@ -51,26 +51,34 @@ async def main():
                 # "x-message-ttl": 120_000,  # 120 seconds TTL
             }
         )
-        await client.channel.set_qos(prefetch_count=1)
+        # Количество одновременно обрабатываемых сообщений равно начальному prefetch_count,
+        # дальше prefetch_count подстраивается под время обработки: consume переносит лимит
+        # на весь канал (global), чтобы его можно было менять у запущенного consumer'а.
+        await client.set_prefetch(prefetch_count=4)
+        prefetch_controller = AdaptivePrefetch(min_prefetch=4, max_prefetch=64)
 
         # Привязываем очередь к обменнику
         await client.bind_queue(queue, exchange.name, routing_key="main-queue")
 
+        # SIGTERM/SIGINT останавливают consumer: обрабатываемые сообщения дорабатываются,
+        # остальные возвращаются в очередь, после чего соединение закрывается.
+        client.install_signal_handlers(shutdown_timeout=30)
+
         # Начинаем обрабатывать сообщения
         logger.info("Waiting for messages...")
-        try:
-            await client.consume(queue, process_message)
-        except KeyboardInterrupt:
-            logger.info("Consumer stopped.")
+        # Повторные доставки уже обработанного сообщения (requeue, повторная публикация)
+        # подтверждаются без обработки. Хранилище в памяти теряется вместе с процессом, поэтому
+        # повтор после падения до отправки ack будет обработан снова; от него защищает только
+        # внешнее хранилище (см. dedup.DedupStore).
+        report = await client.consume(
+            queue,
+            process_message,
+            prefetch_controller=prefetch_controller,
+            dedup_store=MemoryDedupStore(max_size=100_000, ttl=3600),
+        )
+        logger.info("Consumer stopped: %d drained, %d returned.", report.drained, report.returned)
 
 
 if __name__ == '__main__':
-    try:
-        logging.basicConfig(level=logging.INFO)
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print('Interrupted')
-        try:
-            sys.exit(0)
-        except SystemExit:
-            os._exit(0)  # noqa
+    config_logging(background=True)
+    asyncio.run(main())
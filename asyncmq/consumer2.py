@@ -1,21 +1,21 @@
 import asyncio
 import logging
-import sys
-import os
 import random
 
 from aio_pika.abc import AbstractIncomingMessage
 
 from asyncmq.worker import QueueRabbitClient
+from rabbitmq_conf import EventLogger, config_logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+events = EventLogger(logger, sample_rates={"message_processed": 0.1})
 
 
 async def process_message(message: AbstractIncomingMessage):
     long_task = random.randint(0, 3)
     await asyncio.sleep(long_task)
-    logger.info(f"Received message: {message.body.decode()}, spent time: {long_task}")
+    events.info("message_processed", body=message.body, spent=long_task)
 
 
 async def main():
@@ -25,26 +25,23 @@ async def main():
         exchange = await client.declare_exchange("test_exchange", durable=True)
 
         queue = await client.declare_queue("test_queue", durable=True)
-        await client.channel.set_qos(prefetch_count=1)
+        # При auto_ack брокер не ограничивает доставки prefetch_count, поэтому адаптивный prefetch
+        # здесь не используется: значение задаёт только число одновременно обрабатываемых сообщений.
+        await client.set_prefetch(prefetch_count=1)
 
         # Привязываем очередь к обменнику
         await client.bind_queue(queue, exchange.name, routing_key="test_key")
 
+        # SIGTERM/SIGINT останавливают consumer: обрабатываемые сообщения дорабатываются,
+        # остальные возвращаются в очередь, после чего соединение закрывается.
+        client.install_signal_handlers(shutdown_timeout=30)
+
         # Начинаем обрабатывать сообщения
         logger.info("Waiting for messages...")
-        try:
-            await client.consume(queue, process_message, auto_ack=True)
-        except KeyboardInterrupt:
-            logger.info("Consumer stopped.")
+        report = await client.consume(queue, process_message, auto_ack=True)
+        logger.info("Consumer stopped: %d drained, %d returned.", report.drained, report.returned)
 
 
 if __name__ == '__main__':
-    try:
-        logging.basicConfig(level=logging.INFO)
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print('Interrupted')
-        try:
-            sys.exit(0)
-        except SystemExit:
-            os._exit(0)  # noqa
+    config_logging(background=True)
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+"""
+Пул соединений и каналов RabbitMQ для aio_pika.
+
+Соединения создаются лениво и разделяются всеми клиентами процесса,
+каналы берутся из пула каждого соединения и возвращаются в него после использования.
+
+Каналы consumer'ов и publisher'ов выдаются из разных пулов: на канал consumer'а действуют
+prefetch (basic.qos) и подписки, и publisher не должен их получить вместе с каналом.
+При возврате в пул prefetch канала consumer'а сбрасывается.
+"""
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+
+from asyncmq.connection import open_connection
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelPool:
+    """
+    Пул каналов одного соединения.
+
+    Одновременно выдаётся не более `max_size` каналов, закрытые каналы не возвращаются в пул.
+    """
+
+    def __init__(
+            self,
+            connection: AbstractRobustConnection,
+            max_size: int = 16,
+            publisher_confirms: bool = True,
+            consumers: bool = False,
+    ):
+        """
+        :param connection: Соединение, на котором открываются каналы.
+        :param max_size: Максимальное количество одновременно выданных каналов.
+        :param publisher_confirms: Включать ли подтверждения публикации на новых каналах.
+        :param consumers: Каналы для consumer'ов: при возврате в пул их prefetch сбрасывается.
+            Подписки на канале к моменту возврата должны быть отменены.
+        """
+        self.connection = connection
+        self.max_size = max_size
+        self.publisher_confirms = publisher_confirms
+        self.consumers = consumers
+        self._idle: list[AbstractChannel] = []
+        self._semaphore = asyncio.Semaphore(max_size)
+
+    async def get(self) -> AbstractChannel:
+        """Выдаёт рабочий канал из пула или открывает новый."""
+        await self._semaphore.acquire()
+        while self._idle:
+            channel = self._idle.pop()
+            if not channel.is_closed:
+                return channel
+        try:
+            return await self.connection.channel(publisher_confirms=self.publisher_confirms)
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    async def put(self, channel: AbstractChannel) -> None:
+        """Возвращает канал в пул. Закрытый канал и канал, prefetch которого не удалось сбросить, отбрасываются."""
+        try:
+            if not channel.is_closed and self.consumers:
+                await self._reset(channel)
+            if not channel.is_closed:
+                self._idle.append(channel)
+        finally:
+            self._semaphore.release()
+
+    @staticmethod
+    async def _reset(channel: AbstractChannel) -> None:
+        """Сбрасывает prefetch consumer'а и канала, чтобы следующий владелец канала начинал без лимитов."""
+        try:
+            await channel.set_qos(prefetch_count=0)
+            await channel.set_qos(prefetch_count=0, global_=True)
+        except Exception as e:
+            logger.warning("Closing pooled channel that could not be reset: %s", e)
+            if not channel.is_closed:
+                await channel.close()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AbstractChannel]:
+        channel = await self.get()
+        try:
+            yield channel
+        finally:
+            await self.put(channel)
+
+    async def close(self) -> None:
+        while self._idle:
+            channel = self._idle.pop()
+            if not channel.is_closed:
+                await channel.close()
+
+
+class ConnectionPool:
+    """
+    Пул robust-соединений с пулом каналов для каждого соединения.
+
+    Соединения выдаются по кругу, закрытые соединения пересоздаются при следующем обращении.
+    У каждого соединения два пула каналов: для consumer'ов и для publisher'ов.
+    """
+
+    def __init__(
+            self,
+            amqp_url: str,
+            max_connections: int = 1,
+            max_channels: int = 16,
+    ):
+        """
+        :param amqp_url: URL подключения к RabbitMQ.
+        :param max_connections: Максимальное количество соединений в пуле.
+        :param max_channels: Максимальное количество каналов каждого пула (consumer'ов и publisher'ов) на одно соединение.
+        """
+        self.amqp_url = amqp_url
+        self.max_connections = max_connections
+        self.max_channels = max_channels
+        self._connections: list[Optional[AbstractRobustConnection]] = [None] * max_connections
+        self._channel_pools: dict[int, tuple[ChannelPool, ChannelPool]] = {}
+        self._slots = itertools.cycle(range(max_connections))
+        self._lock = asyncio.Lock()
+
+    async def get_connection(self) -> AbstractRobustConnection:
+        """Выдаёт следующее соединение пула, открывая его при необходимости."""
+        slot = next(self._slots)
+        async with self._lock:
+            connection = self._connections[slot]
+            if connection is None or connection.is_closed:
+                if connection is not None:
+                    self._channel_pools.pop(id(connection), None)
+                connection = await open_connection(self.amqp_url)
+                self._connections[slot] = connection
+                self._channel_pools[id(connection)] = (
+                    ChannelPool(connection, max_size=self.max_channels, consumers=True),
+                    ChannelPool(connection, max_size=self.max_channels),
+                )
+                logger.info("Opened pooled connection %d to %s", slot, connection)
+        return connection
+
+    def channels(self, connection: AbstractRobustConnection, publisher: bool = False) -> ChannelPool:
+        """
+        Возвращает пул каналов соединения, выданного этим пулом.
+
+        :param connection: Соединение пула.
+        :param publisher: Пул каналов publisher'ов (по умолчанию - consumer'ов).
+        """
+        return self._channel_pools[id(connection)][publisher]
+
+    async def put_channel(
+            self,
+            connection: AbstractRobustConnection,
+            channel: AbstractChannel,
+            publisher: bool = False,
+    ) -> None:
+        """Возвращает канал в пул его соединения. Если соединение уже пересоздано, канал закрывается."""
+        channel_pools = self._channel_pools.get(id(connection))
+        if channel_pools is not None:
+            await channel_pools[publisher].put(channel)
+        elif not channel.is_closed:
+            await channel.close()
+
+    @asynccontextmanager
+    async def acquire_connection(self) -> AsyncIterator[AbstractRobustConnection]:
+        yield await self.get_connection()
+
+    @asynccontextmanager
+    async def acquire_channel(self, publisher: bool = False) -> AsyncIterator[AbstractChannel]:
+        connection = await self.get_connection()
+        async with self.channels(connection, publisher).acquire() as channel:
+            yield channel
+
+    async def close(self) -> None:
+        async with self._lock:
+            for channel_pools in self._channel_pools.values():
+                for channel_pool in channel_pools:
+                    await channel_pool.close()
+            self._channel_pools.clear()
+            for slot, connection in enumerate(self._connections):
+                if connection is not None and not connection.is_closed:
+                    await connection.close()
+                self._connections[slot] = None
+
+
+_pools: dict[str, ConnectionPool] = {}
+
+
+def get_pool(amqp_url: str, max_connections: int = 1, max_channels: int = 16) -> ConnectionPool:
+    """
+    Возвращает общий для процесса пул соединений для указанного URL.
+
+    Параметры размера учитываются только при первом создании пула.
+    """
+    pool = _pools.get(amqp_url)
+    if pool is None:
+        pool = ConnectionPool(amqp_url, max_connections=max_connections, max_channels=max_channels)
+        _pools[amqp_url] = pool
+    return pool
+
+
+async def close_pools() -> None:
+    """Закрывает все пулы соединений процесса."""
+    for pool in list(_pools.values()):
+        await pool.close()
+    _pools.clear()
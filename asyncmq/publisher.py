@@ -1,10 +1,15 @@
 import asyncio
-import json
+import logging
+import uuid
 
 
 from aio_pika import Message
 
+from asyncmq.batch_publisher import BatchPublisher
 from asyncmq.worker import QueueRabbitClient
+from serializers import encode
+
+logger = logging.getLogger(__name__)
 
 
 async def main():
@@ -14,18 +19,19 @@ async def main():
         queue = await client.declare_queue("test_queue", durable=True)
         await client.bind_queue(queue, exchange.name, routing_key="test_key")
 
-        for i in range(10):
-            message = {
-                f"message-{i:02d}": "Hello World!",
-            }
-            body_to_queue = json.dumps(message)
+        def build_message(index: int) -> Message:
+            body, content_type = encode({f"message-{index:02d}": "Hello World!"})
+            return Message(body=body, content_type=content_type, message_id=uuid.uuid4().hex)
+
+        messages = (build_message(i) for i in range(10))
 
+        async with BatchPublisher(client, exchange.name, window=256) as publisher:
+            outcomes = await publisher.publish_many(messages, routing_key="test_key")
 
-            await exchange.publish(
-                message=Message(body=body_to_queue.encode()),
-                routing_key="test_key",
-            )
+        failed = [outcome for outcome in outcomes if not outcome.confirmed]
+        logger.info("Published %d messages, failed %d", len(outcomes), len(failed))
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
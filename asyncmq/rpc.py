@@ -0,0 +1,245 @@
+"""
+Запрос-ответ (RPC) поверх RabbitMQ через direct reply-to.
+
+RpcClient публикует запрос с reply_to=amq.rabbitmq.reply-to и уникальным correlation_id,
+а ответ приходит в тот же канал без объявления очереди ответов. Ожидающие вызовы хранятся
+в словаре correlation_id -> Future, поэтому по одному каналу одновременно выполняется
+любое количество вызовов. Ответы на вызовы, срок которых истёк, отбрасываются.
+
+RpcServer оборачивает обработчик запросов: результат обработчика публикуется в reply_to
+запроса с тем же correlation_id, исключение обработчика передаётся клиенту в заголовке
+x-rpc-error и поднимается у вызывающего как RpcError.
+
+Пример:
+    async with QueueRabbitClient(amqp_url) as client, RpcClient(client) as rpc:
+        reply = await rpc.call("kyc_lookup", b'{"user_id": 42}', timeout=2)
+"""
+import asyncio
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from aio_pika import Message
+from aio_pika.abc import AbstractExchange, AbstractIncomingMessage, AbstractQueue, ConsumerTag
+
+from asyncmq.worker import QueueRabbitClient, ShutdownReport
+from topology import Topology
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+ERROR_HEADER = "x-rpc-error"
+DEFAULT_RPC_TIMEOUT = 10.0
+
+
+class RpcError(RuntimeError):
+    """Сервер не смог обработать запрос или ответ не получен."""
+
+
+class RpcTimeoutError(RpcError, asyncio.TimeoutError):
+    """Ответ не получен за отведённое время."""
+
+
+class RpcClient:
+    """
+    Выполняет RPC-вызовы через канал подключённого QueueRabbitClient.
+
+    :param client: Подключённый QueueRabbitClient; канал используется совместно с его consumer'ами.
+    :param timeout: Срок ожидания ответа по умолчанию в секундах.
+    """
+
+    def __init__(self, client: QueueRabbitClient, timeout: float = DEFAULT_RPC_TIMEOUT):
+        self.client = client
+        self.timeout = timeout
+        self._pending: dict[str, asyncio.Future[AbstractIncomingMessage]] = {}
+        self._exchanges: dict[str, AbstractExchange] = {}
+        self._queue: Optional[AbstractQueue] = None
+        self._consumer_tag: Optional[ConsumerTag] = None
+
+    @property
+    def pending(self) -> int:
+        """Количество вызовов, ожидающих ответа."""
+        return len(self._pending)
+
+    async def start(self) -> None:
+        """Подписывается на ответы; RabbitMQ требует подписки до первой публикации с direct reply-to."""
+        if self._consumer_tag is not None:
+            return
+        self._queue = await self.client.channel.get_queue(DIRECT_REPLY_TO, ensure=False)
+        self._consumer_tag = await self._queue.consume(self._on_reply, no_ack=True)
+
+    async def close(self) -> None:
+        """Отменяет подписку на ответы, ожидающие вызовы завершаются с RpcError."""
+        if self._consumer_tag is not None and not self.client.channel.is_closed:
+            await self._queue.cancel(self._consumer_tag)
+        self._consumer_tag = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RpcError("RPC client closed"))
+
+    async def __aenter__(self) -> "RpcClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    async def _on_reply(self, message: AbstractIncomingMessage) -> None:
+        future = self._pending.pop(message.correlation_id or "", None)
+        if future is None:
+            # Ответ на вызов, срок которого истёк, или повторный ответ после переотправки запроса.
+            logger.debug("Dropping reply with unknown correlation_id %s", message.correlation_id)
+            return
+        if not future.done():
+            future.set_result(message)
+
+    async def _exchange(self, name: str) -> AbstractExchange:
+        if not name:
+            return self.client.channel.default_exchange
+        exchange = self._exchanges.get(name)
+        if exchange is None:
+            exchange = self._exchanges[name] = await self.client.channel.get_exchange(name, ensure=False)
+        return exchange
+
+    async def call_message(
+            self,
+            routing_key: str,
+            body: bytes,
+            exchange: str = "",
+            timeout: Optional[float] = None,
+            headers: Optional[dict[str, Any]] = None,
+            content_type: Optional[str] = None,
+    ) -> AbstractIncomingMessage:
+        """
+        Отправляет запрос и ждёт ответное сообщение.
+
+        Запросу задаётся expiration, равный сроку ожидания: если сервер не успел взять запрос
+        из очереди, брокер удаляет его, и сервер не тратит время на ответ, который никто не ждёт.
+
+        :param routing_key: Ключ маршрутизации (для обменника по умолчанию - имя очереди сервера).
+        :param body: Тело запроса.
+        :param exchange: Обменник запроса (по умолчанию - обменник по умолчанию).
+        :param timeout: Срок ожидания ответа в секундах (по умолчанию self.timeout).
+        :param headers: Заголовки запроса.
+        :param content_type: Тип содержимого запроса.
+        :return: Ответное сообщение.
+        :raises RpcTimeoutError: Ответ не получен за timeout.
+        :raises RpcError: Сервер вернул ошибку.
+        """
+        await self.start()
+        timeout = self.timeout if timeout is None else timeout
+        correlation_id = uuid.uuid4().hex
+        future: asyncio.Future[AbstractIncomingMessage] = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        try:
+            target = await self._exchange(exchange)
+            await target.publish(
+                Message(
+                    body=body,
+                    headers=get_tracer().inject(headers),
+                    content_type=content_type,
+                    correlation_id=correlation_id,
+                    reply_to=DIRECT_REPLY_TO,
+                    expiration=timeout,
+                ),
+                routing_key=routing_key,
+            )
+            reply = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RpcTimeoutError(f"No reply from {exchange}/{routing_key} in {timeout}s") from None
+        finally:
+            self._pending.pop(correlation_id, None)
+
+        error = (reply.headers or {}).get(ERROR_HEADER)
+        if error is not None:
+            raise RpcError(error.decode() if isinstance(error, bytes) else str(error))
+        return reply
+
+    async def call(
+            self,
+            routing_key: str,
+            body: bytes,
+            exchange: str = "",
+            timeout: Optional[float] = None,
+            headers: Optional[dict[str, Any]] = None,
+            content_type: Optional[str] = None,
+    ) -> bytes:
+        """Отправляет запрос и возвращает тело ответа (см. `call_message`)."""
+        reply = await self.call_message(routing_key, body, exchange, timeout, headers, content_type)
+        return reply.body
+
+
+class RpcServer:
+    """
+    Обрабатывает запросы RpcClient и отвечает на них.
+
+    Обработчик получает сообщение запроса и возвращает тело ответа (None - пустой ответ).
+    Ответ публикуется до подтверждения запроса: если процесс упадёт между ними, запрос
+    будет обработан повторно, а лишний ответ клиент отбросит.
+
+    :param client: Подключённый QueueRabbitClient.
+    """
+
+    def __init__(self, client: QueueRabbitClient):
+        self.client = client
+
+    async def reply(
+            self,
+            request: AbstractIncomingMessage,
+            body: bytes,
+            headers: Optional[dict[str, Any]] = None,
+            content_type: Optional[str] = None,
+    ) -> None:
+        """Публикует ответ на запрос; запросы без reply_to ответа не требуют."""
+        if not request.reply_to:
+            return
+        await self.client.channel.default_exchange.publish(
+            Message(
+                body=body,
+                headers=get_tracer().inject(headers),
+                content_type=content_type,
+                correlation_id=request.correlation_id,
+            ),
+            routing_key=request.reply_to,
+        )
+
+    def replying(
+            self, handler: Callable[[AbstractIncomingMessage], Awaitable[Optional[bytes]]],
+    ) -> Callable[[AbstractIncomingMessage], Awaitable[None]]:
+        """Оборачивает обработчик запросов: результат или ошибка отправляются клиенту, запрос подтверждается."""
+
+        async def wrapper(message: AbstractIncomingMessage) -> None:
+            try:
+                result = await handler(message)
+            except Exception as e:
+                # Запрос подтверждается: клиент получает ошибку сразу, а не по истечении срока.
+                await self.reply(message, b"", headers={ERROR_HEADER: f"{type(e).__name__}: {e}"})
+                if not message.processed:
+                    await message.ack()
+                raise
+            await self.reply(message, result or b"")
+            if not message.processed:
+                await message.ack()
+
+        return wrapper
+
+    async def serve(
+            self,
+            queue_name: str,
+            handler: Callable[[AbstractIncomingMessage], Awaitable[Optional[bytes]]],
+            max_in_flight: Optional[int] = None,
+            durable: bool = False,
+    ) -> ShutdownReport:
+        """
+        Объявляет очередь запросов и обрабатывает её до запроса остановки клиента.
+
+        :param queue_name: Очередь запросов (ключ маршрутизации для RpcClient.call).
+        :param handler: Асинхронный обработчик запроса, возвращающий тело ответа.
+        :param max_in_flight: Лимит одновременно обрабатываемых запросов (по умолчанию равен prefetch_count).
+        :param durable: Устойчивая ли очередь запросов.
+        :return: ShutdownReport клиента.
+        """
+        queue = (await self.client.declare_topology(Topology().queue(queue_name, durable=durable)))[queue_name]
+        return await self.client.consume(queue, self.replying(handler), max_in_flight=max_in_flight)
@@ -0,0 +1,144 @@
+"""
+Планировщик обработки сообщений из нескольких очередей одним consumer'ом.
+
+Сообщения всех очередей собираются в локальные буферы, а общий лимит одновременно
+обрабатываемых сообщений распределяется между очередями:
+
+* priority - строгий приоритет: очередь с меньшим priority получает слот, только если
+  у всех очередей с большим priority нет готовых сообщений (или они упёрлись в свой лимит);
+* weight - доля слотов среди очередей одного приоритета (взвешенная справедливая очередь):
+  очередь с weight=3 при постоянной нагрузке получает втрое больше слотов, чем с weight=1;
+* max_concurrency - лимит одновременно обрабатываемых сообщений очереди.
+
+Внутри буфера очереди сообщения упорядочены по AMQP priority сообщения (для очередей с
+x-max-priority), затем по порядку получения. Брокер упорядочивает только сообщения,
+ещё не доставленные consumer'у, поэтому для очередей с приоритетами prefetch стоит держать небольшим.
+"""
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractIncomingMessage, AbstractQueue
+
+    from dedup import DedupStore
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class QueueSource:
+    """
+    Очередь, обрабатываемая планировщиком.
+
+    :param queue: Очередь aio_pika.
+    :param on_message_callback: Асинхронный обработчик сообщений очереди.
+    :param priority: Класс приоритета: очереди с большим значением обслуживаются первыми.
+    :param weight: Доля слотов среди очередей того же priority.
+    :param max_concurrency: Лимит одновременно обрабатываемых сообщений очереди (None - без отдельного лимита).
+    :param auto_ack: Подтверждать ли сообщения автоматически при получении.
+    :param dedup_store: Если задан, повторные доставки уже обработанных сообщений подтверждаются
+        без вызова обработчика.
+    """
+    queue: "AbstractQueue"
+    on_message_callback: Callable[["AbstractIncomingMessage"], Awaitable[Any]]
+    priority: int = 0
+    weight: float = 1.0
+    max_concurrency: Optional[int] = None
+    auto_ack: bool = False
+    dedup_store: Optional["DedupStore"] = None
+
+
+@dataclass
+class _Lane(Generic[T]):
+    key: Hashable
+    priority: int
+    weight: float
+    max_concurrency: Optional[int]
+    order: int
+    # Виртуальное время очереди: растёт на 1 / weight с каждым выданным сообщением.
+    finish: float = 0.0
+    in_flight: int = 0
+    buffer: list[tuple[int, int, T]] = field(default_factory=list)
+
+    def ready(self) -> bool:
+        return bool(self.buffer) and (self.max_concurrency is None or self.in_flight < self.max_concurrency)
+
+
+class WeightedFairScheduler(Generic[T]):
+    """
+    Выбирает, сообщение какой очереди обработать следующим.
+
+    Планировщик не выполняет ввод-вывод: consumer кладёт полученные сообщения в `push`,
+    забирает следующее через `pop` при свободном слоте и сообщает о завершении обработки в `done`.
+    """
+
+    def __init__(self):
+        self._lanes: dict[Hashable, _Lane[T]] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+
+    def add(
+            self,
+            key: Hashable,
+            priority: int = 0,
+            weight: float = 1.0,
+            max_concurrency: Optional[int] = None,
+    ) -> None:
+        if weight <= 0:
+            raise ValueError("weight must be greater than 0")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be greater than 0")
+        if key in self._lanes:
+            raise ValueError(f"Source {key!r} is already registered")
+        self._lanes[key] = _Lane(key, priority, weight, max_concurrency, order=len(self._lanes))
+
+    def push(self, key: Hashable, item: T, priority: int = 0) -> None:
+        """Добавляет сообщение очереди key; сообщения с большим priority выдаются раньше."""
+        lane = self._lanes[key]
+        if not lane.buffer and lane.in_flight == 0:
+            # Простаивавшая очередь не накапливает кредит: она встаёт в общий поток с текущего момента.
+            lane.finish = max(lane.finish, self._virtual_time)
+        heapq.heappush(lane.buffer, (-priority, next(self._sequence), item))
+
+    def pop(self) -> Optional[tuple[Hashable, T]]:
+        """Следующее сообщение и его очередь или None, если готовых сообщений нет."""
+        best: Optional[_Lane[T]] = None
+        for lane in self._lanes.values():
+            if not lane.ready():
+                continue
+            if best is None or (-lane.priority, lane.finish, lane.order) < (-best.priority, best.finish, best.order):
+                best = lane
+        if best is None:
+            return None
+        _, _, item = heapq.heappop(best.buffer)
+        self._virtual_time = max(self._virtual_time, best.finish)
+        best.finish += 1 / best.weight
+        best.in_flight += 1
+        return best.key, item
+
+    def done(self, key: Hashable) -> None:
+        """Обработка сообщения очереди key завершена."""
+        self._lanes[key].in_flight -= 1
+
+    def drain(self) -> list[tuple[Hashable, T]]:
+        """Забирает все невыданные сообщения (например, чтобы вернуть их в очередь при остановке)."""
+        items = []
+        for lane in self._lanes.values():
+            items.extend((lane.key, item) for _, _, item in sorted(lane.buffer))
+            lane.buffer.clear()
+        return items
+
+    def pending(self, key: Optional[Hashable] = None) -> int:
+        """Количество невыданных сообщений очереди key или всех очередей."""
+        lanes = self._lanes.values() if key is None else [self._lanes[key]]
+        return sum(len(lane.buffer) for lane in lanes)
+
+    def in_flight(self, key: Optional[Hashable] = None) -> int:
+        """Количество выданных и ещё не завершённых сообщений очереди key или всех очередей."""
+        lanes = self._lanes.values() if key is None else [self._lanes[key]]
+        return sum(lane.in_flight for lane in lanes)
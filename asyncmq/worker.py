@@ -5,18 +5,52 @@
 и обработки сообщений. Подходит для создания потребителей и отправителей сообщений.
 """
 import asyncio
+import functools
 import logging
+import signal
+import sys
+import time
+from dataclasses import dataclass
 
-from typing import Union, Awaitable, Any, Callable, Optional
+from typing import Union, Awaitable, Any, Callable, Iterable, Optional
 
+from aio_pika import Message
 from aio_pika.abc import (
     AbstractQueue, AbstractChannel, ExchangeType, TimeoutType, AbstractExchange, AbstractIncomingMessage, ConsumerTag)
 from pamqp.common import Arguments
 
 from asyncmq.connection import RabbitMQClient
+from asyncmq.pool import ConnectionPool
+from asyncmq.scheduler import QueueSource, WeightedFairScheduler
+from compression import DecompressionError, decompress
+from dedup import DedupStore, call_deduplicated
+from delivery import SettleHooksMessage, settle_hooks_message
+from metrics import Metrics, get_metrics, queue_wait, settle_recorder
+from prefetch import AdaptivePrefetch
+from retry_policy import RetryPolicy
+from sharding import Sharding, ShardMembership
+from topology import Topology, apply_async
+from tracing import traced_async
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SHUTDOWN_TIMEOUT = 30.0
+# Лимит одновременно обрабатываемых сообщений при prefetch_count=0: брокер не ограничивает доставки.
+UNLIMITED_IN_FLIGHT = sys.maxsize
+
+
+@dataclass
+class ShutdownReport:
+    """
+    Итог остановки consumer'а.
+
+    :param drained: Сообщения, обработка которых завершилась во время остановки.
+    :param returned: Сообщения, возвращённые в очередь без обработки (из буфера или по истечении срока).
+    """
+    drained: int = 0
+    returned: int = 0
+
+
 class QueueRabbitClient(RabbitMQClient):
     """
     Класс для работы с RabbitMQ.
@@ -26,6 +60,37 @@ class QueueRabbitClient(RabbitMQClient):
     """
     channel: "AbstractChannel"
 
+    def __init__(self, amqp_url: str, pool: Optional[ConnectionPool] = None):
+        super().__init__(amqp_url=amqp_url, pool=pool)
+        self.prefetch_count: int = 1
+        self._in_flight: set[asyncio.Task] = set()
+        self.shutdown_timeout: float = DEFAULT_SHUTDOWN_TIMEOUT
+        self._stop_requested_at: Optional[float] = None
+        self._stop_event = asyncio.Event()
+        # Буферы активных consume: при остановке в них кладётся None, чтобы прервать ожидание сообщений.
+        self._buffers: set[asyncio.Queue] = set()
+        self._signals: tuple[int, ...] = ()
+        self._prefetch_task: Optional[asyncio.Task] = None
+
+    @property
+    def in_flight(self) -> int:
+        """Количество сообщений, которые обрабатываются в данный момент."""
+        return len(self._in_flight)
+
+    async def set_prefetch(self, prefetch_count: int) -> None:
+        """
+        Устанавливает prefetch_count для канала.
+
+        Значение запоминается и используется в consume как лимит одновременно обрабатываемых сообщений
+        (0 - без ограничения, как и у брокера).
+
+        :param prefetch_count: Максимальное количество неподтверждённых сообщений на consumer.
+        """
+        if prefetch_count < 0:
+            raise ValueError("prefetch_count must not be negative")
+        await self.channel.set_qos(prefetch_count=prefetch_count)
+        self.prefetch_count = prefetch_count
+
     async def declare_exchange(
             self,
             exchange: str,
@@ -113,16 +178,75 @@ class QueueRabbitClient(RabbitMQClient):
         :param arguments: Дополнительные аргументы для конфигурации привязки.
         :param timeout: Максимальное время ожидания операции привязки.
         """
-        exchange = await self.channel.get_exchange(exchange_name)
+        # Привязка по имени обменника не требует отдельного запроса get_exchange.
         await queue.bind(
-            exchange=exchange,
+            exchange=exchange_name,
             routing_key=routing_key,
             arguments=arguments,
             timeout=timeout,
         )
 
-    @staticmethod
+    async def declare_topology(self, topology: Topology) -> dict[str, AbstractQueue]:
+        """
+        Объявляет сущности топологии, которые ещё не объявлялись этим процессом.
+
+        :param topology: Обменники, очереди и привязки.
+        :return: Очереди топологии по именам, указанным в топологии.
+        """
+        names = await apply_async(self.channel, topology, self.amqp_url)
+        return {
+            name: await self.channel.get_queue(declared, ensure=False)
+            for name, declared in names.items()
+        }
+
+    @property
+    def stopping(self) -> bool:
+        """Запрошена ли остановка consumer'ов клиента."""
+        return self._stop_requested_at is not None
+
+    def install_signal_handlers(
+            self,
+            signals: tuple[int, ...] = (signal.SIGTERM, signal.SIGINT),
+            shutdown_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Останавливает consumer'ов клиента по сигналам вместо завершения процесса.
+
+        Обработчики снимаются в disconnect.
+
+        :param signals: Сигналы, по которым запрашивается остановка.
+        :param shutdown_timeout: Сколько секунд ждать завершения обрабатываемых сообщений.
+        """
+        if shutdown_timeout is not None:
+            self.shutdown_timeout = shutdown_timeout
+        loop = asyncio.get_running_loop()
+        for signum in signals:
+            loop.add_signal_handler(signum, self.request_shutdown)
+        self._signals = signals
+
+    def remove_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signum in self._signals:
+            loop.remove_signal_handler(signum)
+        self._signals = ()
+
+    def request_shutdown(self) -> None:
+        """
+        Запрашивает остановку всех consume клиента.
+
+        Новые сообщения перестают передаваться обработчикам, consumer отменяется, а срок
+        shutdown_timeout на завершение обрабатываемых сообщений отсчитывается с этого момента.
+        """
+        if self.stopping:
+            return
+        logger.info("Shutdown requested, stopping consumers")
+        self._stop_requested_at = asyncio.get_running_loop().time()
+        self._stop_event.set()
+        for buffer in self._buffers:
+            buffer.put_nowait(None)
+
     async def consume(
+            self,
             queue: AbstractQueue,
             on_message_callback: Callable[[AbstractIncomingMessage], Awaitable[Any]],
             auto_ack: bool = False,
@@ -130,9 +254,21 @@ class QueueRabbitClient(RabbitMQClient):
             arguments: Arguments = None,
             consumer_tag: Optional[ConsumerTag] = None,
             timeout: TimeoutType = None,
-    ):
+            max_in_flight: Optional[int] = None,
+            prefetch_controller: Optional[AdaptivePrefetch] = None,
+            dedup_store: Optional[DedupStore] = None,
+            stop_event: Optional[asyncio.Event] = None,
+    ) -> ShutdownReport:
         """
-        Начинает обработку сообщений из очереди.
+        Начинает обработку сообщений из очереди и работает до запроса остановки.
+
+        Если max_in_flight больше 1, каждое сообщение обрабатывается в отдельной задаче,
+        а количество одновременно выполняемых задач ограничено семафором.
+
+        При остановке (request_shutdown, сигнал, stop_event или отмена задачи) consumer отменяется,
+        полученные, но не начатые сообщения возвращаются в очередь, а обрабатываемые
+        получают shutdown_timeout секунд на завершение. Не успевшие обработчики отменяются,
+        их неподтверждённые сообщения возвращаются в очередь.
 
         :param queue: Объект AbstractQueue, из которого будут потребляться сообщения.
         :param on_message_callback: Асинхронная функция обратного вызова для обработки сообщений.
@@ -141,31 +277,582 @@ class QueueRabbitClient(RabbitMQClient):
         :param arguments: Дополнительные аргументы для конфигурации потребителя.
         :param consumer_tag: Уникальный идентификатор потребителя (по умолчанию None).
         :param timeout: Максимальное время ожидания для регистрации потребителя.
+        :param max_in_flight: Лимит одновременно обрабатываемых сообщений (по умолчанию равен prefetch_count,
+            при prefetch_count=0 не ограничен).
+        :param prefetch_controller: Если задан, prefetch_count подстраивается под время обработки сообщений
+            и задержку до брокера, а max_in_flight остаётся неизменным. Начальный prefetch_count
+            задаётся для всего канала (global), лимит consumer'ов канала снимается.
+        :param dedup_store: Если задан, повторные доставки уже обработанных сообщений подтверждаются
+            без вызова обработчика.
+        :param stop_event: Событие остановки только этого consumer'а; остальные consume клиента продолжают работу.
+        :return: ShutdownReport - сколько сообщений обработано и сколько возвращено в очередь при остановке.
         """
-        # Создаём итератор очереди с переданными параметрами
-        message: AbstractIncomingMessage
+        max_in_flight = self._in_flight_limit(max_in_flight)
+        semaphore = asyncio.Semaphore(max_in_flight)
+        report = ShutdownReport()
+        cancelled = False
+        in_flight: set[asyncio.Task] = set()
+
+        def stopped() -> bool:
+            return self.stopping or (stop_event is not None and stop_event.is_set())
+
+        if prefetch_controller is not None:
+            prefetch_controller.concurrency = max_in_flight
+            # RabbitMQ применяет и лимит consumer'а, и лимит канала. Контроллер меняет лимит канала,
+            # поэтому лимит consumer'а (set_prefetch) снимается до подписки, иначе prefetch не вырастет выше него.
+            await self.channel.set_qos(prefetch_count=0)
+            await self._apply_prefetch(prefetch_controller, self.prefetch_count)
+
+        process = self._pipeline(queue.name, on_message_callback, auto_ack, dedup_store)
+
+        async def handle(incoming: AbstractIncomingMessage) -> None:
+            started = time.perf_counter()
+            try:
+                await process(incoming)
+                if prefetch_controller is not None:
+                    prefetch_controller.observe(time.perf_counter() - started)
+                    prefetch_count = prefetch_controller.suggest()
+                    if prefetch_count is not None:
+                        # Ссылка на задачу хранится, чтобы её не собрал сборщик мусора до завершения.
+                        self._prefetch_task = asyncio.create_task(
+                            self._apply_prefetch(prefetch_controller, prefetch_count)
+                        )
+            except asyncio.CancelledError:
+                # Обработчик не успел к сроку остановки: сообщение возвращается в очередь.
+                await self._return(incoming, auto_ack, report)
+                raise
+            except Exception:
+                logger.exception("Error processing message from %s", queue.name)
+            finally:
+                semaphore.release()
+            if stopped():
+                report.drained += 1
+
+        buffer: asyncio.Queue[Optional[AbstractIncomingMessage]] = asyncio.Queue()
+
+        async def on_message(incoming: AbstractIncomingMessage) -> None:
+            if cancelled:
+                # Доставка пришла после отмены consumer'а.
+                await self._return(incoming, auto_ack, report)
+                return
+            buffer.put_nowait(incoming)
+
+        self._buffers.add(buffer)
+        tag = await queue.consume(
+            on_message,
+            no_ack=auto_ack,
+            exclusive=exclusive,
+            arguments=arguments,
+            consumer_tag=consumer_tag,
+            timeout=timeout,
+        )
+        if stopped():
+            buffer.put_nowait(None)
+        watcher = None
+        if stop_event is not None:
+            watcher = asyncio.create_task(stop_event.wait())
+            watcher.add_done_callback(lambda _: buffer.put_nowait(None))
+
+        message: Optional[AbstractIncomingMessage]
         try:
-            async with queue.iterator(
-                    no_ack=auto_ack,
-                    exclusive=exclusive,
-                    arguments=arguments,
-                    consumer_tag=consumer_tag,
-                    timeout=timeout
-            ) as queue_iter:
-                async for message in queue_iter:
-                    try:
-                        await on_message_callback(message)
-                    except Exception as e:
-                        logger.exception(f"Error processing message: {e}")
+            while True:
+                if not semaphore.locked():
+                    await semaphore.acquire()
+                elif not await self._acquire_unless_stopped(semaphore, stop_event):
+                    break
+                message = None if stopped() else await buffer.get()
+                if message is None or stopped():
+                    semaphore.release()
+                    if message is not None:
+                        buffer.put_nowait(message)
+                    break
+                if max_in_flight <= 1:
+                    await handle(message)
+                    continue
+                task = asyncio.create_task(handle(message))
+                self._in_flight.add(task)
+                in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+                task.add_done_callback(in_flight.discard)
 
         except Exception as e:
             logger.exception(e)
             raise e
+        finally:
+            self._buffers.discard(buffer)
+            cancelled = True
+            if watcher is not None:
+                watcher.cancel()
+            if not self.channel.is_closed:
+                await queue.cancel(tag)
+                # Доставки, полученные до Basic.CancelOk, передаются в on_message отдельными задачами.
+                await asyncio.sleep(0)
+            while not buffer.empty():
+                message = buffer.get_nowait()
+                if message is not None:
+                    await self._return(message, auto_ack, report)
+            await self._drain_until_deadline(in_flight)
+            logger.info(
+                "Consumer %s stopped: %d messages drained, %d returned to the queue",
+                tag, report.drained, report.returned,
+            )
+        return report
+
+    async def consume_shards(
+            self,
+            sharding: Sharding,
+            on_message_callback: Callable[[AbstractIncomingMessage], Awaitable[Any]],
+            member_id: Optional[str] = None,
+            heartbeat_interval: float = 5.0,
+            member_ttl: Optional[float] = None,
+            dedup_store: Optional[DedupStore] = None,
+    ) -> ShutdownReport:
+        """
+        Обрабатывает сообщения из шардов, назначенных этому экземпляру, до запроса остановки.
+
+        Каждый шард обрабатывается отдельным consume с max_in_flight=1, поэтому сообщения
+        одного ключа обрабатываются по порядку, а разные шарды - параллельно. Когда шард
+        переходит к другому экземпляру, его consumer дожидается текущего обработчика и
+        возвращает полученные сообщения в очередь, после чего шард забирает новый владелец.
+
+        :param sharding: Описание шардированной очереди.
+        :param on_message_callback: Асинхронная функция обратного вызова для обработки сообщений.
+        :param member_id: Идентификатор экземпляра в группе (по умолчанию случайный).
+        :param heartbeat_interval: Интервал рассылки heartbeat'ов в секундах.
+        :param member_ttl: Через сколько секунд без heartbeat'а участник считается ушедшим (по умолчанию три интервала).
+        :param dedup_store: Если задан, повторные доставки уже обработанных сообщений подтверждаются
+            без вызова обработчика.
+        :return: ShutdownReport - суммарно по шардам, принадлежавшим экземпляру при остановке.
+        """
+        membership = ShardMembership(member_id, ttl=member_ttl or 3 * heartbeat_interval)
+        queues = await self.declare_topology(sharding.topology())
+        members_queue = (await self.declare_topology(sharding.membership_topology()))[""]
+        members_exchange = await self.channel.get_exchange(sharding.members_exchange, ensure=False)
+        consumers: dict[int, tuple[asyncio.Event, asyncio.Task]] = {}
+        changed = asyncio.Event()
+        changed.set()
+
+        async def on_membership(message: AbstractIncomingMessage) -> None:
+            if membership.handle(message.body):
+                changed.set()
+
+        async def rebalance() -> None:
+            assigned = set(membership.assigned(sharding))
+            released = [consumers.pop(shard) for shard in sorted(set(consumers) - assigned)]
+            for stop, _ in released:
+                stop.set()
+            await asyncio.gather(*(task for _, task in released), return_exceptions=True)
+            for shard in sorted(assigned - set(consumers)):
+                stop = asyncio.Event()
+                task = asyncio.create_task(self.consume(
+                    queues[sharding.queue_name(shard)],
+                    on_message_callback,
+                    max_in_flight=1,
+                    dedup_store=dedup_store,
+                    stop_event=stop,
+                ))
+                consumers[shard] = (stop, task)
+            logger.info(
+                "Member %s of %d owns shards %s", membership.member_id, len(membership.members), sorted(consumers),
+            )
+
+        tag = await members_queue.consume(on_membership, no_ack=True)
+        try:
+            while not self.stopping:
+                await members_exchange.publish(Message(membership.heartbeat()), routing_key="")
+                if membership.expire():
+                    changed.set()
+                if changed.is_set():
+                    changed.clear()
+                    await rebalance()
+                waiters = {asyncio.ensure_future(changed.wait()), asyncio.ensure_future(self._stop_event.wait())}
+                try:
+                    await asyncio.wait(waiters, timeout=heartbeat_interval, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+        finally:
+            for stop, _ in consumers.values():
+                stop.set()
+            results = await asyncio.gather(*(task for _, task in consumers.values()), return_exceptions=True)
+            if not self.channel.is_closed:
+                await members_queue.cancel(tag)
+                # Остальные экземпляры сразу забирают шарды, не дожидаясь истечения member_ttl.
+                await members_exchange.publish(Message(membership.leave()), routing_key="")
+        report = ShutdownReport()
+        for result in results:
+            if isinstance(result, ShutdownReport):
+                report.drained += result.drained
+                report.returned += result.returned
+        return report
+
+    async def consume_many(
+            self,
+            sources: Iterable[QueueSource],
+            max_in_flight: Optional[int] = None,
+    ) -> ShutdownReport:
+        """
+        Обрабатывает сообщения нескольких очередей с общим лимитом до запроса остановки.
+
+        Свободные слоты обработки распределяются между очередями по priority, weight и
+        max_concurrency источников (см. модуль `asyncmq.scheduler`), например живой трафик
+        обрабатывается в первую очередь, а dead letter очередь - только свободными слотами.
+
+        :param sources: Очереди, их обработчики и параметры планирования.
+        :param max_in_flight: Общий лимит одновременно обрабатываемых сообщений (по умолчанию равен prefetch_count,
+            при prefetch_count=0 не ограничен).
+        :return: ShutdownReport - сколько сообщений обработано и сколько возвращено в очередь при остановке.
+        """
+        sources = list(sources)
+        max_in_flight = self._in_flight_limit(max_in_flight)
+        scheduler: WeightedFairScheduler[AbstractIncomingMessage] = WeightedFairScheduler()
+        for index, source in enumerate(sources):
+            scheduler.add(index, source.priority, source.weight, source.max_concurrency)
+        processes = [
+            self._pipeline(source.queue.name, source.on_message_callback, source.auto_ack, source.dedup_store)
+            for source in sources
+        ]
+        report = ShutdownReport()
+        cancelled = False
+        in_flight: set[asyncio.Task] = set()
+        wakeup = asyncio.Event()
+
+        async def on_message(index: int, incoming: AbstractIncomingMessage) -> None:
+            if cancelled:
+                # Доставка пришла после отмены consumer'а.
+                await self._return(incoming, sources[index].auto_ack, report)
+                return
+            scheduler.push(index, incoming, incoming.priority or 0)
+            wakeup.set()
+
+        async def handle(index: int, incoming: AbstractIncomingMessage) -> None:
+            try:
+                await processes[index](incoming)
+            except asyncio.CancelledError:
+                # Обработчик не успел к сроку остановки: сообщение возвращается в очередь.
+                await self._return(incoming, sources[index].auto_ack, report)
+                raise
+            except Exception:
+                logger.exception("Error processing message from %s", sources[index].queue.name)
+            finally:
+                scheduler.done(index)
+                wakeup.set()
+            if self.stopping:
+                report.drained += 1
+
+        tags = []
+        try:
+            for index, source in enumerate(sources):
+                tags.append(await source.queue.consume(functools.partial(on_message, index), no_ack=source.auto_ack))
+            while not self.stopping:
+                picked = scheduler.pop() if scheduler.in_flight() < max_in_flight else None
+                if picked is None:
+                    wakeup.clear()
+                    waiters = {asyncio.ensure_future(wakeup.wait()), asyncio.ensure_future(self._stop_event.wait())}
+                    try:
+                        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        for waiter in waiters:
+                            waiter.cancel()
+                    continue
+                index, message = picked
+                task = asyncio.create_task(handle(index, message))
+                self._in_flight.add(task)
+                in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+                task.add_done_callback(in_flight.discard)
+        finally:
+            cancelled = True
+            if not self.channel.is_closed:
+                for source, tag in zip(sources, tags):
+                    await source.queue.cancel(tag)
+                # Доставки, полученные до Basic.CancelOk, передаются в on_message отдельными задачами.
+                await asyncio.sleep(0)
+            for index, message in scheduler.drain():
+                await self._return(message, sources[index].auto_ack, report)
+            await self._drain_until_deadline(in_flight)
+            logger.info(
+                "Consumers of %s stopped: %d messages drained, %d returned to the queue",
+                ", ".join(source.queue.name for source in sources), report.drained, report.returned,
+            )
+        return report
+
+    def _in_flight_limit(self, max_in_flight: Optional[int]) -> int:
+        """Лимит одновременно обрабатываемых сообщений: заданный или prefetch_count (0 - без ограничения)."""
+        if max_in_flight is None:
+            return self.prefetch_count or UNLIMITED_IN_FLIGHT
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        return max_in_flight
+
+    async def _apply_prefetch(self, controller: AdaptivePrefetch, prefetch_count: int) -> None:
+        """
+        Устанавливает prefetch_count, предложенный контроллером, и сообщает ему время запроса.
+
+        Лимит задаётся для всего канала (global), чтобы RabbitMQ применял его к уже запущенному consumer'у.
+        """
+        started = time.perf_counter()
+        try:
+            await self.channel.set_qos(prefetch_count=prefetch_count, global_=True)
+        except Exception as e:
+            logger.warning("Failed to change prefetch to %d: %s", prefetch_count, e)
+            controller.applied(None)
+            return
+        self.prefetch_count = prefetch_count
+        controller.applied(prefetch_count, rtt=time.perf_counter() - started)
+
+    async def _acquire_unless_stopped(
+            self,
+            semaphore: asyncio.Semaphore,
+            stop_event: Optional[asyncio.Event] = None,
+    ) -> bool:
+        """Ждёт свободный слот обработки, прерываясь при запросе остановки."""
+        acquire = asyncio.ensure_future(semaphore.acquire())
+        stops = {asyncio.ensure_future(event.wait()) for event in (self._stop_event, stop_event) if event is not None}
+        try:
+            await asyncio.wait({acquire, *stops}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for stop in stops:
+                stop.cancel()
+            if not acquire.done():
+                acquire.cancel()
+        if acquire.cancelled():
+            return False
+        if self.stopping or (stop_event is not None and stop_event.is_set()):
+            semaphore.release()
+            return False
+        return True
+
+    @staticmethod
+    async def _return(message: AbstractIncomingMessage, auto_ack: bool, report: ShutdownReport) -> None:
+        """Возвращает неподтверждённое сообщение в очередь при остановке."""
+        if auto_ack:
+            logger.warning("Message %s lost on shutdown: consumer uses auto_ack", message.delivery_tag)
+            return
+        if message.processed:
+            return
+        try:
+            await message.nack(requeue=True)
+        except Exception as e:
+            # Канал закрыт: брокер сам вернёт неподтверждённое сообщение в очередь.
+            logger.debug("Could not return message %s: %r", message.delivery_tag, e)
+            return
+        report.returned += 1
+
+    async def _drain_until_deadline(self, tasks: Optional[set[asyncio.Task]] = None) -> None:
+        """
+        Ждёт обрабатываемые сообщения не дольше shutdown_timeout с момента запроса остановки, остальные отменяет.
+
+        :param tasks: Задачи обработчиков (по умолчанию все задачи клиента).
+        """
+        tasks = set(self._in_flight if tasks is None else tasks)
+        if not tasks:
+            return
+        loop = asyncio.get_running_loop()
+        started = self._stop_requested_at if self._stop_requested_at is not None else loop.time()
+        remaining = max(0.0, started + self.shutdown_timeout - loop.time())
+        logger.info("Waiting up to %.1fs for %d in-flight messages", remaining, len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=remaining)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("%d handlers did not finish in time and were cancelled", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def consume_batches(
+            self,
+            queue: AbstractQueue,
+            batch_handler: Callable[
+                [list[AbstractIncomingMessage]], Awaitable[Optional[Iterable[AbstractIncomingMessage]]]
+            ],
+            max_batch: int = 100,
+            max_wait_ms: int = 50,
+            requeue_failed: bool = False,
+            consumer_tag: Optional[ConsumerTag] = None,
+    ):
+        """
+        Обрабатывает сообщения из очереди пакетами.
+
+        Пакет передаётся обработчику, когда набрано max_batch сообщений или с момента получения
+        первого сообщения пакета прошло max_wait_ms. Обработчик возвращает неудачные сообщения
+        (или None), они отклоняются через nack, остальные подтверждаются одним ack(multiple=True).
+        Если обработчик выбросил исключение, отклоняется весь пакет.
+
+        Канал не должен использоваться другими consumer'ами: ack с multiple=True подтверждает
+        все сообщения канала до последнего тега пакета.
+
+        :param queue: Объект AbstractQueue, из которого будут потребляться сообщения.
+        :param batch_handler: Асинхронный обработчик пакета, возвращающий неудачные сообщения.
+        :param max_batch: Максимальный размер пакета, также используется как prefetch_count.
+        :param max_wait_ms: Максимальное время накопления пакета в миллисекундах.
+        :param requeue_failed: Возвращать ли неудачные сообщения в очередь (по умолчанию False).
+        :param consumer_tag: Уникальный идентификатор потребителя (по умолчанию None).
+        """
+        await self.set_prefetch(prefetch_count=max_batch)
+        max_wait = max_wait_ms / 1000
+        loop = asyncio.get_running_loop()
+        batch: list[AbstractIncomingMessage] = []
+
+        metrics = get_metrics()
+
+        async def flush() -> None:
+            metrics.delivered.inc(len(batch), queue=queue.name)
+            started = time.perf_counter()
+            try:
+                failed = await batch_handler(batch) or ()
+            except Exception:
+                logger.exception("Error processing batch of %d messages from %s", len(batch), queue.name)
+                metrics.handler_errors.inc(queue=queue.name)
+                failed = batch
+            metrics.handler_seconds.observe(time.perf_counter() - started, queue=queue.name)
+            await self._settle_batch(batch, failed, requeue_failed, queue.name)
+            batch.clear()
+
+        async with queue.iterator(consumer_tag=consumer_tag) as queue_iter:
+            try:
+                while True:
+                    message = await self._decompress(await queue_iter.__anext__(), False, queue.name)
+                    if message is None:
+                        continue
+                    batch.append(message)
+                    deadline = loop.time() + max_wait
+                    while len(batch) < max_batch:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            incoming = await asyncio.wait_for(queue_iter.__anext__(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+                        message = await self._decompress(incoming, False, queue.name)
+                        if message is not None:
+                            batch.append(message)
+                    await flush()
+            except StopAsyncIteration:
+                pass
+            finally:
+                if batch:
+                    await flush()
+
+    def _pipeline(
+            self,
+            queue_name: str,
+            on_message_callback: Callable[[AbstractIncomingMessage], Awaitable[Any]],
+            auto_ack: bool,
+            dedup_store: Optional[DedupStore] = None,
+    ) -> Callable[[AbstractIncomingMessage], Awaitable[None]]:
+        """Оборачивает обработчик распаковкой, дедупликацией, трассировкой и метриками."""
+        metrics = get_metrics()
+
+        async def instrumented(incoming: AbstractIncomingMessage) -> None:
+            if metrics.enabled:
+                await self._call_instrumented(on_message_callback, incoming, queue_name, metrics)
+            else:
+                await on_message_callback(incoming)
+
+        traced = traced_async(instrumented, queue=queue_name)
+
+        async def process(incoming: AbstractIncomingMessage) -> None:
+            message = await self._decompress(incoming, auto_ack, queue_name)
+            if message is None:
+                return
+            if dedup_store is not None:
+                await call_deduplicated(traced, message, dedup_store, auto_ack=auto_ack, queue=queue_name)
+            else:
+                await traced(message)
+
+        return process
+
+    @staticmethod
+    async def _decompress(
+            message: AbstractIncomingMessage,
+            auto_ack: bool,
+            queue_name: str,
+    ) -> Optional[AbstractIncomingMessage]:
+        """
+        Сообщение с распакованным телом для обработчика.
+
+        IncomingMessage не изменяется: распакованное тело передаётся обёрткой `delivery.SettleHooksMessage`,
+        к которой следующие слои добавляют свои хуки. Сообщение, которое не удалось распаковать,
+        отклоняется без возврата в очередь, и возвращается None.
+        """
+        if not message.content_encoding:
+            return message
+        try:
+            body = decompress(message.body, message.content_encoding)
+        except DecompressionError as e:
+            logger.error("Rejecting message %s from %s: %s", message.delivery_tag, queue_name, e)
+            if not auto_ack:
+                await message.reject(requeue=False)
+            return None
+        return SettleHooksMessage(message, body=body)  # type: ignore[return-value]
+
+    @staticmethod
+    async def _settle_batch(
+            batch: list[AbstractIncomingMessage],
+            failed: Iterable[AbstractIncomingMessage],
+            requeue_failed: bool,
+            queue_name: str = "",
+    ) -> None:
+        """Отклоняет неудачные сообщения пакета и подтверждает остальные одним ack(multiple=True)."""
+        metrics = get_metrics()
+        failed_tags = {message.delivery_tag for message in failed}
+        for message in batch:
+            if message.delivery_tag in failed_tags:
+                await message.nack(requeue=requeue_failed)
+                metrics.record_settle("nack", requeue_failed, queue=queue_name)
+        last_ok = next((message for message in reversed(batch) if message.delivery_tag not in failed_tags), None)
+        if last_ok is not None:
+            await last_ok.ack(multiple=True)
+            metrics.acked.inc(len(batch) - len(failed_tags), queue=queue_name)
+
+    @staticmethod
+    async def _call_instrumented(
+            on_message_callback: Callable[[AbstractIncomingMessage], Awaitable[Any]],
+            message: AbstractIncomingMessage,
+            queue_name: str,
+            metrics: Metrics,
+    ) -> None:
+        """Вызывает обработчик, записывая метрики доставки, ожидания в очереди, времени обработки и подтверждений."""
+        metrics.delivered.inc(queue=queue_name)
+        wait = queue_wait(message.timestamp)
+        if wait is not None:
+            metrics.queue_wait_seconds.observe(wait, queue=queue_name)
+        metrics.in_flight.inc(queue=queue_name)
+        started = time.perf_counter()
+        try:
+            await on_message_callback(settle_hooks_message(message, settle_recorder(metrics, queue_name)))  # type: ignore
+        except Exception:
+            metrics.handler_errors.inc(queue=queue_name)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, queue=queue_name)
+            metrics.in_flight.dec(queue=queue_name)
+
+    async def drain(self) -> None:
+        """Дожидается завершения всех обрабатываемых в данный момент сообщений."""
+        if not self._in_flight:
+            return
+        logger.info("Waiting for %d in-flight messages", len(self._in_flight))
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def disconnect(self):
+        if self._signals:
+            self.remove_signal_handlers()
+        await self.drain()
+        await super().disconnect()
 
 
 class DeadLetterQueueClient(QueueRabbitClient):
-    def __init__(self, amqp_url: str):
-        super().__init__(amqp_url=amqp_url)
+    def __init__(
+            self,
+            amqp_url: str,
+            pool: Optional[ConnectionPool] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+    ):
+        super().__init__(amqp_url=amqp_url, pool=pool)
+        # Политика повторов через очереди задержки; без неё неудачные сообщения сразу уходят в DLX.
+        self.retry_policy = retry_policy
         # Имена для основного обменника и очереди
         self.main_exchange = "main-exchange"
         self.main_queue = "main-queue"
@@ -173,59 +860,127 @@ class DeadLetterQueueClient(QueueRabbitClient):
         self.dead_letter_exchange = "dead-letter-exchange"
         self.dead_letter_queue = "dead-letter-queue"
 
+    def topology(self) -> Topology:
+        """Основной и dead letter обменники и очереди, а также очереди задержки, если задана политика повторов."""
+        topology = (
+            Topology()
+            .exchange(self.dead_letter_exchange, ExchangeType.FANOUT, durable=True)
+            .exchange(self.main_exchange, ExchangeType.FANOUT, durable=True)
+            .queue(self.dead_letter_queue, durable=True)
+            .queue(
+                self.main_queue,
+                durable=True,
+                arguments={
+                    "x-dead-letter-exchange": self.dead_letter_exchange,
+                    "x-dead-letter-routing-key": self.dead_letter_queue
+                },
+            )
+            .bind(self.dead_letter_queue, self.dead_letter_exchange)
+            .bind(self.main_queue, self.main_exchange)
+        )
+        if self.retry_policy is not None:
+            topology = topology.merge(self.retry_topology())
+        return topology
+
+    def retry_topology(self) -> Topology:
+        """
+        Обменник повторов и очереди задержки основной очереди.
+
+        У очередей задержки нет consumer'ов: по истечении x-message-ttl сообщение
+        возвращается в основную очередь через dead-letter маршрутизацию.
+        """
+        policy = self.retry_policy
+        topology = Topology().exchange(policy.retry_exchange, ExchangeType.DIRECT, durable=True)
+        for queue_name, arguments in policy.delay_queues(self.main_queue):
+            topology.queue(queue_name, durable=True, arguments=arguments)
+            topology.bind(queue_name, policy.retry_exchange, routing_key=queue_name)
+        return topology
+
     async def setup_infrastructure(self):
-        """Настройка всей инфраструктуры очередей и обменников"""
+        """Настройка всей инфраструктуры очередей и обменников одним проходом"""
+        queues = await self.declare_topology(self.topology())
+        return queues[self.main_queue], queues[self.dead_letter_queue]
 
-        # 1. Создаем dead letter exchange
-        await self.declare_exchange(
-            exchange=self.dead_letter_exchange,
-            exchange_type=ExchangeType.FANOUT,
-            durable=True
-        )
+    async def retry(self, message: AbstractIncomingMessage) -> bool:
+        """
+        Откладывает повторную обработку сообщения основной очереди.
 
-        # 2. Создаем dead letter очередь
-        dead_letter_queue = await self.declare_queue(
-            queue=self.dead_letter_queue,
-            durable=True
-        )
+        Копия сообщения публикуется в очередь задержки следующего уровня, после чего оригинал
+        подтверждается. Если политика не задана или попытки исчерпаны, сообщение отклоняется
+        без возврата в очередь и попадает в dead letter очередь.
 
-        # 3. Привязываем dead letter очередь к dead letter exchange
-        await self.bind_queue(
-            queue=dead_letter_queue,
-            exchange_name=self.dead_letter_exchange
-        )
+        :param message: Сообщение основной очереди, обработка которого завершилась ошибкой.
+        :return: True, если повтор запланирован.
+        """
+        delay_queue = None
+        if self.retry_policy is not None:
+            delay_queue = self.retry_policy.next_delay_queue(self.main_queue, message.headers)
+        if delay_queue is None:
+            await message.nack(requeue=False)
+            return False
 
-        # 4. Создаем основной exchange
-        await self.declare_exchange(
-            exchange=self.main_exchange,
-            exchange_type=ExchangeType.FANOUT,
-            durable=True
+        exchange = await self.channel.get_exchange(self.retry_policy.retry_exchange)
+        await exchange.publish(
+            Message(
+                body=message.body,
+                headers=message.headers,
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                delivery_mode=message.delivery_mode,
+                priority=message.priority,
+                correlation_id=message.correlation_id,
+                reply_to=message.reply_to,
+                message_id=message.message_id,
+                timestamp=message.timestamp,
+                type=message.type,
+                app_id=message.app_id,
+            ),
+            routing_key=delay_queue,
         )
+        await message.ack()
+        return True
 
-        # 5. Создаем основную очередь с настройками DLX
-        main_queue = await self.declare_queue(
-            queue=self.main_queue,
-            durable=True,
-            arguments={
-                "x-dead-letter-exchange": self.dead_letter_exchange,
-                "x-dead-letter-routing-key": self.dead_letter_queue
-            }
-        )
+    def retrying(
+            self, on_message_callback: Callable[[AbstractIncomingMessage], Awaitable[Any]],
+    ) -> Callable[[AbstractIncomingMessage], Awaitable[Any]]:
+        """Оборачивает обработчик основной очереди: при исключении сообщение отправляется на повтор."""
 
-        # 6. Привязываем основную очередь к основному exchange
-        await self.bind_queue(
-            queue=main_queue,
-            exchange_name=self.main_exchange
-        )
+        async def wrapper(message: AbstractIncomingMessage) -> None:
+            try:
+                await on_message_callback(message)
+            except Exception:
+                # Если обработчик уже подтвердил или отклонил сообщение, повтор создал бы копию.
+                if not message.processed:
+                    await self.retry(message)
+                raise
 
-        return main_queue, dead_letter_queue
+        return wrapper
 
-    async def run(self, main_callback, dead_letter_callback):
-        """Запуск обработки сообщений"""
+    async def run(
+            self,
+            main_callback,
+            dead_letter_callback,
+            dedup_store: Optional[DedupStore] = None,
+            max_in_flight: Optional[int] = None,
+    ) -> ShutdownReport:
+        """
+        Запуск обработки сообщений.
+
+        Основная очередь обрабатывается в первую очередь, dead letter очередь - только слотами,
+        которые не заняты сообщениями основной очереди.
+        Если задан dedup_store, повторные доставки уже обработанных сообщений основной очереди
+        подтверждаются без вызова обработчика.
+
+        :param max_in_flight: Общий лимит одновременно обрабатываемых сообщений обеих очередей
+            (по умолчанию равен prefetch_count).
+        """
         main_queue, dead_letter_queue = await self.setup_infrastructure()
 
-        # Запускаем обработчики для обеих очередей
-        await asyncio.gather(
-            # self.consume(main_queue, main_callback),
-            self.consume(dead_letter_queue, dead_letter_callback)
-        )
\ No newline at end of file
+        # Ошибки основного обработчика уходят на повтор
+        return await self.consume_many(
+            [
+                QueueSource(main_queue, self.retrying(main_callback), priority=1, dedup_store=dedup_store),
+                QueueSource(dead_letter_queue, dead_letter_callback, priority=0),
+            ],
+            max_in_flight=max_in_flight,
+        )
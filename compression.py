@@ -0,0 +1,135 @@
+"""
+Сжатие тел сообщений с указанием алгоритма в свойстве content_encoding.
+
+При публикации тело сжимается, только если его размер не меньше порога, при получении
+тело распаковывается по content_encoding. Используется и pika, и aio_pika клиентами.
+
+Сжатие включается publisher'ом явно (compression=None по умолчанию). Алгоритм по умолчанию -
+deflate: его распакует любой consumer, а zstd и lz4 требуют установленных библиотек у всех
+получателей. Сообщение с алгоритмом, который consumer не умеет распаковывать, не передаётся
+обработчику, а отклоняется без возврата в очередь (уходит в dead letter, если он настроен).
+"""
+import functools
+import logging
+import zlib
+from typing import TYPE_CHECKING, Callable, Optional
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+if TYPE_CHECKING:
+    from pika.adapters.blocking_connection import BlockingChannel
+    from pika.spec import Basic, BasicProperties
+
+logger = logging.getLogger(__name__)
+
+ENCODING_IDENTITY = "identity"
+ENCODING_DEFLATE = "deflate"
+ENCODING_LZ4 = "lz4"
+ENCODING_ZSTD = "zstd"
+
+# Сообщения меньше порога не сжимаются: выигрыш меньше затрат на сжатие.
+DEFAULT_MIN_SIZE = 1024
+
+_compressors: dict[str, Callable[[bytes], bytes]] = {
+    ENCODING_DEFLATE: functools.partial(zlib.compress, level=6),
+}
+_decompressors: dict[str, Callable[[bytes], bytes]] = {
+    ENCODING_DEFLATE: zlib.decompress,
+}
+
+if lz4_frame is not None:
+    _compressors[ENCODING_LZ4] = lz4_frame.compress
+    _decompressors[ENCODING_LZ4] = lz4_frame.decompress
+
+if zstandard is not None:
+    _compressors[ENCODING_ZSTD] = zstandard.ZstdCompressor().compress
+    _decompressors[ENCODING_ZSTD] = zstandard.ZstdDecompressor().decompress
+
+# Алгоритм, который распакует consumer без дополнительных библиотек. zstd и lz4 быстрее,
+# но выбирать их нужно явно, когда они установлены у всех consumer'ов.
+DEFAULT_ENCODING = ENCODING_DEFLATE
+
+
+class DecompressionError(ValueError):
+    """Тело не удалось распаковать: алгоритм недоступен или данные повреждены."""
+
+
+class UnsupportedEncodingError(DecompressionError):
+    """Тело сжато алгоритмом, который недоступен в этом процессе."""
+
+
+def compress(
+        body: bytes,
+        encoding: Optional[str] = DEFAULT_ENCODING,
+        min_size: int = DEFAULT_MIN_SIZE,
+) -> tuple[bytes, Optional[str]]:
+    """
+    Сжимает тело сообщения.
+
+    :param body: Тело сообщения.
+    :param encoding: Алгоритм сжатия (None - не сжимать).
+    :param min_size: Минимальный размер тела для сжатия.
+    :return: Тело и content_encoding (None, если тело не сжималось).
+    """
+    if encoding is None or len(body) < min_size:
+        return body, None
+    compressor = _compressors.get(encoding)
+    if compressor is None:
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    compressed = compressor(body)
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, encoding
+
+
+def decompress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """
+    Распаковывает тело сообщения по content_encoding.
+
+    Тела без content_encoding (или с identity) возвращаются без изменений.
+
+    :raises UnsupportedEncodingError: Алгоритм неизвестен или его библиотека не установлена.
+    :raises DecompressionError: Данные повреждены (ошибка zlib, lz4 или zstd).
+    """
+    if not content_encoding or content_encoding == ENCODING_IDENTITY:
+        return body
+    decompressor = _decompressors.get(content_encoding)
+    if decompressor is None:
+        raise UnsupportedEncodingError(f"Unsupported content encoding: {content_encoding}")
+    try:
+        return decompressor(body)
+    except Exception as e:
+        # У каждой библиотеки свои исключения (zlib.error, RuntimeError lz4, ZstdError).
+        raise DecompressionError(f"Corrupt {content_encoding} body: {e}") from e
+
+
+def decompressing(
+        on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+        auto_ack: bool = False,
+) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None]:
+    """
+    Оборачивает pika callback так, чтобы он получал уже распакованное тело.
+
+    Сообщение, которое не удалось распаковать, отклоняется без возврата в очередь
+    (при auto_ack - только записывается в лог), обработчик не вызывается.
+    """
+    @functools.wraps(on_message_callback)
+    def wrapper(channel, method, properties, body):
+        try:
+            body = decompress(body, properties.content_encoding)
+        except DecompressionError as e:
+            logger.error("Rejecting message %s: %s", method.delivery_tag, e)
+            if not auto_ack:
+                channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            return None
+        return on_message_callback(channel, method, properties, body)
+
+    return wrapper
@@ -2,13 +2,14 @@ import logging
 import os
 import sys
 import time
-from typing import Callable
+from typing import Callable, Optional
 
 import random
 from pika.adapters.blocking_connection import BlockingChannel
 from pika.spec import Basic, BasicProperties
 
 from consumers_models.consumer_base import RabbitMQClientBase
+from prefetch import AdaptivePrefetch, adaptive_prefetch
 from rabbitmq_conf import config_logging
 
 logger = logging.getLogger(__name__)
@@ -52,9 +53,16 @@ def consume_messages(
         queue_name: str,
         on_message_callback: Callable,
         auto_ack: bool = False,  # подтверждаем выполнение задачи автоматически если True.
+        prefetch_controller: Optional[AdaptivePrefetch] = None,
 ) -> None:
     """Обрабатывает сообщения из очереди."""
-    channel.basic_qos(prefetch_count=2)  # лимитируем сообщения из очереди.
+    if prefetch_controller is None:
+        channel.basic_qos(prefetch_count=2)  # лимитируем сообщения из очереди.
+    else:
+        # Начинаем с 2 сообщений, дальше лимит на весь канал подстраивается под время обработки.
+        channel.basic_qos(prefetch_count=2, global_qos=True)
+        prefetch_controller.applied(2)
+        on_message_callback = adaptive_prefetch(on_message_callback, prefetch_controller)
     # Удаление устойчивой очереди
     channel.queue_delete(queue='test')
     
@@ -97,6 +105,7 @@ def main() -> None:
             channel=mq_client.channel,
             on_message_callback=process_new_msg,
             queue_name="test",
+            prefetch_controller=AdaptivePrefetch(min_prefetch=1, max_prefetch=10),
         )
 
 
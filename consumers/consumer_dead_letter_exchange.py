@@ -3,8 +3,12 @@ import random
 import time
 
 from consumers_models.consumer_email_simple_dead_letter_exchange import RabbitMQWithDeadLetters
+from rabbitmq_conf import EventLogger, config_logging
+from retry_policy import RetryPolicy
 
 logger = logging.getLogger(__name__)
+# Успешные обработки пишутся выборочно: на потоке сообщений они составляют основную часть логов.
+events = EventLogger(logger, sample_rates={"message_processed": 0.1})
 
 
 def process_main_message(channel, method, properties, body):
@@ -16,31 +20,32 @@ def process_main_message(channel, method, properties, body):
         if random.random() > 0.5:
             raise Exception("Симуляция ошибки обработки")
 
-        logger.info(f"Успешно обработано сообщение: {body}")
+        events.info("message_processed", body=body)
         channel.basic_ack(delivery_tag=method.delivery_tag)
 
     except Exception as e:
-        logger.error(f"Ошибка обработки сообщения: {e}")
-        # Отправляем в dead letter очередь
-        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        logger.error("Ошибка обработки сообщения: %s", e)
+        # Сообщение не возвращается в очередь сразу: client.retrying отправит его
+        # в очередь задержки, а после исчерпания попыток - в dead letter очередь
+        raise
 
 
 def process_dead_letter(channel, method, properties, body):
     """Обработчик для dead letter очереди"""
     try:
-        logger.warning(f"Обработка сообщения из dead letter очереди: {body}")
+        events.warning("dead_letter_received", body=body)
         # Здесь может быть логика для обработки "мертвых" сообщений
         # Например, сохранение в БД, отправка уведомления и т.д.
 
         channel.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
-        logger.error(f"Ошибка обработки dead letter сообщения: {e}")
+        logger.error("Ошибка обработки dead letter сообщения: %s", e)
         # В случае ошибки можно решить, нужно ли пытаться еще раз
         channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
 
 def main():
-    client = RabbitMQWithDeadLetters()
+    client = RabbitMQWithDeadLetters(retry_policy=RetryPolicy(delays_ms=(1_000, 5_000, 30_000)))
 
     with client:
         client.run(
@@ -50,5 +55,5 @@ def main():
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
+    config_logging(background=True)
     main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import logging
+import sys
+import os
+
+from pika.adapters.blocking_connection import BlockingChannel
+from pika.spec import Basic, BasicProperties
+
+from consumers_models.consumer_email_update_kyc import EmailUpdateRabbit
+from rabbitmq_conf import config_logging
+
+logger = logging.getLogger(__name__)
+
+
+def process_update(
+        channel: "BlockingChannel",
+        method: "Basic.Deliver",
+        properties: "BasicProperties",
+        body: bytes,
+):
+    # Обновления одного пользователя приходят из одного шарда по порядку.
+    logger.info("Шард %s, тело %s", method.routing_key, body)
+    channel.basic_ack(delivery_tag=method.delivery_tag)  # type: ignore
+
+
+def main() -> None:
+    config_logging()
+    with EmailUpdateRabbit() as mq_email:
+        # Запустите несколько экземпляров: шарды распределятся между ними
+        # и перераспределятся, когда экземпляр остановится.
+        mq_email.consume_shards(
+            sharding=mq_email.email_update_sharding(),
+            on_message_callback=process_update,
+            prefetch_count=4,
+        )
+
+
+if __name__ == '__main__':
+    try:
+        logging.basicConfig(level=logging.INFO)
+        main()
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)  # noqa
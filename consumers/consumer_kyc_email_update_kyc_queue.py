@@ -7,6 +7,7 @@ from pika.adapters.blocking_connection import BlockingChannel
 from pika.spec import Basic, BasicProperties
 
 from consumers_models.consumer_email_update_kyc import EmailUpdateRabbit
+from message_view import MessageView, viewing
 from rabbitmq_conf import MQ_EMAIL_NAME_UPDATE_QUEUE_KYC, config_logging
 
 logger = logging.getLogger(__name__)
@@ -16,11 +17,12 @@ def process_new_msg(
         channel: "BlockingChannel",
         method: "Basic.Deliver",
         properties: "BasicProperties",
-        body: bytes,
+        body: MessageView,
 ):
     logging.debug("Канал %s", channel)
     logging.debug("Метод %s", method)
     logging.debug("Свойства %s", properties)
+    # Для лога декодируется только начало тела и только если запись выводится.
     logging.info("Тело %s", body)
     time.sleep(4)  # задержка для отладки: какой-то долгий процесс.
 
@@ -32,10 +34,12 @@ def main() -> None:
     config_logging()
     with EmailUpdateRabbit() as mq_email:
         mq_email.consume_messages(
-            on_message_callback=process_new_msg,
+            on_message_callback=viewing(process_new_msg),
             queue_name=MQ_EMAIL_NAME_UPDATE_QUEUE_KYC,
             exclusive=False,
             # привязывается только к одному подключению и будет автоматически удалена, когда это подключение закроется.
+            prefetch_count=4,
+            threaded=True,  # обработчик выполняется в пуле потоков, heartbeat'ы не блокируются.
         )
 
 
@@ -0,0 +1,38 @@
+import logging
+
+from consumers.consumer_with_dead_letter_exchange import process_new_msg
+from consumers_models.consumer_email_simple_dead_letter_exchange import MQDeadLetterExchangeLesson
+from consumers_models.supervisor import ConsumerSupervisor, stop_on_signal
+from rabbitmq_conf import config_logging
+
+logger = logging.getLogger(__name__)
+
+
+def worker_main() -> None:
+    """Точка входа процесса-воркера."""
+    config_logging()
+    with MQDeadLetterExchangeLesson() as mq_with_dead_letter_ex:
+        stop_on_signal(mq_with_dead_letter_ex)
+        mq_with_dead_letter_ex.declare_queue()
+        mq_with_dead_letter_ex.consume_messages(
+            on_message_callback=process_new_msg,
+            queue_name="main-queue",
+            exclusive=False,
+        )
+    logger.info("Воркер завершил работу")
+
+
+def main() -> None:
+    config_logging()
+    supervisor = ConsumerSupervisor(
+        worker_target=worker_main,
+        queue_name="main-queue",
+        min_workers=1,
+        max_workers=4,
+        messages_per_worker=50,
+    )
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
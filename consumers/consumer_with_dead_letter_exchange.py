@@ -9,10 +9,12 @@ from pika.spec import Basic, BasicProperties
 
 from consumers_models.consumer_email_simple_dead_letter_exchange import MQDeadLetterExchangeLesson
 
-from rabbitmq_conf import config_logging
+from rabbitmq_conf import EventLogger, config_logging
 
 # Настраиваем логгер для записи событий
 logger = logging.getLogger(__name__)
+# Успешные обработки пишутся выборочно: на потоке сообщений они составляют основную часть логов.
+events = EventLogger(logger, sample_rates={"message_processed": 0.1})
 
 
 def process_new_msg(
@@ -49,13 +51,13 @@ def process_new_msg(
 
     if random.random() > 0.5:
 
-        logger.warning(f"ЗАПРОС {body} НЕ БЫЛ УСПЕШНО ОБРАБОТАН И  НЕ был возвращен в очередь (requeue=False).")
+        events.warning("message_rejected", requeue=False, body=body)
         # channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
         channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
     else:
 
-        logger.info(f"ЗАПРОС {body} БЫЛ УСПЕШНО ОБРАБОТАН.")
+        events.info("message_processed", body=body)
         channel.basic_ack(delivery_tag=method.delivery_tag)
 
 
@@ -66,7 +68,7 @@ def main() -> None:
     Основная функция для настройки и запуска consumer для очереди сообщений RabbitMQ.
     """
     # Настройка логирования для RabbitMQ
-    config_logging()
+    config_logging(background=True)
 
     # Инициализация клиента RabbitMQ с автоматическим закрытием соединения
     with MQDeadLetterExchangeLesson() as mq_with_dead_letter_ex:
@@ -0,0 +1,125 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, NamedTuple, Optional
+
+from pika.spec import Basic, BasicProperties
+
+from compression import DecompressionError, decompress
+from metrics import get_metrics
+
+if TYPE_CHECKING:
+    from pika.adapters.blocking_connection import BlockingChannel
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery(NamedTuple):
+    """Одно доставленное сообщение в пакете."""
+    method: "Basic.Deliver"
+    properties: "BasicProperties"
+    body: bytes
+
+
+BatchHandler = Callable[["BlockingChannel", list[Delivery]], Optional[Iterable[Delivery]]]
+
+
+class BatchRabbitMixin:
+    """
+    Класс-миксин для пакетной обработки сообщений.
+
+    Сообщения накапливаются в пакеты, обработчик вызывается один раз на пакет,
+    а весь пакет подтверждается одним basic_ack(multiple=True).
+    """
+
+    channel: "BlockingChannel"
+
+    def _settle_batch(
+            self,
+            batch: list[Delivery],
+            failed: Iterable[Delivery],
+            requeue_failed: bool,
+            queue_name: str = "",
+    ) -> None:
+        """
+        Подтверждает пакет: сначала nack для неудачных сообщений, затем один ack с multiple=True.
+
+        Ack с multiple=True подтверждает все неподтверждённые сообщения канала до последнего тега,
+        поэтому уже отклонённые сообщения он не затрагивает.
+        """
+        metrics = get_metrics()
+        failed_tags = {delivery.method.delivery_tag for delivery in failed}
+        for tag in sorted(failed_tags):
+            self.channel.basic_nack(delivery_tag=tag, requeue=requeue_failed)
+            metrics.record_settle("nack", requeue_failed, queue=queue_name)
+        last_ok = next(
+            (delivery for delivery in reversed(batch) if delivery.method.delivery_tag not in failed_tags),
+            None,
+        )
+        if last_ok is not None:
+            self.channel.basic_ack(delivery_tag=last_ok.method.delivery_tag, multiple=True)
+            metrics.acked.inc(len(batch) - len(failed_tags), queue=queue_name)
+
+    def consume_batches(
+            self,
+            queue_name: str,
+            batch_handler: BatchHandler,
+            max_batch: int = 100,
+            max_wait_ms: int = 50,
+            requeue_failed: bool = False,
+    ) -> None:
+        """
+        Обрабатывает сообщения из очереди пакетами.
+
+        Пакет передаётся обработчику, когда набрано max_batch сообщений или с момента получения
+        первого сообщения пакета прошло max_wait_ms. Обработчик возвращает неудачные сообщения
+        (или None, если все обработаны), они отклоняются через basic_nack. Если обработчик
+        выбросил исключение, отклоняется весь пакет.
+
+        Канал не должен использоваться другими consumer'ами: ack с multiple=True подтверждает
+        все сообщения канала до последнего тега пакета.
+
+        Аргументы:
+            queue_name (str): Имя очереди.
+            batch_handler (Callable): Обработчик (channel, list[Delivery]) -> неудачные сообщения | None.
+            max_batch (int): Максимальный размер пакета, также используется как prefetch_count.
+            max_wait_ms (int): Максимальное время накопления пакета в миллисекундах.
+            requeue_failed (bool): Возвращать ли неудачные сообщения в очередь.
+        """
+        self.channel.basic_qos(prefetch_count=max_batch)
+        max_wait = max_wait_ms / 1000
+        batch: list[Delivery] = []
+        deadline = 0.0
+
+        metrics = get_metrics()
+
+        def flush() -> None:
+            metrics.delivered.inc(len(batch), queue=queue_name)
+            started = time.perf_counter()
+            try:
+                failed = batch_handler(self.channel, batch) or ()
+            except Exception as e:
+                logger.exception("Ошибка обработки пакета из %d сообщений: %s", len(batch), e)
+                metrics.handler_errors.inc(queue=queue_name)
+                failed = batch
+            metrics.handler_seconds.observe(time.perf_counter() - started, queue=queue_name)
+            self._settle_batch(batch, failed, requeue_failed, queue_name)
+            batch.clear()
+
+        logger.info("Ожидание пакетов сообщений в очереди: %s", queue_name)
+        try:
+            for method, properties, body in self.channel.consume(queue_name, inactivity_timeout=max_wait):
+                if method is not None:
+                    if not batch:
+                        deadline = time.monotonic() + max_wait
+                    try:
+                        batch.append(Delivery(method, properties, decompress(body, properties.content_encoding)))
+                    except DecompressionError as e:
+                        logger.error("Отклоняем сообщение %s: %s", method.delivery_tag, e)
+                        self.channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+                if batch and (len(batch) >= max_batch or time.monotonic() >= deadline):
+                    flush()
+        finally:
+            if batch and self.channel.is_open:
+                flush()
+            if self.channel.is_open:
+                self.channel.cancel()
@@ -0,0 +1,124 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import pika
+from pika.exceptions import AMQPError
+
+from memory_broker.blocking import BlockingConnection as MemoryBlockingConnection, MemoryConnectionParameters
+
+logger = logging.getLogger(__name__)
+
+
+def open_blocking_connection(connection_params) -> pika.BlockingConnection:
+    """
+    Открывает блокирующее соединение с RabbitMQ.
+
+    Для MemoryConnectionParameters соединение открывается к брокеру в памяти процесса (без сети).
+    """
+    if isinstance(connection_params, MemoryConnectionParameters):
+        return MemoryBlockingConnection(connection_params)  # type: ignore
+    return pika.BlockingConnection(parameters=connection_params)
+
+
+class BlockingConnectionPool:
+    """
+    Пул блокирующих соединений с RabbitMQ.
+
+    Соединение выдаётся одному потоку за раз (BlockingConnection не потокобезопасно)
+    и после использования возвращается в пул вместо закрытия.
+
+    Атрибуты:
+        connection_params (pika.ConnectionParameters): Параметры подключения к RabbitMQ.
+        max_idle (int): Максимальное количество простаивающих соединений в пуле.
+    """
+
+    def __init__(self, connection_params: pika.ConnectionParameters, max_idle: int = 4) -> None:
+        self.connection_params = connection_params
+        self.max_idle = max_idle
+        self._idle: list[pika.BlockingConnection] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_healthy(connection: pika.BlockingConnection) -> bool:
+        """
+        Проверяет, что соединение открыто и сокет жив.
+
+        Обработка событий с нулевым таймаутом выявляет разорванные брокером соединения.
+        """
+        if not connection.is_open:
+            return False
+        try:
+            connection.process_data_events(time_limit=0)
+        except AMQPError:
+            return False
+        return connection.is_open
+
+    def get(self) -> pika.BlockingConnection:
+        """
+        Выдаёт рабочее соединение из пула или создаёт новое.
+
+        Возвращает:
+            pika.BlockingConnection: Объект соединения с RabbitMQ.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection = self._idle.pop()
+            if self.is_healthy(connection):
+                return connection
+            logger.info("Dropping broken pooled connection %s", connection)
+        return open_blocking_connection(self.connection_params)
+
+    def put(self, connection: pika.BlockingConnection) -> None:
+        """Возвращает соединение в пул. Лишние и закрытые соединения закрываются."""
+        if connection.is_open:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(connection)
+                    return
+            connection.close()
+
+    @contextmanager
+    def acquire(self) -> Iterator[pika.BlockingConnection]:
+        connection = self.get()
+        try:
+            yield connection
+        finally:
+            self.put(connection)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            if connection.is_open:
+                connection.close()
+
+
+_pools: dict[tuple, BlockingConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def broker_key(connection_params: pika.ConnectionParameters) -> tuple:
+    """Ключ брокера и учётной записи для параметров подключения."""
+    return (
+        connection_params.host,
+        connection_params.port,
+        connection_params.virtual_host,
+        getattr(connection_params.credentials, "username", None),
+    )
+
+
+def get_blocking_pool(connection_params: pika.ConnectionParameters) -> BlockingConnectionPool:
+    """
+    Возвращает общий для процесса пул соединений для указанных параметров подключения.
+    """
+    key = broker_key(connection_params)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = BlockingConnectionPool(connection_params)
+            _pools[key] = pool
+        return pool
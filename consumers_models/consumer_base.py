@@ -1,6 +1,9 @@
 import pika
 import logging
 
+from consumers_models.connection_pool import broker_key, get_blocking_pool, open_blocking_connection
+from topology import Topology, apply_blocking
+
 logger = logging.getLogger(__name__)
 
 HOST = "0.0.0.0"
@@ -30,29 +33,48 @@ class RabbitMQClientBase:
         connection_params (pika.ConnectionParameters): Параметры подключения к RabbitMQ.
         _connection (pika.BlockingConnection | None): Активное соединение с RabbitMQ.
         _channel (pika.adapters.blocking_connection.BlockingChannel | None): Канал для взаимодействия с RabbitMQ.
+        use_pool (bool): Брать ли соединение из общего пула процесса вместо открытия нового.
     """
 
     def __init__(self,
-                 connection_params: pika.ConnectionParameters = mq_connection_params
+                 connection_params: pika.ConnectionParameters = mq_connection_params,
+                 use_pool: bool = False,
                  ) -> None:
         """
         Инициализация клиента RabbitMQ.
 
         Аргументы:
-            connection_params (pika.ConnectionParameters): Параметры подключения к RabbitMQ.
+            connection_params (pika.ConnectionParameters): Параметры подключения к RabbitMQ
+                (или MemoryConnectionParameters для брокера в памяти).
+            use_pool (bool): Если True, соединение берётся из пула и возвращается в него при выходе из контекста.
         """
         self.connection_params: pika.ConnectionParameters = connection_params
+        self.use_pool: bool = use_pool
         self._connection: pika.BlockingConnection | None = None  # Активное соединение
         self._channel: pika.adapters.blocking_connection.BlockingChannel | None = None  # Канал связи
 
     def get_connection(self) -> pika.BlockingConnection:
         """
-        Создает новое соединение с RabbitMQ.
+        Создает новое соединение с RabbitMQ или берёт его из пула, если включен use_pool.
 
         Возвращает:
             pika.BlockingConnection: Объект соединения с RabbitMQ.
         """
-        return pika.BlockingConnection(parameters=self.connection_params)
+        if self.use_pool:
+            return get_blocking_pool(self.connection_params).get()
+        return open_blocking_connection(self.connection_params)
+
+    @property
+    def connection(self) -> pika.BlockingConnection:
+        """
+        Возвращает активное соединение с RabbitMQ.
+
+        Исключения:
+            RabbitRuntimeException: Если соединение не инициализировано.
+        """
+        if self._connection is None:
+            raise RabbitRuntimeException("Connection is not yet initialized")
+        return self._connection
 
     @property
     def channel(self) -> pika.adapters.blocking_connection.BlockingChannel:
@@ -71,6 +93,18 @@ class RabbitMQClientBase:
             raise RabbitRuntimeException("Channel is not yet initialized")
         return self._channel
 
+    def declare_topology(self, topology: Topology) -> dict[str, str]:
+        """
+        Объявляет сущности топологии, которые ещё не объявлялись этим процессом.
+
+        Аргументы:
+            topology (Topology): Обменники, очереди и привязки.
+
+        Возвращает:
+            dict[str, str]: Соответствие имён очередей топологии объявленным именам.
+        """
+        return apply_blocking(self.channel, topology, broker_key(self.connection_params))
+
     def __enter__(self):
         """
         Контекстный менеджер: инициализирует соединение и канал при входе в контекст.
@@ -94,6 +128,8 @@ class RabbitMQClientBase:
         # Закрываем канал, если он открыт
         if self._channel and self._channel.is_open:
             self._channel.close()
-        # Закрываем соединение, если оно открыто
-        if self._connection and self._connection.is_open:
+        # Возвращаем соединение в пул или закрываем его, если оно открыто
+        if self._connection and self.use_pool:
+            get_blocking_pool(self.connection_params).put(self._connection)
+        elif self._connection and self._connection.is_open:
             self._connection.close()
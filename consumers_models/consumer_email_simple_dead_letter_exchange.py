@@ -1,10 +1,23 @@
+import functools
 import logging
+import time
 from typing import TYPE_CHECKING, Callable, Optional
 
+import pika
 from pika.exchange_type import ExchangeType
 from pika.spec import Basic, BasicProperties
 
-from consumers_models.consumer_base import RabbitMQClientBase
+from compression import decompressing
+from consumers_models.batch_consumer import BatchRabbitMixin
+from consumers_models.consumer_base import RabbitMQClientBase, mq_connection_params
+from consumers_models.threaded_consumer import ThreadedCallback, worker_count
+from dedup import DedupStore, deduplicating
+from delivery import settle_hooks_channel
+from metrics import instrumented
+from prefetch import AdaptivePrefetch, adaptive_prefetch
+from retry_policy import RetryPolicy
+from topology import Topology
+from tracing import traced
 
 
 if TYPE_CHECKING:
@@ -21,17 +34,21 @@ class SimpleRabbitMixin:
     """
 
     channel: "BlockingChannel"
+    declare_topology: Callable[[Topology], dict[str, str]]
 
-    def declare_exchange(self) -> None:
+    def exchange_topology(self) -> Topology:
         """
-        Объявляет exchange, используемый для обновлений email.
+        Exchange, используемый для обновлений email.
 
         Exchange имеет тип `fanout`, который рассылает сообщения всем связанным очередям.
         """
-        self.channel.exchange_declare(
-            exchange="main-exchange",
-            exchange_type=ExchangeType.fanout,
-        )
+        return Topology().exchange("main-exchange", ExchangeType.fanout)
+
+    def declare_exchange(self) -> None:
+        """
+        Объявляет exchange, используемый для обновлений email.
+        """
+        self.declare_topology(self.exchange_topology())
 
     def declare_queue(
             self, queue_name: str = "dead-letter-queue",
@@ -45,32 +62,30 @@ class SimpleRabbitMixin:
         """
         Объявляет очередь для получения обновлений email и связывает её с exchange.
 
+        Exchange, очередь и привязка объявляются одним проходом, повторный вызов
+        с теми же параметрами не обращается к брокеру.
+
         Аргументы:
             queue_name (str): Имя очереди для объявления. Если не указано, будет сгенерировано уникальное имя.
+            passive (bool): Если True, только проверяет существование очереди.
             exclusive (bool): Если True, очередь будет эксклюзивной для соединения и удалена при его закрытии.
 
         Возвращает:
             str: Имя объявленной очереди.
         """
-        # Убеждаемся, что exchange существует (идемпотентная операция).
-        self.declare_exchange()
-
-        # Объявляем очередь с заданными параметрами.
-        queue = self.channel.queue_declare(queue=queue_name,
-                                           passive=passive,
-                                           durable=durable,
-                                           exclusive=exclusive,
-                                           auto_delete=auto_delete,
-                                           arguments=arguments)
-        q_name = queue.method.queue
-
-        # Связываем объявленную очередь с exchange для получения сообщений.
-        self.channel.queue_bind(
-            exchange="dead-letter-exchange",
-            queue=q_name,  # Здесь передаём имя объявленной очереди
+        if passive:
+            return self.channel.queue_declare(queue=queue_name, passive=True).method.queue
+
+        topology = self.exchange_topology().queue(
+            queue_name,
+            durable=durable,
+            exclusive=exclusive,
+            auto_delete=auto_delete,
+            arguments=dict(arguments or {}),
         )
-
-        return q_name
+        # Связываем объявленную очередь с exchange для получения сообщений.
+        topology.bind(queue_name, "dead-letter-exchange")
+        return self.declare_topology(topology)[queue_name]
 
     def consume_messages(
             self,
@@ -80,7 +95,11 @@ class SimpleRabbitMixin:
             exclusive: bool = True,
             prefetch_count: int = 1,
             auto_ack: bool = False,
-            queue_name: str = ""
+            queue_name: str = "",
+            threaded: bool = False,
+            prefetch_controller: Optional[AdaptivePrefetch] = None,
+            dedup_store: Optional[DedupStore] = None,
+            workers: Optional[int] = None,
     ) -> None:
         """
         Настраивает consumer для обработки сообщений из очереди обновлений email.
@@ -89,13 +108,42 @@ class SimpleRabbitMixin:
             on_message_callback (Callable): Callback-функция для обработки входящих сообщений.
             prefetch_count (int): Максимальное количество непотверждённых сообщений, которые может получить consumer.
             auto_ack (bool): Если True, сообщения автоматически подтверждаются при получении.
+            threaded (bool): Если True, обработчик выполняется в пуле потоков,
+                а ack/nack передаются в поток соединения через add_callback_threadsafe.
+            prefetch_controller (AdaptivePrefetch | None): Если задан, prefetch_count используется как начальное
+                значение и подстраивается под время обработки сообщений и задержку до брокера.
+            dedup_store (DedupStore | None): Если задан, повторные доставки уже обработанных сообщений
+                подтверждаются без вызова обработчика.
+            workers (int | None): Количество потоков при threaded=True (по умолчанию prefetch_count,
+                а при prefetch_count=0 - DEFAULT_MAX_WORKERS).
         """
+        workers = worker_count(prefetch_count, workers) if threaded else 1
         # Устанавливаем максимальное количество необработанных сообщений, которое может принять consumer.
-        self.channel.basic_qos(prefetch_count=prefetch_count)
+        if prefetch_controller is None:
+            self.channel.basic_qos(prefetch_count=prefetch_count)
+        else:
+            # Лимит на весь канал, чтобы последующие изменения применялись к запущенному consumer'у.
+            started = time.perf_counter()
+            self.channel.basic_qos(prefetch_count=prefetch_count, global_qos=True)
+            prefetch_controller.concurrency = workers
+            prefetch_controller.applied(prefetch_count, rtt=time.perf_counter() - started)
 
         # Объявляем очередь и связываем её с exchange.
         queue_name = self.declare_queue(queue_name=queue_name, exclusive=exclusive)  # type: ignore
 
+        # Сжатые тела распаковываются до вызова обработчика.
+        on_message_callback = traced(instrumented(on_message_callback, queue=queue_name), queue=queue_name)
+        if dedup_store is not None:
+            on_message_callback = deduplicating(on_message_callback, dedup_store, auto_ack=auto_ack, queue=queue_name)
+        on_message_callback = decompressing(on_message_callback, auto_ack=auto_ack)
+        if prefetch_controller is not None:
+            on_message_callback = adaptive_prefetch(on_message_callback, prefetch_controller)
+
+        threaded_callback = None
+        if threaded:
+            threaded_callback = ThreadedCallback(on_message_callback, max_workers=workers)
+            on_message_callback = threaded_callback
+
         # Настраиваем consumer для прослушивания сообщений в очереди.
         self.channel.basic_consume(
             queue=queue_name,
@@ -106,10 +154,14 @@ class SimpleRabbitMixin:
         logger.info("Ожидание сообщений в очереди: %s", queue_name)
 
         # Запускаем цикл обработки сообщений.
-        self.channel.start_consuming()
+        try:
+            self.channel.start_consuming()
+        finally:
+            if threaded_callback is not None:
+                threaded_callback.close(self.channel.connection)
 
 
-class MQDeadLetterExchangeLesson(SimpleRabbitMixin, RabbitMQClientBase):
+class MQDeadLetterExchangeLesson(SimpleRabbitMixin, BatchRabbitMixin, RabbitMQClientBase):
     """
     Клиент RabbitMQ для обработки сообщений об обновлении email.
 
@@ -123,8 +175,14 @@ class RabbitMQWithDeadLetters(RabbitMQClientBase):
     """
     Реализация RabbitMQ клиента с поддержкой Dead Letter Exchange
     """
-    def __init__(self):
-        super().__init__()
+    def __init__(
+            self,
+            connection_params: pika.ConnectionParameters = mq_connection_params,
+            retry_policy: Optional[RetryPolicy] = None,
+    ):
+        super().__init__(connection_params=connection_params)
+        # Политика повторов через очереди задержки; без неё неудачные сообщения сразу уходят в DLX.
+        self.retry_policy = retry_policy
         # Имена для основного обменника и очереди
         self.main_exchange = "main-exchange"
         self.main_queue = "main-queue"
@@ -132,52 +190,102 @@ class RabbitMQWithDeadLetters(RabbitMQClientBase):
         self.dead_letter_exchange = "dead-letter-exchange"
         self.dead_letter_queue = "dead-letter-queue"
 
-    def setup_exchanges(self) -> None:
-        """Объявление основного и dead letter обменников"""
-        # Объявляем dead letter exchange
-        self.channel.exchange_declare(
-            exchange=self.dead_letter_exchange,
-            exchange_type=ExchangeType.fanout,
-            durable=True
+    def topology(self) -> Topology:
+        """Основной и dead letter обменники и очереди, а также очереди задержки, если задана политика повторов."""
+        topology = (
+            Topology()
+            .exchange(self.dead_letter_exchange, ExchangeType.fanout, durable=True)
+            .exchange(self.main_exchange, ExchangeType.fanout, durable=True)
+            # Dead letter очереди не нужны специальные аргументы
+            .queue(self.dead_letter_queue, durable=True)
+            # Основная очередь с привязкой к dead letter exchange
+            .queue(
+                self.main_queue,
+                durable=True,
+                arguments={
+                    "x-dead-letter-exchange": self.dead_letter_exchange,
+                    "x-dead-letter-routing-key": self.dead_letter_queue
+                },
+            )
+            .bind(self.dead_letter_queue, self.dead_letter_exchange)
+            .bind(self.main_queue, self.main_exchange)
         )
+        if self.retry_policy is not None:
+            topology = topology.merge(self.retry_topology())
+        return topology
 
-        # Объявляем основной exchange
-        self.channel.exchange_declare(
-            exchange=self.main_exchange,
-            exchange_type=ExchangeType.fanout,
-            durable=True
-        )
+    def retry_topology(self) -> Topology:
+        """
+        Обменник повторов и очереди задержки основной очереди.
 
-    def setup_queues(self) -> None:
-        """Объявление основной и dead letter очередей"""
-        # Объявляем dead letter очередь
-        self.channel.queue_declare(
-            queue=self.dead_letter_queue,
-            durable=True,
-            arguments={}  # Здесь не нужны специальные аргументы
-        )
+        У очередей задержки нет consumer'ов: по истечении x-message-ttl сообщение
+        возвращается в основную очередь через dead-letter маршрутизацию.
+        """
+        policy = self.retry_policy
+        topology = Topology().exchange(policy.retry_exchange, ExchangeType.direct, durable=True)
+        for queue_name, arguments in policy.delay_queues(self.main_queue):
+            topology.queue(queue_name, durable=True, arguments=arguments)
+            topology.bind(queue_name, policy.retry_exchange, routing_key=queue_name)
+        return topology
+
+    def setup_infrastructure(self) -> None:
+        """Объявление обменников, очередей и привязок одним проходом"""
+        self.declare_topology(self.topology())
+
+    def retry(
+            self,
+            channel: "BlockingChannel",
+            method: "Basic.Deliver",
+            properties: "BasicProperties",
+            body: bytes,
+    ) -> bool:
+        """
+        Откладывает повторную обработку сообщения основной очереди.
 
-        # Привязываем dead letter очередь к dead letter exchange
-        self.channel.queue_bind(
-            exchange=self.dead_letter_exchange,
-            queue=self.dead_letter_queue
-        )
+        Копия сообщения публикуется в очередь задержки следующего уровня, после чего оригинал
+        подтверждается. Если политика не задана или попытки исчерпаны, сообщение отклоняется
+        без возврата в очередь и попадает в dead letter очередь.
 
-        # Объявляем основную очередь с привязкой к dead letter exchange
-        self.channel.queue_declare(
-            queue=self.main_queue,
-            durable=True,
-            arguments={
-                "x-dead-letter-exchange": self.dead_letter_exchange,
-                "x-dead-letter-routing-key": self.dead_letter_queue
-            }
+        Возвращает:
+            bool: True, если повтор запланирован.
+        """
+        delay_queue = None
+        if self.retry_policy is not None:
+            delay_queue = self.retry_policy.next_delay_queue(self.main_queue, properties.headers)
+        if delay_queue is None:
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return False
+
+        channel.basic_publish(
+            exchange=self.retry_policy.retry_exchange,
+            routing_key=delay_queue,
+            body=body,
+            properties=properties,
         )
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        return True
 
-        # Привязываем основную очередь к основному exchange
-        self.channel.queue_bind(
-            exchange=self.main_exchange,
-            queue=self.main_queue
-        )
+    def retrying(
+            self,
+            on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+    ) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None]:
+        """Оборачивает обработчик основной очереди: при исключении сообщение отправляется на повтор."""
+
+        @functools.wraps(on_message_callback)
+        def wrapper(channel, method, properties, body):
+            settled = []
+            channel = settle_hooks_channel(channel, lambda settle_method, requeue: settled.append(settle_method))
+            try:
+                on_message_callback(channel, method, properties, body)
+            except Exception as e:
+                if settled:
+                    # Обработчик уже подтвердил или отклонил сообщение - повтор создал бы копию.
+                    logger.error("Ошибка после завершения сообщения %s, повтор не нужен: %s", method.delivery_tag, e)
+                    return
+                logger.error("Ошибка обработки сообщения %s, отправляем на повтор: %s", method.delivery_tag, e)
+                self.retry(channel, method, properties, body)
+
+        return wrapper
 
     def setup_dead_letter_consumer(self, callback) -> None:
         """Настройка consumer'а для dead letter очереди"""
@@ -195,17 +303,37 @@ class RabbitMQWithDeadLetters(RabbitMQClientBase):
             auto_ack=False
         )
 
-    def run(self, main_callback, dead_letter_callback: Optional[callable] = None) -> None:
-        """Запуск обработки сообщений"""
+    def run(
+            self,
+            main_callback,
+            dead_letter_callback: Optional[callable] = None,
+            dedup_store: Optional[DedupStore] = None,
+            prefetch_count: int = 1,
+            dead_letter_prefetch: int = 1,
+    ) -> None:
+        """
+        Запуск обработки сообщений.
+
+        Если задан dedup_store, повторные доставки уже обработанных сообщений основной очереди
+        подтверждаются без вызова обработчика. Consumer основной очереди получает не больше
+        prefetch_count неподтверждённых сообщений, consumer dead letter очереди - не больше
+        dead_letter_prefetch, поэтому при разборе накопившейся dead letter очереди сообщения
+        основной очереди не ждут за ней в буфере.
+        """
         # Настраиваем инфраструктуру
-        self.setup_exchanges()
-        self.setup_queues()
+        self.setup_infrastructure()
 
-        # Устанавливаем основной consumer
-        self.setup_main_consumer(main_callback)
+        # Устанавливаем основной consumer, ошибки обработчика уходят на повтор
+        main_callback = traced(main_callback, queue=self.main_queue)
+        if dedup_store is not None:
+            main_callback = deduplicating(main_callback, dedup_store, queue=self.main_queue)
+        # prefetch без global_qos действует на consumer'ов, созданных после него.
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+        self.setup_main_consumer(self.retrying(main_callback))
 
         # Если предоставлен callback для dead letter очереди, устанавливаем его
         if dead_letter_callback:
+            self.channel.basic_qos(prefetch_count=dead_letter_prefetch)
             self.setup_dead_letter_consumer(dead_letter_callback)
 
         logger.info("Начинаем прослушивание очередей")
@@ -1,13 +1,24 @@
 import logging
-from typing import TYPE_CHECKING, Callable
+import time
+from typing import TYPE_CHECKING, Callable, Optional
 
 from pika.exchange_type import ExchangeType
 from pika.spec import Basic, BasicProperties
 
 
 
+from compression import decompressing
+from consumers_models.batch_consumer import BatchRabbitMixin
 from consumers_models.consumer_base import RabbitMQClientBase
-from rabbitmq_conf import MQ_EMAIL_UPDATE_EXCHANGE_NAME
+from consumers_models.sharded_consumer import ShardedRabbitMixin
+from consumers_models.threaded_consumer import ThreadedCallback, worker_count
+from dedup import DedupStore, deduplicating
+from metrics import instrumented
+from prefetch import AdaptivePrefetch, adaptive_prefetch
+from rabbitmq_conf import MQ_EMAIL_UPDATE_EXCHANGE_NAME, MQ_EMAIL_UPDATE_SHARDS
+from sharding import Sharding
+from topology import Topology
+from tracing import traced
 
 if TYPE_CHECKING:
     from pika.adapters.blocking_connection import BlockingChannel
@@ -23,46 +34,63 @@ class EmailUpdateRabbitMixin:
     """
 
     channel: "BlockingChannel"
+    declare_topology: Callable[[Topology], dict[str, str]]
+
+    def email_update_exchange_topology(self) -> Topology:
+        """
+        Exchange, используемый для обновлений email.
+
+        Exchange имеет тип `fanout`, который рассылает сообщения всем связанным очередям.
+        """
+        return Topology().exchange(MQ_EMAIL_UPDATE_EXCHANGE_NAME, ExchangeType.fanout)
+
+    def email_update_sharding(self, shards: int = MQ_EMAIL_UPDATE_SHARDS) -> Sharding:
+        """
+        Шардированная очередь обновлений email.
+
+        Сообщения одного пользователя попадают в один шард и обрабатываются по порядку,
+        шарды распределяются между экземплярами consumer'ов (см. `consume_shards`).
+        """
+        return Sharding(f"{MQ_EMAIL_UPDATE_EXCHANGE_NAME}.sharded", shards)
 
     def declare_email_update_exchange(self) -> None:
         """
         Объявляет exchange, используемый для обновлений email.
+        """
+        self.declare_topology(self.email_update_exchange_topology())
 
-        Exchange имеет тип `fanout`, который рассылает сообщения всем связанным очередям.
+    def declare_email_update_shards(self) -> None:
         """
-        self.channel.exchange_declare(
-            exchange=MQ_EMAIL_UPDATE_EXCHANGE_NAME,
-            exchange_type=ExchangeType.fanout,
-        )
+        Объявляет обменник и очереди шардированной обработки обновлений email.
+        """
+        self.declare_topology(self.email_update_sharding().topology())
 
     def declare_queue_email_updates(
             self, queue_name: str = "",
-            exclusive: bool = True
+            exclusive: bool = True,
+            durable: bool = False,
     ) -> str | None:
         """
         Объявляет очередь для получения обновлений email и связывает её с exchange.
 
+        Exchange, очередь и привязка объявляются одним проходом, повторный вызов
+        с теми же параметрами не обращается к брокеру.
+
         Аргументы:
             queue_name (str): Имя очереди для объявления. Если не указано, будет сгенерировано уникальное имя.
             exclusive (bool): Если True, очередь будет эксклюзивной для соединения и удалена при его закрытии.
+            durable (bool): Если True, очередь сохраняется после перезапуска RabbitMQ.
 
         Возвращает:
             str | None: Имя объявленной очереди.
         """
-        # Убеждаемся, что exchange существует (идемпотентная операция).
-        self.declare_email_update_exchange()
-
-        # Объявляем очередь с заданными параметрами.
-        queue = self.channel.queue_declare(queue=queue_name, exclusive=exclusive)
-        q_name = queue.method.queue
-
-        # Связываем объявленную очередь с exchange для получения сообщений.
-        self.channel.queue_bind(
-            exchange=MQ_EMAIL_UPDATE_EXCHANGE_NAME,
-            queue=queue_name,
+        topology = (
+            self.email_update_exchange_topology()
+            .queue(queue_name, exclusive=exclusive, durable=durable)
+            # Связываем объявленную очередь с exchange для получения сообщений.
+            .bind(queue_name, MQ_EMAIL_UPDATE_EXCHANGE_NAME)
         )
-
-        return q_name
+        return self.declare_topology(topology)[queue_name]
 
     def consume_messages(
             self,
@@ -72,7 +100,12 @@ class EmailUpdateRabbitMixin:
             exclusive: bool = True,
             prefetch_count: int = 1,
             auto_ack: bool = False,
-            queue_name: str = ""
+            queue_name: str = "",
+            threaded: bool = False,
+            prefetch_controller: Optional[AdaptivePrefetch] = None,
+            durable: bool = False,
+            dedup_store: Optional[DedupStore] = None,
+            workers: Optional[int] = None,
     ) -> None:
         """
         Настраивает consumer для обработки сообщений из очереди обновлений email.
@@ -81,12 +114,44 @@ class EmailUpdateRabbitMixin:
             on_message_callback (Callable): Callback-функция для обработки входящих сообщений.
             prefetch_count (int): Максимальное количество непотверждённых сообщений, которые может получить consumer.
             auto_ack (bool): Если True, сообщения автоматически подтверждаются при получении.
+            threaded (bool): Если True, обработчик выполняется в пуле потоков,
+                а ack/nack передаются в поток соединения через add_callback_threadsafe.
+            prefetch_controller (AdaptivePrefetch | None): Если задан, prefetch_count используется как начальное
+                значение и подстраивается под время обработки сообщений и задержку до брокера.
+            durable (bool): Если True, объявляется устойчивая очередь.
+            dedup_store (DedupStore | None): Если задан, повторные доставки уже обработанных сообщений
+                подтверждаются без вызова обработчика.
+            workers (int | None): Количество потоков при threaded=True (по умолчанию prefetch_count,
+                а при prefetch_count=0 - DEFAULT_MAX_WORKERS).
         """
+        workers = worker_count(prefetch_count, workers) if threaded else 1
         # Устанавливаем максимальное количество необработанных сообщений, которое может принять consumer.
-        self.channel.basic_qos(prefetch_count=prefetch_count)
+        if prefetch_controller is None:
+            self.channel.basic_qos(prefetch_count=prefetch_count)
+        else:
+            # Лимит на весь канал, чтобы последующие изменения применялись к запущенному consumer'у.
+            started = time.perf_counter()
+            self.channel.basic_qos(prefetch_count=prefetch_count, global_qos=True)
+            prefetch_controller.concurrency = workers
+            prefetch_controller.applied(prefetch_count, rtt=time.perf_counter() - started)
 
         # Объявляем очередь и связываем её с exchange.
-        queue_name = self.declare_queue_email_updates(queue_name=queue_name, exclusive=exclusive)  # type: ignore
+        queue_name = self.declare_queue_email_updates(  # type: ignore
+            queue_name=queue_name, exclusive=exclusive, durable=durable,
+        )
+
+        # Сжатые тела распаковываются до вызова обработчика.
+        on_message_callback = traced(instrumented(on_message_callback, queue=queue_name), queue=queue_name)
+        if dedup_store is not None:
+            on_message_callback = deduplicating(on_message_callback, dedup_store, auto_ack=auto_ack, queue=queue_name)
+        on_message_callback = decompressing(on_message_callback, auto_ack=auto_ack)
+        if prefetch_controller is not None:
+            on_message_callback = adaptive_prefetch(on_message_callback, prefetch_controller)
+
+        threaded_callback = None
+        if threaded:
+            threaded_callback = ThreadedCallback(on_message_callback, max_workers=workers)
+            on_message_callback = threaded_callback
 
         # Настраиваем consumer для прослушивания сообщений в очереди.
         self.channel.basic_consume(
@@ -98,10 +163,14 @@ class EmailUpdateRabbitMixin:
         logger.info("Ожидание сообщений в очереди: %s", queue_name)
 
         # Запускаем цикл обработки сообщений.
-        self.channel.start_consuming()
+        try:
+            self.channel.start_consuming()
+        finally:
+            if threaded_callback is not None:
+                threaded_callback.close(self.channel.connection)
 
 
-class EmailUpdateRabbit(EmailUpdateRabbitMixin, RabbitMQClientBase):
+class EmailUpdateRabbit(EmailUpdateRabbitMixin, BatchRabbitMixin, ShardedRabbitMixin, RabbitMQClientBase):
     """
     Клиент RabbitMQ для обработки сообщений об обновлении email.
 
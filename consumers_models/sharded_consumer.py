@@ -0,0 +1,117 @@
+import logging
+from typing import TYPE_CHECKING, Callable, Optional
+
+from pika.spec import Basic, BasicProperties
+
+from compression import decompressing
+from dedup import DedupStore, deduplicating
+from metrics import instrumented
+from sharding import Sharding, ShardMembership
+from topology import Topology
+from tracing import traced
+
+if TYPE_CHECKING:
+    from pika.adapters.blocking_connection import BlockingChannel
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedRabbitMixin:
+    """
+    Класс-миксин для обработки шардированной очереди группой экземпляров.
+
+    Экземпляр подписывается только на свои шарды и перераспределяет их при появлении
+    и уходе других экземпляров (см. модуль `sharding`).
+    """
+
+    channel: "BlockingChannel"
+    declare_topology: Callable[[Topology], dict[str, str]]
+
+    def consume_shards(
+            self,
+            sharding: Sharding,
+            on_message_callback: Callable[
+                ["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None
+            ],
+            member_id: Optional[str] = None,
+            prefetch_count: int = 1,
+            heartbeat_interval: float = 5.0,
+            member_ttl: Optional[float] = None,
+            dedup_store: Optional[DedupStore] = None,
+    ) -> None:
+        """
+        Обрабатывает сообщения из шардов, назначенных этому экземпляру.
+
+        Обработчик вызывается последовательно в потоке соединения, поэтому сообщения одного
+        шарда (и одного ключа) обрабатываются по порядку. При отмене consumer'а шарда
+        pika возвращает в очередь доставленные, но не переданные обработчику сообщения.
+
+        Аргументы:
+            sharding (Sharding): Описание шардированной очереди.
+            on_message_callback (Callable): Callback-функция для обработки входящих сообщений.
+            member_id (str | None): Идентификатор экземпляра в группе (по умолчанию случайный).
+            prefetch_count (int): Лимит неподтверждённых сообщений на каждый шард.
+            heartbeat_interval (float): Интервал рассылки heartbeat'ов в секундах.
+            member_ttl (float | None): Через сколько секунд без heartbeat'а участник считается ушедшим
+                (по умолчанию три интервала).
+            dedup_store (DedupStore | None): Если задан, повторные доставки уже обработанных сообщений
+                подтверждаются без вызова обработчика.
+        """
+        membership = ShardMembership(member_id, ttl=member_ttl or 3 * heartbeat_interval)
+        self.declare_topology(sharding.topology())
+        members_queue = self.declare_topology(sharding.membership_topology())[""]
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+
+        consumers: dict[int, str] = {}
+
+        def shard_callback(shard: int):
+            queue_name = sharding.queue_name(shard)
+            callback = traced(instrumented(on_message_callback, queue=queue_name), queue=queue_name)
+            if dedup_store is not None:
+                callback = deduplicating(callback, dedup_store, queue=queue_name)
+            return decompressing(callback)
+
+        def rebalance() -> None:
+            assigned = set(membership.assigned(sharding))
+            for shard in sorted(set(consumers) - assigned):
+                self.channel.basic_cancel(consumers.pop(shard))
+            for shard in sorted(assigned - set(consumers)):
+                consumers[shard] = self.channel.basic_consume(
+                    queue=sharding.queue_name(shard),
+                    on_message_callback=shard_callback(shard),
+                )
+            logger.info(
+                "Member %s of %d owns shards %s", membership.member_id, len(membership.members), sorted(consumers),
+            )
+
+        def publish_membership(body: bytes) -> None:
+            self.channel.basic_publish(exchange=sharding.members_exchange, routing_key="", body=body)
+
+        def on_membership(channel, method, properties, body) -> None:
+            if membership.handle(body):
+                rebalance()
+
+        timer = None
+
+        def heartbeat() -> None:
+            nonlocal timer
+            publish_membership(membership.heartbeat())
+            if membership.expire():
+                rebalance()
+            timer = self.channel.connection.call_later(heartbeat_interval, heartbeat)
+
+        self.channel.basic_consume(queue=members_queue, on_message_callback=on_membership, auto_ack=True)
+        rebalance()
+        heartbeat()
+
+        logger.info("Ожидание сообщений в шардах %s", sharding.exchange)
+        try:
+            self.channel.start_consuming()
+        finally:
+            if timer is not None:
+                self.channel.connection.remove_timeout(timer)
+            if self.channel.is_open:
+                # Остальные экземпляры сразу забирают шарды, не дожидаясь истечения member_ttl.
+                for tag in consumers.values():
+                    self.channel.basic_cancel(tag)
+                publish_membership(membership.leave())
@@ -0,0 +1,188 @@
+import logging
+import math
+import multiprocessing
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from typing import Callable, Optional
+
+import pika
+
+from consumers_models.consumer_base import RabbitMQClientBase, mq_connection_params
+
+logger = logging.getLogger(__name__)
+
+
+def stop_on_signal(client: RabbitMQClientBase) -> None:
+    """
+    Устанавливает обработчики SIGTERM/SIGINT для процесса-воркера.
+
+    Обработчик не прерывает текущий callback: остановка consumer'а планируется через
+    add_callback_threadsafe и выполняется после того, как сообщение будет обработано и подтверждено.
+    После выхода из start_consuming клиент закрывает канал и соединение в __exit__.
+
+    Аргументы:
+        client (RabbitMQClientBase): Клиент с открытым соединением и каналом.
+    """
+    def handler(signum, frame):
+        logger.warning("Получен сигнал %s, останавливаем consumer", signal.Signals(signum).name)
+        client.connection.add_callback_threadsafe(client.channel.stop_consuming)
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+class ConsumerSupervisor:
+    """
+    Запускает N процессов-воркеров, каждый из которых выполняет блокирующий consumer.
+
+    Перезапускает упавшие процессы, при SIGTERM передаёт сигнал воркерам для корректного
+    завершения и масштабирует количество воркеров в пределах [min_workers, max_workers]
+    по глубине очереди.
+
+    Атрибуты:
+        worker_target (Callable): Функция верхнего уровня, запускаемая в каждом процессе.
+        queue_name (str): Очередь, глубина которой используется для масштабирования.
+        min_workers (int): Минимальное количество воркеров.
+        max_workers (int): Максимальное количество воркеров.
+        messages_per_worker (int): Количество сообщений в очереди на одного воркера.
+        check_interval (float): Период проверки воркеров и очереди в секундах.
+        shutdown_timeout (float): Время на корректное завершение воркеров перед kill.
+    """
+
+    def __init__(
+            self,
+            worker_target: Callable[[], None],
+            queue_name: str,
+            min_workers: int = 1,
+            max_workers: Optional[int] = None,
+            messages_per_worker: int = 100,
+            check_interval: float = 5.0,
+            shutdown_timeout: float = 30.0,
+            connection_params: pika.ConnectionParameters = mq_connection_params,
+    ) -> None:
+        self.worker_target = worker_target
+        self.queue_name = queue_name
+        self.min_workers = min_workers
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.messages_per_worker = messages_per_worker
+        self.check_interval = check_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.connection_params = connection_params
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: list[BaseProcess] = []
+        # Остановленные при масштабировании воркеры, дорабатывающие текущее сообщение, и срок их завершения.
+        self._draining: dict[BaseProcess, float] = {}
+        self._stopping = False
+
+    @property
+    def workers(self) -> list[BaseProcess]:
+        """Работающие воркеры, учитываемые при масштабировании."""
+        return list(self._workers)
+
+    @property
+    def draining(self) -> list[BaseProcess]:
+        """Воркеры, получившие SIGTERM при масштабировании и ещё не завершившиеся."""
+        return list(self._draining)
+
+    def queue_depth(self, client: RabbitMQClientBase) -> int:
+        """
+        Возвращает количество готовых к доставке сообщений в очереди (queue_declare с passive=True).
+
+        Проверка выполняется на отдельном канале: если очереди нет, брокер закрывает канал (404),
+        и следующие проверки не должны на этом ломаться.
+        """
+        with client.connection.channel() as probe:
+            queue = probe.queue_declare(queue=self.queue_name, passive=True)
+        return queue.method.message_count
+
+    def desired_workers(self, depth: int) -> int:
+        """Вычисляет нужное количество воркеров по глубине очереди."""
+        wanted = math.ceil(depth / self.messages_per_worker)
+        return max(self.min_workers, min(self.max_workers, wanted))
+
+    def start_worker(self) -> None:
+        process = self._context.Process(target=self.worker_target, daemon=False)
+        process.start()
+        self._workers.append(process)
+        logger.info("Запущен воркер pid=%s", process.pid)
+
+    def stop_worker(self, process: BaseProcess) -> None:
+        """Отправляет воркеру SIGTERM, воркер завершится после текущего сообщения."""
+        if process.is_alive():
+            process.terminate()
+
+    def reap(self) -> None:
+        """
+        Удаляет завершившиеся процессы из списков, упавшие воркеры будут перезапущены при масштабировании.
+
+        Останавливаемые воркеры, не завершившиеся за shutdown_timeout, убиваются.
+        """
+        for process in list(self._workers):
+            if process.is_alive():
+                continue
+            process.join()
+            self._workers.remove(process)
+            if process.exitcode != 0 and not self._stopping:
+                logger.error("Воркер pid=%s упал с кодом %s", process.pid, process.exitcode)
+        for process, deadline in list(self._draining.items()):
+            if process.is_alive():
+                if time.monotonic() < deadline:
+                    continue
+                logger.warning("Воркер pid=%s не завершился вовремя, kill", process.pid)
+                process.kill()
+            process.join()
+            del self._draining[process]
+
+    def scale(self, target: int) -> None:
+        """
+        Доводит количество воркеров до target.
+
+        Лишним воркерам SIGTERM отправляется один раз: они переходят в список останавливаемых
+        и не учитываются в target, пока дорабатывают текущее сообщение.
+        """
+        while len(self._workers) < target:
+            self.start_worker()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self._workers[target:]:
+            self.stop_worker(process)
+            self._draining[process] = deadline
+        del self._workers[target:]
+
+    def shutdown(self) -> None:
+        """Останавливает всех воркеров и ждёт их завершения, по истечении shutdown_timeout убивает оставшиеся."""
+        for process in self._workers:
+            self.stop_worker(process)
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self._workers + list(self._draining):
+            process.join(timeout=max(0.0, min(self._draining.get(process, deadline), deadline) - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Воркер pid=%s не завершился вовремя, kill", process.pid)
+                process.kill()
+                process.join()
+        self._workers.clear()
+        self._draining.clear()
+
+    def _handle_signal(self, signum, frame) -> None:
+        logger.warning("Supervisor получил сигнал %s", signal.Signals(signum).name)
+        self._stopping = True
+
+    def run(self) -> None:
+        """Основной цикл супервизора."""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        target = self.min_workers
+        try:
+            with RabbitMQClientBase(connection_params=self.connection_params) as monitor:
+                while not self._stopping:
+                    self.reap()
+                    try:
+                        depth = self.queue_depth(monitor)
+                        target = self.desired_workers(depth)
+                        logger.debug("Глубина очереди %s: %d, воркеров: %d", self.queue_name, depth, target)
+                    except pika.exceptions.AMQPError as e:
+                        logger.error("Не удалось получить глубину очереди: %s", e)
+                    self.scale(target)
+                    monitor.connection.sleep(self.check_interval)
+        finally:
+            self.shutdown()
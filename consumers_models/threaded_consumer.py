@@ -0,0 +1,128 @@
+import functools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from pika.exceptions import AMQPError
+from pika.spec import Basic, BasicProperties
+
+if TYPE_CHECKING:
+    from pika.adapters.blocking_connection import BlockingChannel, BlockingConnection
+
+logger = logging.getLogger(__name__)
+
+# Количество рабочих потоков при prefetch_count=0: брокер не ограничивает доставки,
+# поэтому лишние сообщения ждут в очереди задач пула.
+DEFAULT_MAX_WORKERS = 32
+
+
+def worker_count(prefetch_count: int, workers: Optional[int] = None) -> int:
+    """Количество рабочих потоков: workers или prefetch_count (при prefetch_count=0 - DEFAULT_MAX_WORKERS)."""
+    count = workers if workers is not None else prefetch_count or DEFAULT_MAX_WORKERS
+    if count < 1:
+        raise ValueError("workers must be at least 1")
+    return count
+
+
+class ThreadSafeChannel:
+    """
+    Обёртка над BlockingChannel для вызова из рабочих потоков.
+
+    basic_ack, basic_nack и basic_reject не выполняются сразу, а передаются в поток
+    соединения через `connection.add_callback_threadsafe`. Остальные атрибуты делегируются
+    исходному каналу и не являются потокобезопасными.
+    """
+
+    def __init__(self, channel: "BlockingChannel") -> None:
+        self._channel = channel
+        self._connection: "BlockingConnection" = channel.connection
+
+    def _schedule(self, method: Callable[..., Any], **kwargs: Any) -> None:
+        self._connection.add_callback_threadsafe(functools.partial(method, **kwargs))
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self._schedule(self._channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        self._schedule(self._channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def basic_reject(self, delivery_tag: int = 0, requeue: bool = True) -> None:
+        self._schedule(self._channel.basic_reject, delivery_tag=delivery_tag, requeue=requeue)
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._channel, item)
+
+
+class ThreadedCallback:
+    """
+    Callback для basic_consume, который выполняет обработчик в ThreadPoolExecutor.
+
+    Поток соединения только передаёт доставку в пул и продолжает обслуживать heartbeat'ы.
+    Обычно количество потоков равно prefetch_count (см. `worker_count`): брокер не доставит больше
+    неподтверждённых сообщений, поэтому очередь задач пула не растёт.
+
+    Атрибуты:
+        on_message_callback (Callable): Исходный обработчик (channel, method, properties, body).
+        max_workers (int): Количество рабочих потоков.
+    """
+
+    def __init__(
+            self,
+            on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+            max_workers: int = 1,
+    ) -> None:
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.on_message_callback = on_message_callback
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mq-handler")
+        self._pending: set[Future] = set()
+        self._lock = threading.Lock()
+
+    def _run(self, channel: ThreadSafeChannel, method: "Basic.Deliver", properties: "BasicProperties", body: bytes):
+        try:
+            self.on_message_callback(channel, method, properties, body)  # type: ignore
+        except Exception as e:
+            logger.exception("Ошибка обработки сообщения %s: %s", method.delivery_tag, e)
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def __call__(
+            self,
+            channel: "BlockingChannel",
+            method: "Basic.Deliver",
+            properties: "BasicProperties",
+            body: bytes,
+    ) -> None:
+        future = self._executor.submit(self._run, ThreadSafeChannel(channel), method, properties, body)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def close(self, connection: "BlockingConnection") -> None:
+        """
+        Дожидается завершения обработчиков и отправляет их подтверждения.
+
+        Пока обработчики работают, поток соединения продолжает обрабатывать события,
+        чтобы выполнить запланированные ack/nack. Если соединение закрыто или потеряно,
+        подтверждения отправить нельзя: брокер сам вернёт сообщения в очередь, а метод
+        только дожидается обработчиков.
+        """
+        try:
+            while self.in_flight and connection.is_open:
+                connection.process_data_events(time_limit=0.1)
+            self._executor.shutdown(wait=True)
+            if connection.is_open:
+                connection.process_data_events(time_limit=0)
+        except AMQPError as e:
+            logger.warning("Соединение потеряно, подтверждения обработчиков не отправлены: %s", e)
+        finally:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,208 @@
+"""
+Идемпотентная обработка: пропуск повторных доставок одного и того же сообщения.
+
+Повторы возникают при requeue, после падения consumer'а (неподтверждённые сообщения
+доставляются заново) и при повторной публикации at-least-once publisher'ом. Перед вызовом
+обработчика ключ сообщения резервируется в хранилище; если он уже есть, сообщение
+подтверждается (ack) без вызова обработчика.
+
+Ключ резервируется атомарно до обработки, поэтому копия, пришедшая во время обработки
+оригинала, тоже пропускается. Если обработчик выбросил исключение или вернул сообщение
+в очередь (nack/reject с requeue=True), ключ освобождается и повторная доставка будет
+обработана.
+
+Ключ - message_id или хэш тела, дополненный номером попытки: сообщение, вернувшееся через
+dead-letter (повтор через очереди задержки, повторная отправка из DLQ), - это новая попытка,
+а не дубликат. Хэш тела одинаков у разных сообщений с одинаковым содержимым, поэтому
+publisher'ы должны задавать message_id (publisher'ы проекта задают uuid4).
+
+Хранилище по умолчанию - MemoryDedupStore в памяти процесса: оно защищает от повторов
+внутри процесса (requeue, повторная публикация), но не от повторной доставки после его
+падения - ключи теряются вместе с процессом. Для этого и для нескольких consumer'ов нужно
+общее хранилище, реализующее протокол DedupStore, например поверх Redis:
+
+    class RedisDedupStore:
+        def add(self, key):
+            return bool(redis.set(f"dedup:{key}", 1, nx=True, ex=3600))
+
+        def discard(self, key):
+            redis.delete(f"dedup:{key}")
+
+Для aio_pika методы хранилища могут быть асинхронными.
+"""
+import functools
+import hashlib
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional, Protocol, Union
+
+from delivery import settle_hooks_channel, settle_hooks_message
+from metrics import get_metrics
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractIncomingMessage
+    from pika.adapters.blocking_connection import BlockingChannel
+    from pika.spec import Basic, BasicProperties
+
+logger = logging.getLogger(__name__)
+
+REPLAY_COUNT_HEADER = "x-replay-count"
+
+
+class DedupStore(Protocol):
+
+    def add(self, key: str) -> Union[bool, Awaitable[bool]]:
+        """Добавляет ключ, возвращает False, если он уже был."""
+        ...
+
+    def discard(self, key: str) -> Union[None, Awaitable[None]]:
+        """Удаляет ключ."""
+        ...
+
+
+class MemoryDedupStore:
+    """
+    LRU-хранилище ключей с ограничением по размеру и времени жизни с момента последнего обращения.
+
+    :param max_size: Максимальное количество ключей, при переполнении вытесняются самые старые.
+    :param ttl: Время жизни ключа в секундах (None - без ограничения).
+    """
+
+    def __init__(self, max_size: int = 100_000, ttl: Optional[float] = 3600.0):
+        if max_size < 1:
+            raise ValueError("max_size must be greater than 0")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._keys: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        # Время жизни у всех ключей одинаковое, поэтому истёкшие ключи всегда в начале.
+        while self._keys:
+            key, expires = next(iter(self._keys.items()))
+            if expires > now:
+                break
+            del self._keys[key]
+
+    def add(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self.ttl is not None:
+                self._expire(now)
+            duplicate = key in self._keys
+            # Повторное обращение продлевает жизнь ключа, так что порядок по времени истечения сохраняется.
+            self._keys[key] = now + self.ttl if self.ttl is not None else float("inf")
+            self._keys.move_to_end(key)
+            if duplicate:
+                return False
+            if len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+            return True
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if self.ttl is not None:
+                self._expire(time.monotonic())
+            return key in self._keys
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self.ttl is not None:
+                self._expire(time.monotonic())
+            return len(self._keys)
+
+
+def dedup_key(message_id: Optional[str], body: bytes, headers: Optional[dict[str, Any]] = None) -> str:
+    """
+    Ключ сообщения: message_id или хэш тела и номер попытки.
+
+    Номер попытки - сумма счётчиков x-death и значение x-replay-count: он меняется, когда
+    сообщение проходит через dead-letter, и не меняется при повторной доставке той же копии.
+    """
+    key = message_id or "body:" + hashlib.blake2b(body, digest_size=16).hexdigest()
+    headers = headers or {}
+    deaths = sum(int(death.get("count") or 0) for death in headers.get("x-death") or [])
+    replays = int(headers.get(REPLAY_COUNT_HEADER) or 0)
+    return f"{key}#{deaths}.{replays}" if deaths or replays else key
+
+
+async def _resolve(value: Any) -> Any:
+    return await value if inspect.isawaitable(value) else value
+
+
+class _RequeueTracking:
+    """Хук для обёрток `delivery`, запоминающий возврат сообщения в очередь."""
+
+    def __init__(self):
+        self.requeued = False
+
+    def __call__(self, method: str, requeue: bool) -> None:
+        self.requeued = self.requeued or requeue
+
+
+def deduplicating(
+        on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+        store: DedupStore,
+        auto_ack: bool = False,
+        queue: str = "",
+) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None]:
+    """
+    Оборачивает pika callback пропуском повторных доставок.
+
+    Хранилище должно быть синхронным. Повторная доставка подтверждается через канал обработчика,
+    поэтому обёртку можно использовать и внутри ThreadedCallback.
+    """
+    metrics = get_metrics()
+
+    @functools.wraps(on_message_callback)
+    def wrapper(channel, method, properties, body):
+        key = dedup_key(properties.message_id, body, properties.headers)
+        if not store.add(key):
+            logger.debug("Skipping duplicate message %s", key)
+            metrics.duplicates.inc(queue=queue)
+            if not auto_ack:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+            return None
+        tracking = _RequeueTracking()
+        try:
+            result = on_message_callback(settle_hooks_channel(channel, tracking), method, properties, body)
+        except BaseException:
+            store.discard(key)
+            raise
+        if tracking.requeued:
+            store.discard(key)
+        return result
+
+    return wrapper
+
+
+async def call_deduplicated(
+        on_message_callback: Callable[["AbstractIncomingMessage"], Awaitable[Any]],
+        message: "AbstractIncomingMessage",
+        store: DedupStore,
+        auto_ack: bool = False,
+        queue: str = "",
+) -> None:
+    """Вызывает aio_pika обработчик, если сообщение не было обработано ранее."""
+    key = dedup_key(message.message_id, message.body, message.headers)
+    if not await _resolve(store.add(key)):
+        logger.debug("Skipping duplicate message %s", key)
+        get_metrics().duplicates.inc(queue=queue)
+        if not auto_ack:
+            await message.ack()
+        return
+    tracking = _RequeueTracking()
+    try:
+        await on_message_callback(settle_hooks_message(message, tracking))  # type: ignore[arg-type]
+    except BaseException:
+        await _resolve(store.discard(key))
+        raise
+    if tracking.requeued:
+        await _resolve(store.discard(key))
@@ -0,0 +1,114 @@
+"""
+Обёртки канала pika и сообщения aio_pika, сообщающие об ack/nack/reject обработчика.
+
+Метрикам, трассировке и дедупликации нужно знать, как обработчик завершил сообщение.
+Вместо отдельной обёртки для каждой из них на доставку создаётся одна: каждый слой
+добавляет к ней свой хук через `settle_hooks_channel` / `settle_hooks_message`, а если
+обёртка уже создана внешним слоем, использует её же. Хук вызывается после успешного
+ack/nack/reject с названием метода и признаком requeue; момент первого вызова
+ack/nack/reject (до ответа брокера) хранится в `settle_started`.
+
+Обёртка сообщения aio_pika также может подменять тело (например, распакованным),
+не изменяя само IncomingMessage.
+"""
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractIncomingMessage
+    from pika.adapters.blocking_connection import BlockingChannel
+
+SettleHook = Callable[[str, bool], None]
+
+
+class SettleHooksChannel:
+    """Обёртка над каналом pika, вызывающая хуки после basic_ack/basic_nack/basic_reject."""
+
+    def __init__(self, channel: "BlockingChannel"):
+        self._channel = channel
+        self.hooks: list[SettleHook] = []
+        self.settle_started: Optional[float] = None
+
+    def _settling(self) -> None:
+        if self.settle_started is None:
+            self.settle_started = time.perf_counter()
+
+    def _settled(self, method: str, requeue: bool) -> None:
+        for hook in self.hooks:
+            hook(method, requeue)
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self._settling()
+        self._channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+        self._settled("ack", False)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        self._settling()
+        self._channel.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+        self._settled("nack", requeue)
+
+    def basic_reject(self, delivery_tag: int = 0, requeue: bool = True) -> None:
+        self._settling()
+        self._channel.basic_reject(delivery_tag=delivery_tag, requeue=requeue)
+        self._settled("reject", requeue)
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._channel, item)
+
+
+class SettleHooksMessage:
+    """
+    Обёртка над aio_pika сообщением, вызывающая хуки после ack/nack/reject.
+
+    :param message: Входящее сообщение.
+    :param body: Тело, которое видят обработчики вместо message.body (например, распакованное).
+        Если задано, content_encoding обёртки - None.
+    """
+
+    def __init__(self, message: "AbstractIncomingMessage", body: Optional[bytes] = None):
+        self._message = message
+        self.hooks: list[SettleHook] = []
+        self.settle_started: Optional[float] = None
+        if body is not None:
+            self.body = body
+            self.content_encoding = None
+
+    def _settling(self) -> None:
+        if self.settle_started is None:
+            self.settle_started = time.perf_counter()
+
+    def _settled(self, method: str, requeue: bool) -> None:
+        for hook in self.hooks:
+            hook(method, requeue)
+
+    async def ack(self, multiple: bool = False) -> None:
+        self._settling()
+        await self._message.ack(multiple=multiple)
+        self._settled("ack", False)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        self._settling()
+        await self._message.nack(multiple=multiple, requeue=requeue)
+        self._settled("nack", requeue)
+
+    async def reject(self, requeue: bool = False) -> None:
+        self._settling()
+        await self._message.reject(requeue=requeue)
+        self._settled("reject", requeue)
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._message, item)
+
+
+def settle_hooks_channel(channel: "BlockingChannel", hook: SettleHook) -> SettleHooksChannel:
+    """Добавляет хук к обёртке канала, созданной внешним слоем, или оборачивает канал."""
+    wrapper = channel if isinstance(channel, SettleHooksChannel) else SettleHooksChannel(channel)
+    wrapper.hooks.append(hook)
+    return wrapper
+
+
+def settle_hooks_message(message: "AbstractIncomingMessage", hook: SettleHook) -> SettleHooksMessage:
+    """Добавляет хук к обёртке сообщения, созданной внешним слоем, или оборачивает сообщение."""
+    wrapper = message if isinstance(message, SettleHooksMessage) else SettleHooksMessage(message)
+    wrapper.hooks.append(hook)
+    return wrapper
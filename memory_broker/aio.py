@@ -0,0 +1,498 @@
+"""
+Адаптер брокера в памяти с интерфейсом aio_pika.
+
+`connect_robust("memory://")` возвращает соединение, каналы которого поддерживают методы,
+используемые QueueRabbitClient: объявление обменников и очередей, привязки, set_qos,
+публикацию с подтверждениями и потребление через consume()/iterator(). Входящие
+сообщения - настоящие aio_pika.IncomingMessage, подтверждения которых уходят в брокер.
+"""
+import asyncio
+import functools
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from aio_pika import IncomingMessage
+from aio_pika.abc import AbstractMessage
+from aiormq.abc import DeliveredMessage
+from aiormq.exceptions import (
+    ChannelClosed, ChannelInvalidStateError, ChannelLockedResource, ChannelNotFoundEntity, ChannelPreconditionFailed)
+from pamqp.commands import Basic, Queue as QueueCommands
+from pamqp.header import ContentHeader
+
+from memory_broker.broker import (
+    MEMORY_URL_SCHEME, BrokerError, MemoryBroker, NotFound, PreconditionFailed, Properties, ResourceLocked,
+    StoredMessage, broker_from_url)
+
+logger = logging.getLogger(__name__)
+
+
+def _translate(error: BrokerError) -> ChannelClosed:
+    if isinstance(error, NotFound):
+        return ChannelNotFoundEntity(error.reply_code, error.reply_text)
+    if isinstance(error, PreconditionFailed):
+        return ChannelPreconditionFailed(error.reply_code, error.reply_text)
+    if isinstance(error, ResourceLocked):
+        return ChannelLockedResource(error.reply_code, error.reply_text)
+    return ChannelClosed(error.reply_code, error.reply_text)
+
+
+def from_aio_message(message: AbstractMessage) -> Properties:
+    properties = message.properties
+    timestamp = properties.timestamp
+    return Properties(
+        content_type=properties.content_type,
+        content_encoding=properties.content_encoding,
+        headers=dict(properties.headers) if properties.headers else None,
+        delivery_mode=int(properties.delivery_mode) if properties.delivery_mode is not None else None,
+        priority=properties.priority,
+        correlation_id=properties.correlation_id,
+        reply_to=properties.reply_to,
+        expiration=properties.expiration,
+        message_id=properties.message_id,
+        timestamp=int(timestamp.timestamp()) if isinstance(timestamp, datetime) else timestamp,
+        type=properties.message_type,
+        user_id=properties.user_id,
+        app_id=properties.app_id,
+        cluster_id=properties.cluster_id or None,
+    )
+
+
+def to_pamqp_properties(properties: Properties) -> Basic.Properties:
+    timestamp = properties.timestamp
+    return Basic.Properties(
+        content_type=properties.content_type,
+        content_encoding=properties.content_encoding,
+        headers=dict(properties.headers) if properties.headers else None,
+        delivery_mode=properties.delivery_mode,
+        priority=properties.priority,
+        correlation_id=properties.correlation_id,
+        reply_to=properties.reply_to,
+        expiration=properties.expiration,
+        message_id=properties.message_id,
+        timestamp=datetime.fromtimestamp(timestamp, tz=timezone.utc) if timestamp is not None else None,
+        message_type=properties.type,
+        user_id=properties.user_id,
+        app_id=properties.app_id,
+        cluster_id=properties.cluster_id or "",
+    )
+
+
+class _ServerCapabilities:
+    """Возможности сервера, которые aio_pika проверяет перед nack."""
+    basic_nack = True
+    publisher_confirms = True
+
+
+class LowLevelChannel:
+    """
+    Аналог aiormq канала: его возвращает IncomingMessage.channel,
+    через него выполняются ack/nack/reject входящих сообщений.
+    """
+
+    def __init__(self, channel: "MemoryChannel"):
+        self._channel = channel
+        self.connection = _ServerCapabilities()
+
+    @property
+    def is_closed(self) -> bool:
+        return self._channel.is_closed
+
+    async def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self._channel._call(self._channel.broker.ack, delivery_tag, multiple)
+
+    async def basic_nack(self, delivery_tag: Optional[int] = None, multiple: bool = False, requeue: bool = True) -> None:
+        self._channel._call(self._channel.broker.nack, delivery_tag or 0, multiple, requeue)
+
+    async def basic_reject(self, delivery_tag: int, *, requeue: bool = True) -> None:
+        self._channel._call(self._channel.broker.reject, delivery_tag, requeue)
+
+
+class MemoryConnection:
+    """Аналог aio_pika.RobustConnection для брокера в памяти."""
+
+    def __init__(self, broker: MemoryBroker):
+        self.broker = broker
+        self.connection_id = f"memory-{uuid.uuid4().hex}"
+        self._channels: list[MemoryChannel] = []
+        self._closed = False
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def __repr__(self) -> str:
+        return f"<MemoryConnection broker={self.broker.name!r} closed={self._closed}>"
+
+    async def channel(
+            self,
+            channel_number: Optional[int] = None,
+            publisher_confirms: bool = True,
+            on_return_raises: bool = False,
+    ) -> "MemoryChannel":
+        if self._closed:
+            raise RuntimeError("Connection closed")
+        channel = MemoryChannel(self, publisher_confirms=publisher_confirms)
+        self._channels.append(channel)
+        return channel
+
+    async def close(self, exc: Optional[BaseException] = None) -> None:
+        if self._closed:
+            return
+        for channel in self._channels:
+            await channel.close()
+        self.broker.close_connection(self.connection_id)
+        self._closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class MemoryChannel:
+    """Аналог aio_pika.Channel для брокера в памяти."""
+
+    def __init__(self, connection: MemoryConnection, publisher_confirms: bool = True):
+        self.connection = connection
+        self.broker = connection.broker
+        self.publisher_confirms = publisher_confirms
+        self._state = self.broker.open_channel(connection.connection_id)
+        self._loop = asyncio.get_running_loop()
+        self._low_level = LowLevelChannel(self)
+        self._closed = False
+        self._close_callbacks: list[Callable[[], None]] = []
+        self.default_exchange = MemoryExchange(self, "", "direct")
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def _call(self, method: Callable, *args: Any, **kwargs: Any) -> Any:
+        if self._closed:
+            raise ChannelInvalidStateError("Channel closed")
+        try:
+            return method(self._state, *args, **kwargs)
+        except BrokerError as e:
+            self._close_state()
+            raise _translate(e) from e
+
+    def _topology(self, method: Callable, *args: Any, **kwargs: Any) -> Any:
+        if self._closed:
+            raise ChannelInvalidStateError("Channel closed")
+        try:
+            return method(*args, **kwargs)
+        except BrokerError as e:
+            self._close_state()
+            raise _translate(e) from e
+
+    def _close_state(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.broker.close_channel(self._state)
+        for callback in self._close_callbacks:
+            callback()
+        self._close_callbacks.clear()
+
+    async def close(self, exc: Optional[BaseException] = None) -> None:
+        self._close_state()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def set_qos(
+            self,
+            prefetch_count: int = 0,
+            prefetch_size: int = 0,
+            global_: bool = False,
+            timeout: Any = None,
+            all_channels: Optional[bool] = None,
+    ) -> None:
+        self._call(self.broker.basic_qos, prefetch_count, global_)
+
+    async def declare_exchange(
+            self,
+            name: str,
+            type: Union[str, Any] = "direct",
+            *,
+            durable: bool = False,
+            auto_delete: bool = False,
+            internal: bool = False,
+            passive: bool = False,
+            arguments: Optional[dict] = None,
+            timeout: Any = None,
+    ) -> "MemoryExchange":
+        exchange_type = getattr(type, "value", type)
+        declared = self._topology(
+            self.broker.exchange_declare, name, exchange_type, passive, durable, auto_delete, internal, arguments,
+        )
+        return MemoryExchange(self, name, declared.type)
+
+    async def get_exchange(self, name: str, *, ensure: bool = True) -> "MemoryExchange":
+        if not name:
+            return self.default_exchange
+        if ensure:
+            return await self.declare_exchange(name, passive=True)
+        return MemoryExchange(self, name, "direct")
+
+    async def declare_queue(
+            self,
+            name: Optional[str] = None,
+            *,
+            durable: bool = False,
+            exclusive: bool = False,
+            passive: bool = False,
+            auto_delete: bool = False,
+            arguments: Optional[dict] = None,
+            timeout: Any = None,
+    ) -> "MemoryQueue":
+        queue_name, message_count, consumer_count = self._topology(
+            self.broker.queue_declare, name or "", passive, durable, exclusive, auto_delete, arguments,
+            connection_id=self.connection.connection_id,
+        )
+        queue = MemoryQueue(self, queue_name, durable=durable, exclusive=exclusive, auto_delete=auto_delete,
+                            arguments=arguments)
+        queue.declaration_result = QueueCommands.DeclareOk(queue_name, message_count, consumer_count)
+        return queue
+
+    async def get_queue(self, name: str, *, ensure: bool = True) -> "MemoryQueue":
+        if ensure:
+            return await self.declare_queue(name, passive=True)
+        return MemoryQueue(self, name)
+
+    async def queue_delete(self, queue_name: str, timeout: Any = None, if_unused: bool = False,
+                           if_empty: bool = False, nowait: bool = False) -> None:
+        self._topology(self.broker.queue_delete, queue_name, if_unused=if_unused, if_empty=if_empty)
+
+    async def exchange_delete(self, exchange_name: str, timeout: Any = None, if_unused: bool = False,
+                              nowait: bool = False) -> None:
+        self._topology(self.broker.exchange_delete, exchange_name, if_unused=if_unused)
+
+    def _incoming(self, consumer_tag: Optional[str], delivery_tag: int, message: StoredMessage,
+                  no_ack: bool, message_count: Optional[int] = None) -> IncomingMessage:
+        if consumer_tag is None:
+            delivery: Any = Basic.GetOk(
+                delivery_tag=delivery_tag,
+                redelivered=message.redelivered,
+                exchange=message.exchange,
+                routing_key=message.routing_key,
+                message_count=message_count,
+            )
+        else:
+            delivery = Basic.Deliver(
+                consumer_tag=consumer_tag,
+                delivery_tag=delivery_tag,
+                redelivered=message.redelivered,
+                exchange=message.exchange,
+                routing_key=message.routing_key,
+            )
+        delivered = DeliveredMessage(
+            delivery=delivery,
+            header=ContentHeader(body_size=len(message.body), properties=to_pamqp_properties(message.properties)),
+            body=message.body,
+            channel=self._low_level,  # type: ignore
+        )
+        return IncomingMessage(delivered, no_ack=no_ack)
+
+    def _consume(self, queue: str, on_message: Callable[[IncomingMessage], None], no_ack: bool,
+                 exclusive: bool, consumer_tag: Optional[str]) -> str:
+        tag = consumer_tag or f"ctag-{uuid.uuid4().hex}"
+
+        def deliver(delivery_tag: int, message: StoredMessage) -> None:
+            # Брокер может доставлять из другого потока (например, по истечении TTL).
+            self._loop.call_soon_threadsafe(
+                lambda: self._closed or on_message(self._incoming(tag, delivery_tag, message, no_ack))
+            )
+
+        return self._call(self.broker.basic_consume, queue, deliver, no_ack=no_ack, exclusive=exclusive,
+                          consumer_tag=tag)
+
+
+class MemoryExchange:
+    """Аналог aio_pika.Exchange."""
+
+    def __init__(self, channel: MemoryChannel, name: str, type: str):
+        self.channel = channel
+        self.name = name
+        self.type = type
+
+    def __repr__(self) -> str:
+        return f"<MemoryExchange name={self.name!r} type={self.type!r}>"
+
+    async def publish(
+            self,
+            message: AbstractMessage,
+            routing_key: str,
+            *,
+            mandatory: bool = True,
+            immediate: bool = False,
+            timeout: Any = None,
+    ) -> Optional[Basic.Ack]:
+        self.channel._topology(
+            self.channel.broker.publish, self.name, routing_key, message.body, from_aio_message(message),
+            channel=self.channel._state,
+        )
+        if self.channel.publisher_confirms:
+            return Basic.Ack()
+        return None
+
+    async def delete(self, if_unused: bool = False, timeout: Any = None) -> None:
+        await self.channel.exchange_delete(self.name, if_unused=if_unused)
+
+
+class MemoryQueue:
+    """Аналог aio_pika.Queue."""
+
+    def __init__(self, channel: MemoryChannel, name: str, durable: bool = False, exclusive: bool = False,
+                 auto_delete: bool = False, arguments: Optional[dict] = None):
+        self.channel = channel
+        self.name = name
+        self.durable = durable
+        self.exclusive = exclusive
+        self.auto_delete = auto_delete
+        self.arguments = arguments
+        self.declaration_result = QueueCommands.DeclareOk(name, 0, 0)
+        self.close_callbacks: set[Callable] = set()
+
+    def __repr__(self) -> str:
+        return f"<MemoryQueue name={self.name!r}>"
+
+    async def bind(
+            self,
+            exchange: Union[MemoryExchange, str],
+            routing_key: Optional[str] = None,
+            *,
+            arguments: Optional[dict] = None,
+            timeout: Any = None,
+    ) -> None:
+        exchange_name = exchange if isinstance(exchange, str) else exchange.name
+        self.channel._topology(self.channel.broker.queue_bind, self.name, exchange_name, routing_key, arguments)
+
+    async def unbind(
+            self,
+            exchange: Union[MemoryExchange, str],
+            routing_key: Optional[str] = None,
+            arguments: Optional[dict] = None,
+            timeout: Any = None,
+    ) -> None:
+        exchange_name = exchange if isinstance(exchange, str) else exchange.name
+        self.channel._topology(self.channel.broker.queue_unbind, self.name, exchange_name, routing_key, arguments)
+
+    async def consume(
+            self,
+            callback: Callable[[IncomingMessage], Awaitable[Any]],
+            no_ack: bool = False,
+            exclusive: bool = False,
+            arguments: Optional[dict] = None,
+            consumer_tag: Optional[str] = None,
+            timeout: Any = None,
+    ) -> str:
+        """Регистрирует consumer'а, каждый обработчик запускается отдельной задачей, как в aio_pika."""
+        def on_message(message: IncomingMessage) -> None:
+            asyncio.ensure_future(callback(message))
+
+        return self.channel._consume(self.name, on_message, no_ack, exclusive, consumer_tag)
+
+    async def cancel(self, consumer_tag: str, timeout: Any = None, nowait: bool = False) -> None:
+        if not self.channel.is_closed:
+            self.channel._call(self.channel.broker.basic_cancel, consumer_tag)
+
+    async def get(self, *, no_ack: bool = False, fail: bool = True, timeout: Any = 5) -> Optional[IncomingMessage]:
+        result = self.channel._call(self.channel.broker.basic_get, self.name, no_ack)
+        if result is None:
+            if fail:
+                raise asyncio.QueueEmpty()
+            return None
+        delivery_tag, message, message_count = result
+        return self.channel._incoming(None, delivery_tag, message, no_ack, message_count)
+
+    async def purge(self, no_wait: bool = False, timeout: Any = None) -> QueueCommands.PurgeOk:
+        count = self.channel._topology(self.channel.broker.queue_purge, self.name)
+        return QueueCommands.PurgeOk(message_count=count)
+
+    async def delete(self, *, if_unused: bool = True, if_empty: bool = True, timeout: Any = None) -> None:
+        await self.channel.queue_delete(self.name, if_unused=if_unused, if_empty=if_empty)
+
+    def iterator(self, **kwargs: Any) -> "MemoryQueueIterator":
+        return MemoryQueueIterator(self, **kwargs)
+
+
+class MemoryQueueIterator:
+    """Аналог aio_pika.QueueIterator: буферизует доставки и отдаёт их через async for."""
+
+    def __init__(self, queue: MemoryQueue, **kwargs: Any):
+        self.queue = queue
+        self._consume_kwargs = kwargs
+        self._buffer: asyncio.Queue[Optional[IncomingMessage]] = asyncio.Queue()
+        self._consumer_tag: Optional[str] = None
+        self._closed = False
+
+    @property
+    def consumer_tag(self) -> Optional[str]:
+        return self._consumer_tag
+
+    async def consume(self) -> None:
+        self._consumer_tag = self.queue.channel._consume(
+            self.queue.name,
+            self._buffer.put_nowait,
+            no_ack=self._consume_kwargs.get("no_ack", False),
+            exclusive=self._consume_kwargs.get("exclusive", False),
+            consumer_tag=self._consume_kwargs.get("consumer_tag"),
+        )
+        self.queue.channel._close_callbacks.append(functools.partial(self._buffer.put_nowait, None))
+
+    async def close(self) -> None:
+        """Отменяет consumer'а и возвращает в очередь сообщения, не отданные обработчику."""
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer.put_nowait(None)
+        if self._consumer_tag is None or self.queue.channel.is_closed:
+            return
+        await self.queue.cancel(self._consumer_tag)
+        self._consumer_tag = None
+        while not self._buffer.empty():
+            message = self._buffer.get_nowait()
+            if message is not None and not message.processed:
+                await message.nack(requeue=True)
+
+    def __aiter__(self) -> "MemoryQueueIterator":
+        return self
+
+    async def __anext__(self) -> IncomingMessage:
+        if self._closed:
+            raise StopAsyncIteration
+        if self._consumer_tag is None:
+            await self.consume()
+        timeout = self._consume_kwargs.get("timeout")
+        try:
+            if timeout:
+                message = await asyncio.wait_for(self._buffer.get(), timeout=timeout)
+            else:
+                message = await self._buffer.get()
+        except asyncio.TimeoutError:
+            await self.close()
+            raise
+        if message is None:
+            self._closed = True
+            raise StopAsyncIteration
+        return message
+
+    async def __aenter__(self) -> "MemoryQueueIterator":
+        if self._consumer_tag is None:
+            await self.consume()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+
+async def connect_robust(url: str = MEMORY_URL_SCHEME, **kwargs: Any) -> MemoryConnection:
+    """Подключается к брокеру в памяти по URL вида `memory://<имя>`."""
+    return MemoryConnection(broker_from_url(url))
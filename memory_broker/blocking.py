@@ -0,0 +1,544 @@
+"""
+Адаптер брокера в памяти с интерфейсом pika.BlockingConnection / BlockingChannel.
+
+Обработчики вызываются в потоке, который крутит `start_consuming` или `process_data_events`,
+как и в pika. Доставки и `add_callback_threadsafe` передаются в этот поток через очередь событий.
+"""
+import functools
+import itertools
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Iterator, Optional
+
+from pika import spec
+from pika.exceptions import ChannelClosedByBroker, ChannelWrongStateError, ConnectionWrongStateError
+from pika.frame import Method
+
+from memory_broker.broker import (
+    MEMORY_URL_SCHEME, BrokerError, MemoryBroker, PreconditionFailed, Properties, StoredMessage, broker_from_url)
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryConnectionParameters:
+    """
+    Параметры подключения к брокеру в памяти.
+
+    Передаются вместо pika.ConnectionParameters, например `RabbitMQClientBase(connection_params=...)`.
+    """
+
+    def __init__(self, url: str = MEMORY_URL_SCHEME):
+        self.url = url
+        self.host = url
+        self.port = 0
+        self.virtual_host = "/"
+        self.credentials = None
+
+    @property
+    def broker(self) -> MemoryBroker:
+        return broker_from_url(self.url)
+
+
+def to_pika_properties(properties: Properties) -> spec.BasicProperties:
+    return spec.BasicProperties(
+        content_type=properties.content_type,
+        content_encoding=properties.content_encoding,
+        headers=dict(properties.headers) if properties.headers else None,
+        delivery_mode=properties.delivery_mode,
+        priority=properties.priority,
+        correlation_id=properties.correlation_id,
+        reply_to=properties.reply_to,
+        expiration=properties.expiration,
+        message_id=properties.message_id,
+        timestamp=properties.timestamp,
+        type=properties.type,
+        user_id=properties.user_id,
+        app_id=properties.app_id,
+        cluster_id=properties.cluster_id,
+    )
+
+
+def from_pika_properties(properties: Optional[spec.BasicProperties]) -> Properties:
+    if properties is None:
+        return Properties()
+    delivery_mode = properties.delivery_mode
+    return Properties(
+        content_type=properties.content_type,
+        content_encoding=properties.content_encoding,
+        headers=dict(properties.headers) if properties.headers else None,
+        delivery_mode=int(delivery_mode) if delivery_mode is not None else None,
+        priority=properties.priority,
+        correlation_id=properties.correlation_id,
+        reply_to=properties.reply_to,
+        expiration=properties.expiration,
+        message_id=properties.message_id,
+        timestamp=properties.timestamp,
+        type=properties.type,
+        user_id=properties.user_id,
+        app_id=properties.app_id,
+        cluster_id=properties.cluster_id,
+    )
+
+
+class BlockingConnection:
+    """Аналог pika.BlockingConnection для брокера в памяти."""
+
+    def __init__(self, parameters: Optional[MemoryConnectionParameters] = None):
+        parameters = parameters or MemoryConnectionParameters()
+        self.broker: MemoryBroker = parameters.broker
+        self.connection_id = f"memory-{uuid.uuid4().hex}"
+        self._events: "queue.SimpleQueue[Callable[[], None]]" = queue.SimpleQueue()
+        self._channels: dict[int, BlockingChannel] = {}
+        self._channel_numbers = itertools.count(1)
+        self._open = True
+        self._blocked_callbacks: list[Callable[["BlockingConnection", Method], None]] = []
+        self._unblocked_callbacks: list[Callable[["BlockingConnection", Method], None]] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    @property
+    def is_closed(self) -> bool:
+        return not self._open
+
+    def channel(self, channel_number: Optional[int] = None) -> "BlockingChannel":
+        if not self._open:
+            raise ConnectionWrongStateError("Connection is closed")
+        number = channel_number or next(self._channel_numbers)
+        channel = BlockingChannel(self, number)
+        self._channels[number] = channel
+        return channel
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        """Планирует вызов callback в потоке соединения (можно вызывать из любого потока)."""
+        if not self._open:
+            raise ConnectionWrongStateError("Connection is closed")
+        self._events.put(callback)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> threading.Timer:
+        """Планирует вызов callback в потоке соединения через delay секунд."""
+        if not self._open:
+            raise ConnectionWrongStateError("Connection is closed")
+        timer = threading.Timer(delay, self._events.put, (callback,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def remove_timeout(self, timeout_id: threading.Timer) -> None:
+        timeout_id.cancel()
+
+    def add_on_connection_blocked_callback(self, callback: Callable[["BlockingConnection", Method], None]) -> None:
+        self._blocked_callbacks.append(callback)
+        self.broker.add_alarm_listener(self.connection_id, self._on_alarm)
+
+    def add_on_connection_unblocked_callback(self, callback: Callable[["BlockingConnection", Method], None]) -> None:
+        self._unblocked_callbacks.append(callback)
+        self.broker.add_alarm_listener(self.connection_id, self._on_alarm)
+
+    def _on_alarm(self, reason: Optional[str]) -> None:
+        """Вызывается брокером (в любом потоке), уведомление обрабатывается в потоке соединения."""
+        if reason is None:
+            frame = Method(0, spec.Connection.Unblocked())
+            callbacks = self._unblocked_callbacks
+        else:
+            frame = Method(0, spec.Connection.Blocked(reason=reason))
+            callbacks = self._blocked_callbacks
+        if self._open:
+            self._events.put(functools.partial(self._run_alarm_callbacks, list(callbacks), frame))
+
+    def _run_alarm_callbacks(self, callbacks: list[Callable[["BlockingConnection", Method], None]], frame: Method) -> None:
+        for callback in callbacks:
+            callback(self, frame)
+
+    def _run_event(self, timeout: Optional[float]) -> bool:
+        try:
+            if timeout is None:
+                event = self._events.get()
+            elif timeout <= 0:
+                event = self._events.get_nowait()
+            else:
+                event = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        event()
+        return True
+
+    def process_data_events(self, time_limit: Optional[float] = 0) -> None:
+        """
+        Выполняет накопившиеся доставки и callback'и.
+
+        time_limit=0 - не ждать, None - ждать хотя бы одного события,
+        положительное значение - ждать событий не дольше time_limit секунд.
+        """
+        if not self._open:
+            raise ConnectionWrongStateError("Connection is closed")
+        if time_limit is None:
+            self._run_event(None)
+        elif time_limit > 0:
+            self._run_event(time_limit)
+        while self._open and self._run_event(0):
+            pass
+
+    def sleep(self, duration: float) -> None:
+        deadline = time.monotonic() + duration
+        while self._open:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.process_data_events(time_limit=remaining)
+
+    def close(self, reply_code: int = 200, reply_text: str = "Normal shutdown") -> None:
+        if not self._open:
+            raise ConnectionWrongStateError("Connection is already closed")
+        for channel in list(self._channels.values()):
+            if channel.is_open:
+                channel.close()
+        self.broker.close_connection(self.connection_id)
+        self._open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._open:
+            self.close()
+
+
+def _translate_errors(method: Callable) -> Callable:
+    """Преобразует ошибки брокера в ChannelClosedByBroker и закрывает канал, как настоящий брокер."""
+    @functools.wraps(method)
+    def wrapper(self: "BlockingChannel", *args, **kwargs):
+        if not self.is_open:
+            raise ChannelWrongStateError("Channel is closed.")
+        try:
+            return method(self, *args, **kwargs)
+        except BrokerError as e:
+            self._close_state()
+            raise ChannelClosedByBroker(e.reply_code, e.reply_text) from e
+    return wrapper
+
+
+class BlockingChannel:
+    """Аналог pika.adapters.blocking_connection.BlockingChannel для брокера в памяти."""
+
+    def __init__(self, connection: BlockingConnection, channel_number: int):
+        self._connection = connection
+        self.channel_number = channel_number
+        self._broker = connection.broker
+        self._state = self._broker.open_channel(connection.connection_id)
+        self._callbacks: dict[str, Callable] = {}
+        self._auto_ack: dict[str, bool] = {}
+        self._cancelled: set[str] = set()
+        self._generator_tag: Optional[str] = None
+        self._generator_buffer: deque[tuple[spec.Basic.Deliver, spec.BasicProperties, bytes]] = deque()
+        self._transaction: Optional[list[tuple[str, str, bytes, Properties]]] = None
+        self._open = True
+
+    def __repr__(self) -> str:
+        return f"<MemoryBlockingChannel number={self.channel_number} open={self._open}>"
+
+    @property
+    def connection(self) -> BlockingConnection:
+        return self._connection
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    @property
+    def is_closed(self) -> bool:
+        return not self._open
+
+    def _close_state(self) -> None:
+        self._open = False
+        self._callbacks.clear()
+        self._generator_tag = None
+        self._broker.close_channel(self._state)
+
+    def close(self, reply_code: int = 0, reply_text: str = "Normal shutdown") -> None:
+        if not self._open:
+            raise ChannelWrongStateError("Channel is closed.")
+        self._close_state()
+
+    # Топология
+
+    @_translate_errors
+    def exchange_declare(
+            self,
+            exchange: str,
+            exchange_type: Any = "direct",
+            passive: bool = False,
+            durable: bool = False,
+            auto_delete: bool = False,
+            internal: bool = False,
+            arguments: Optional[dict] = None,
+    ) -> Method:
+        exchange_type = getattr(exchange_type, "value", exchange_type)
+        self._broker.exchange_declare(exchange, exchange_type, passive, durable, auto_delete, internal, arguments)
+        return Method(self.channel_number, spec.Exchange.DeclareOk())
+
+    @_translate_errors
+    def exchange_delete(self, exchange: Optional[str] = None, if_unused: bool = False) -> Method:
+        self._broker.exchange_delete(exchange or "", if_unused=if_unused)
+        return Method(self.channel_number, spec.Exchange.DeleteOk())
+
+    @_translate_errors
+    def queue_declare(
+            self,
+            queue: str,
+            passive: bool = False,
+            durable: bool = False,
+            exclusive: bool = False,
+            auto_delete: bool = False,
+            arguments: Optional[dict] = None,
+    ) -> Method:
+        name, message_count, consumer_count = self._broker.queue_declare(
+            queue, passive, durable, exclusive, auto_delete, arguments,
+            connection_id=self._connection.connection_id,
+        )
+        return Method(self.channel_number, spec.Queue.DeclareOk(name, message_count, consumer_count))
+
+    @_translate_errors
+    def queue_bind(
+            self,
+            queue: str,
+            exchange: str,
+            routing_key: Optional[str] = None,
+            arguments: Optional[dict] = None,
+    ) -> Method:
+        self._broker.queue_bind(queue, exchange, routing_key, arguments)
+        return Method(self.channel_number, spec.Queue.BindOk())
+
+    @_translate_errors
+    def queue_unbind(
+            self,
+            queue: str,
+            exchange: Optional[str] = None,
+            routing_key: Optional[str] = None,
+            arguments: Optional[dict] = None,
+    ) -> Method:
+        self._broker.queue_unbind(queue, exchange or "", routing_key, arguments)
+        return Method(self.channel_number, spec.Queue.UnbindOk())
+
+    @_translate_errors
+    def queue_delete(self, queue: str, if_unused: bool = False, if_empty: bool = False) -> Method:
+        count = self._broker.queue_delete(queue, if_unused=if_unused, if_empty=if_empty)
+        return Method(self.channel_number, spec.Queue.DeleteOk(message_count=count))
+
+    @_translate_errors
+    def queue_purge(self, queue: str) -> Method:
+        count = self._broker.queue_purge(queue)
+        return Method(self.channel_number, spec.Queue.PurgeOk(message_count=count))
+
+    # Публикация
+
+    def confirm_delivery(self) -> None:
+        """Подтверждения публикации в памяти синхронны, включать нечего."""
+
+    @_translate_errors
+    def basic_publish(
+            self,
+            exchange: str,
+            routing_key: str,
+            body: bytes,
+            properties: Optional[spec.BasicProperties] = None,
+            mandatory: bool = False,
+    ) -> None:
+        if isinstance(body, str):
+            body = body.encode()
+        if self._transaction is not None:
+            self._transaction.append((exchange, routing_key, body, from_pika_properties(properties)))
+            return
+        self._broker.publish(exchange, routing_key, body, from_pika_properties(properties), channel=self._state)
+
+    # Транзакции: публикации копятся в канале и попадают в очереди при tx_commit.
+
+    @_translate_errors
+    def tx_select(self) -> Method:
+        if self._transaction is None:
+            self._transaction = []
+        return Method(self.channel_number, spec.Tx.SelectOk())
+
+    @_translate_errors
+    def tx_commit(self) -> Method:
+        if self._transaction is None:
+            raise PreconditionFailed("PRECONDITION_FAILED - channel is not transactional")
+        pending, self._transaction = self._transaction, []
+        # Как в RabbitMQ: публикация в несуществующий exchange отменяет всю транзакцию.
+        for exchange in {exchange for exchange, *_ in pending}:
+            self._broker.exchange_declare(exchange, passive=True)
+        for exchange, routing_key, body, properties in pending:
+            self._broker.publish(exchange, routing_key, body, properties, channel=self._state)
+        return Method(self.channel_number, spec.Tx.CommitOk())
+
+    @_translate_errors
+    def tx_rollback(self) -> Method:
+        if self._transaction is None:
+            raise PreconditionFailed("PRECONDITION_FAILED - channel is not transactional")
+        self._transaction = []
+        return Method(self.channel_number, spec.Tx.RollbackOk())
+
+    # Потребление
+
+    @_translate_errors
+    def basic_qos(self, prefetch_size: int = 0, prefetch_count: int = 0, global_qos: bool = False) -> None:
+        self._broker.basic_qos(self._state, prefetch_count, global_qos)
+
+    def _deliver(self, consumer_tag: str, delivery_tag: int, message: StoredMessage) -> None:
+        """Вызывается брокером (в любом потоке), доставка выполняется в потоке соединения."""
+        if self._connection.is_open:
+            self._connection.add_callback_threadsafe(
+                functools.partial(self._dispatch, consumer_tag, delivery_tag, message)
+            )
+
+    def _dispatch(self, consumer_tag: str, delivery_tag: int, message: StoredMessage) -> None:
+        method = spec.Basic.Deliver(
+            consumer_tag=consumer_tag,
+            delivery_tag=delivery_tag,
+            redelivered=message.redelivered,
+            exchange=message.exchange,
+            routing_key=message.routing_key,
+        )
+        properties = to_pika_properties(message.properties)
+        if consumer_tag == self._generator_tag:
+            self._generator_buffer.append((method, properties, message.body))
+            return
+        callback = self._callbacks.get(consumer_tag)
+        if callback is not None:
+            callback(self, method, properties, message.body)
+        elif consumer_tag in self._cancelled and self._open:
+            # Как pika: доставки отменённого consumer'а, не переданные обработчику, возвращаются в очередь.
+            self._broker.nack(self._state, delivery_tag, requeue=True)
+
+    @_translate_errors
+    def basic_consume(
+            self,
+            queue: str,
+            on_message_callback: Callable,
+            auto_ack: bool = False,
+            exclusive: bool = False,
+            consumer_tag: Optional[str] = None,
+            arguments: Optional[dict] = None,
+    ) -> str:
+        tag = consumer_tag or f"ctag{self.channel_number}.{uuid.uuid4().hex}"
+        self._callbacks[tag] = on_message_callback
+        self._auto_ack[tag] = auto_ack
+        self._broker.basic_consume(
+            self._state, queue, functools.partial(self._deliver, tag), no_ack=auto_ack,
+            exclusive=exclusive, consumer_tag=tag,
+        )
+        return tag
+
+    @_translate_errors
+    def basic_cancel(self, consumer_tag: str = "") -> list:
+        if self._callbacks.pop(consumer_tag, None) is not None and not self._auto_ack.pop(consumer_tag, False):
+            self._cancelled.add(consumer_tag)
+        self._broker.basic_cancel(self._state, consumer_tag)
+        return []
+
+    @property
+    def consumer_tags(self) -> list[str]:
+        return list(self._callbacks)
+
+    def start_consuming(self) -> None:
+        """Обрабатывает доставки, пока не будут отменены все consumer'ы (stop_consuming)."""
+        while self._open and self._callbacks:
+            self._connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag: Optional[str] = None) -> None:
+        tags = [consumer_tag] if consumer_tag else list(self._callbacks)
+        for tag in tags:
+            if self._open:
+                self.basic_cancel(tag)
+        if not consumer_tag:
+            self.cancel()
+
+    def consume(
+            self,
+            queue: str,
+            auto_ack: bool = False,
+            exclusive: bool = False,
+            arguments: Optional[dict] = None,
+            inactivity_timeout: Optional[float] = None,
+    ) -> Iterator[tuple]:
+        """
+        Генератор доставок, как BlockingChannel.consume в pika.
+
+        При inactivity_timeout возвращает (None, None, None), если сообщений не было.
+        """
+        if self._generator_tag is None:
+            tag = f"ctag{self.channel_number}.{uuid.uuid4().hex}"
+            self._generator_tag = tag
+            try:
+                self._broker.basic_consume(
+                    self._state, queue, functools.partial(self._deliver, tag), no_ack=auto_ack,
+                    exclusive=exclusive, consumer_tag=tag,
+                )
+            except BrokerError as e:
+                self._generator_tag = None
+                self._close_state()
+                raise ChannelClosedByBroker(e.reply_code, e.reply_text) from e
+        while self._open and (self._generator_tag is not None or self._generator_buffer):
+            if self._generator_buffer:
+                yield self._generator_buffer.popleft()
+                continue
+            self._connection.process_data_events(time_limit=inactivity_timeout)
+            if not self._generator_buffer and inactivity_timeout is not None and self._generator_tag is not None:
+                yield None, None, None
+
+    def cancel(self) -> int:
+        """Отменяет consumer генератора consume() и возвращает недоставленные обработчику сообщения в очередь."""
+        if self._generator_tag is None:
+            return 0
+        self._broker.basic_cancel(self._state, self._generator_tag)
+        self._generator_tag = None
+        pending = len(self._generator_buffer)
+        while self._generator_buffer:
+            method, _, _ = self._generator_buffer.pop()
+            if self._open:
+                self.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return pending
+
+    @_translate_errors
+    def basic_get(self, queue: str, auto_ack: bool = False) -> tuple:
+        result = self._broker.basic_get(self._state, queue, no_ack=auto_ack)
+        if result is None:
+            return None, None, None
+        delivery_tag, message, message_count = result
+        method = spec.Basic.GetOk(
+            delivery_tag=delivery_tag,
+            redelivered=message.redelivered,
+            exchange=message.exchange,
+            routing_key=message.routing_key,
+            message_count=message_count,
+        )
+        return method, to_pika_properties(message.properties), message.body
+
+    def get_waiting_message_count(self) -> int:
+        return len(self._generator_buffer)
+
+    # Подтверждения
+
+    @_translate_errors
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self._broker.ack(self._state, delivery_tag, multiple)
+
+    @_translate_errors
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        self._broker.nack(self._state, delivery_tag, multiple, requeue)
+
+    @_translate_errors
+    def basic_reject(self, delivery_tag: int = 0, requeue: bool = True) -> None:
+        self._broker.reject(self._state, delivery_tag, requeue)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._open:
+            self.close()
@@ -0,0 +1,815 @@
+"""
+Брокер AMQP в памяти процесса.
+
+Эмулирует обменники (direct, fanout, topic, headers), очереди, привязки, prefetch,
+ack/nack/reject, возврат в очередь, x-single-active-consumer, x-max-priority, direct reply-to
+(amq.rabbitmq.reply-to), connection.blocked/unblocked и dead-letter маршрутизацию (x-dead-letter-exchange,
+x-dead-letter-routing-key, TTL через expiration и x-message-ttl). Адаптеры в
+`memory_broker.blocking` и `memory_broker.aio` повторяют интерфейсы pika и aio_pika,
+поэтому клиенты проекта работают с брокером без сети.
+
+Все операции выполняются под одной блокировкой. Доставка сообщения consumer'у только
+передаёт его в адаптер, который вызывает обработчик в своём потоке или event loop.
+"""
+import bisect
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MEMORY_URL_SCHEME = "memory://"
+
+EXCHANGE_DIRECT = "direct"
+EXCHANGE_FANOUT = "fanout"
+EXCHANGE_TOPIC = "topic"
+EXCHANGE_HEADERS = "headers"
+EXCHANGE_TYPES = (EXCHANGE_DIRECT, EXCHANGE_FANOUT, EXCHANGE_TOPIC, EXCHANGE_HEADERS)
+
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class BrokerError(Exception):
+    """Ошибка канала, которую настоящий брокер вернул бы через Channel.Close."""
+    reply_code = 500
+
+    def __init__(self, reply_text: str):
+        super().__init__(self.reply_code, reply_text)
+        self.reply_text = reply_text
+
+
+class NotFound(BrokerError):
+    reply_code = 404
+
+
+class PreconditionFailed(BrokerError):
+    reply_code = 406
+
+
+class ResourceLocked(BrokerError):
+    reply_code = 405
+
+
+@dataclass
+class Properties:
+    """Свойства сообщения (имена полей как в pika.BasicProperties)."""
+    content_type: Optional[str] = None
+    content_encoding: Optional[str] = None
+    headers: Optional[dict[str, Any]] = None
+    delivery_mode: Optional[int] = None
+    priority: Optional[int] = None
+    correlation_id: Optional[str] = None
+    reply_to: Optional[str] = None
+    expiration: Optional[str] = None
+    message_id: Optional[str] = None
+    timestamp: Optional[int] = None
+    type: Optional[str] = None
+    user_id: Optional[str] = None
+    app_id: Optional[str] = None
+    cluster_id: Optional[str] = None
+
+
+@dataclass
+class StoredMessage:
+    body: bytes
+    properties: Properties
+    exchange: str
+    routing_key: str
+    redelivered: bool = False
+    expires_at: Optional[float] = None
+    position: int = 0
+
+
+@dataclass
+class Binding:
+    exchange: str
+    queue: str
+    routing_key: str
+    arguments: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Exchange:
+    name: str
+    type: str
+    durable: bool = False
+    auto_delete: bool = False
+    internal: bool = False
+    arguments: dict[str, Any] = field(default_factory=dict)
+    bindings: list[Binding] = field(default_factory=list)
+
+
+@dataclass(eq=False)
+class Consumer:
+    tag: str
+    queue: "Queue"
+    channel: "ChannelState"
+    deliver: Callable[[int, StoredMessage], None]
+    no_ack: bool = False
+    prefetch_count: int = 0
+    unacked: int = 0
+
+    def can_accept(self) -> bool:
+        """Не исчерпаны ли лимит consumer'а и общий лимит его канала (global qos)."""
+        if self.no_ack:
+            return True
+        if self.prefetch_count and self.unacked >= self.prefetch_count:
+            return False
+        limit = self.channel.global_prefetch_count
+        return not limit or self.channel.consumer_unacked < limit
+
+
+@dataclass(eq=False)
+class Queue:
+    name: str
+    durable: bool = False
+    exclusive: bool = False
+    auto_delete: bool = False
+    arguments: dict[str, Any] = field(default_factory=dict)
+    owner: Optional[str] = None
+    messages: deque[StoredMessage] = field(default_factory=deque)
+    consumers: list[Consumer] = field(default_factory=list)
+    had_consumers: bool = False
+    next_consumer: int = 0
+
+
+@dataclass(eq=False)
+class ChannelState:
+    """Состояние канала на стороне брокера."""
+    connection_id: str
+    # Лимит для consumer'ов, создаваемых на канале (basic.qos без global).
+    prefetch_count: int = 0
+    # Общий лимит неподтверждённых доставок consumer'ам канала (basic.qos с global).
+    global_prefetch_count: int = 0
+    consumer_unacked: int = 0
+    tags: Any = field(default_factory=lambda: itertools.count(1))
+    unacked: dict[int, tuple[Queue, StoredMessage, Optional[Consumer]]] = field(default_factory=dict)
+    consumers: dict[str, Consumer] = field(default_factory=dict)
+    closed: bool = False
+    # Скрытая очередь direct reply-to, пока канал потребляет из amq.rabbitmq.reply-to.
+    reply_queue: Optional[str] = None
+
+
+def topic_matches(pattern: str, routing_key: str) -> bool:
+    """Проверяет ключ маршрутизации по шаблону topic-обменника (`*` - одно слово, `#` - ноль и более)."""
+    return _match_words(pattern.split("."), routing_key.split(".") if routing_key else [])
+
+
+def _match_words(pattern: list[str], words: list[str]) -> bool:
+    if not pattern:
+        return not words
+    head, rest = pattern[0], pattern[1:]
+    if head == "#":
+        return any(_match_words(rest, words[i:]) for i in range(len(words) + 1))
+    if not words:
+        return False
+    if head == "*" or head == words[0]:
+        return _match_words(rest, words[1:])
+    return False
+
+
+def headers_match(arguments: dict[str, Any], headers: Optional[dict[str, Any]]) -> bool:
+    """Проверяет заголовки сообщения по аргументам привязки headers-обменника (x-match all/any)."""
+    headers = headers or {}
+    match_any = arguments.get("x-match", "all") in ("any", "any-with-x")
+    expected = {key: value for key, value in arguments.items() if not key.startswith("x-")}
+    if not expected:
+        return True
+    results = (
+        key in headers and (value is None or headers[key] == value)
+        for key, value in expected.items()
+    )
+    return any(results) if match_any else all(results)
+
+
+class MemoryBroker:
+    """
+    Брокер в памяти.
+
+    Экземпляры регистрируются по имени, см. `get_broker`: клиенты pika и aio_pika,
+    указывающие на одно имя, работают с одним и тем же брокером.
+    """
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._lock = threading.RLock()
+        self._exchanges: dict[str, Exchange] = {}
+        self._queues: dict[str, Queue] = {}
+        self._expiry: list[tuple[float, int, str]] = []
+        self._expiry_seq = itertools.count()
+        self._positions = itertools.count()
+        self._expiry_wakeup = threading.Condition(self._lock)
+        self._expiry_thread: Optional[threading.Thread] = None
+        # Активная тревога ресурсов (причина блокировки publisher'ов) и подписчики соединений.
+        self._alarm: Optional[str] = None
+        self._alarm_listeners: dict[str, Callable[[Optional[str]], None]] = {}
+        for name_, type_ in (
+                ("", EXCHANGE_DIRECT),
+                ("amq.direct", EXCHANGE_DIRECT),
+                ("amq.fanout", EXCHANGE_FANOUT),
+                ("amq.topic", EXCHANGE_TOPIC),
+                ("amq.headers", EXCHANGE_HEADERS),
+        ):
+            self._exchanges[name_] = Exchange(name=name_, type=type_, durable=True)
+
+    # Каналы и соединения
+
+    def open_channel(self, connection_id: str) -> ChannelState:
+        return ChannelState(connection_id=connection_id)
+
+    def close_channel(self, channel: ChannelState) -> None:
+        """Отменяет consumer'ов канала и возвращает его неподтверждённые сообщения в очереди."""
+        with self._lock:
+            if channel.closed:
+                return
+            channel.closed = True
+            for tag in list(channel.consumers):
+                self.basic_cancel(channel, tag)
+            self._requeue(channel, list(channel.unacked))
+
+    def close_connection(self, connection_id: str) -> None:
+        """Удаляет эксклюзивные очереди соединения."""
+        with self._lock:
+            self._alarm_listeners.pop(connection_id, None)
+            for queue in list(self._queues.values()):
+                if queue.exclusive and queue.owner == connection_id:
+                    self._delete_queue(queue)
+
+    def add_alarm_listener(self, connection_id: str, callback: Callable[[Optional[str]], None]) -> None:
+        """Подписывает соединение на connection.blocked (причина) и connection.unblocked (None)."""
+        with self._lock:
+            self._alarm_listeners[connection_id] = callback
+            if self._alarm is not None:
+                callback(self._alarm)
+
+    def set_resource_alarm(self, reason: Optional[str]) -> None:
+        """
+        Включает (reason - причина, например "memory") или снимает (None) тревогу ресурсов.
+
+        Как RabbitMQ при срабатывании memory или disk alarm, брокер уведомляет соединения
+        через connection.blocked и connection.unblocked. Публикации при этом принимаются.
+        """
+        with self._lock:
+            if reason == self._alarm:
+                return
+            self._alarm = reason
+            for callback in list(self._alarm_listeners.values()):
+                callback(reason)
+
+    # Топология
+
+    def exchange_declare(
+            self,
+            name: str,
+            exchange_type: str = EXCHANGE_DIRECT,
+            passive: bool = False,
+            durable: bool = False,
+            auto_delete: bool = False,
+            internal: bool = False,
+            arguments: Optional[dict[str, Any]] = None,
+    ) -> Exchange:
+        with self._lock:
+            exchange = self._exchanges.get(name)
+            if passive:
+                if exchange is None:
+                    raise NotFound(f"NOT_FOUND - no exchange '{name}'")
+                return exchange
+            if exchange_type not in EXCHANGE_TYPES:
+                raise PreconditionFailed(f"COMMAND_INVALID - unknown exchange type '{exchange_type}'")
+            if exchange is None:
+                exchange = Exchange(
+                    name=name,
+                    type=exchange_type,
+                    durable=durable,
+                    auto_delete=auto_delete,
+                    internal=internal,
+                    arguments=dict(arguments or {}),
+                )
+                self._exchanges[name] = exchange
+            elif exchange.type != exchange_type or exchange.durable != durable:
+                raise PreconditionFailed(f"PRECONDITION_FAILED - inequivalent arg for exchange '{name}'")
+            return exchange
+
+    def exchange_delete(self, name: str, if_unused: bool = False) -> None:
+        with self._lock:
+            exchange = self._exchanges.get(name)
+            if exchange is None or name == "" or name.startswith("amq."):
+                return
+            if if_unused and exchange.bindings:
+                raise PreconditionFailed(f"PRECONDITION_FAILED - exchange '{name}' in use")
+            del self._exchanges[name]
+
+    def queue_declare(
+            self,
+            name: str = "",
+            passive: bool = False,
+            durable: bool = False,
+            exclusive: bool = False,
+            auto_delete: bool = False,
+            arguments: Optional[dict[str, Any]] = None,
+            connection_id: Optional[str] = None,
+    ) -> tuple[str, int, int]:
+        """
+        Объявляет очередь.
+
+        :return: Имя очереди, количество сообщений и количество consumer'ов.
+        """
+        arguments = dict(arguments or {})
+        with self._lock:
+            queue = self._queues.get(name) if name else None
+            if passive:
+                if queue is None:
+                    raise NotFound(f"NOT_FOUND - no queue '{name}'")
+            elif queue is None:
+                name = name or f"amq.gen-{uuid.uuid4().hex}"
+                queue = Queue(
+                    name=name,
+                    durable=durable,
+                    exclusive=exclusive,
+                    auto_delete=auto_delete,
+                    arguments=arguments,
+                    owner=connection_id if exclusive else None,
+                )
+                self._queues[name] = queue
+                # Очередь всегда привязана к обменнику по умолчанию по своему имени.
+                self._exchanges[""].bindings.append(Binding(exchange="", queue=name, routing_key=name))
+            elif (queue.durable, queue.exclusive, queue.auto_delete, queue.arguments) != (
+                    durable, exclusive, auto_delete, arguments):
+                raise PreconditionFailed(f"PRECONDITION_FAILED - inequivalent arg for queue '{name}'")
+            if queue.exclusive and queue.owner != connection_id:
+                raise ResourceLocked(f"RESOURCE_LOCKED - cannot obtain exclusive access to queue '{name}'")
+            self._expire(queue)
+            return queue.name, len(queue.messages), len(queue.consumers)
+
+    def queue_bind(
+            self,
+            queue: str,
+            exchange: str,
+            routing_key: Optional[str] = None,
+            arguments: Optional[dict[str, Any]] = None,
+    ) -> None:
+        with self._lock:
+            target = self._get_exchange(exchange)
+            self._get_queue(queue)
+            routing_key = queue if routing_key is None else routing_key
+            arguments = dict(arguments or {})
+            for binding in target.bindings:
+                if (binding.queue, binding.routing_key, binding.arguments) == (queue, routing_key, arguments):
+                    return
+            target.bindings.append(Binding(exchange=exchange, queue=queue, routing_key=routing_key, arguments=arguments))
+
+    def queue_unbind(
+            self,
+            queue: str,
+            exchange: str,
+            routing_key: Optional[str] = None,
+            arguments: Optional[dict[str, Any]] = None,
+    ) -> None:
+        with self._lock:
+            target = self._get_exchange(exchange)
+            routing_key = queue if routing_key is None else routing_key
+            arguments = dict(arguments or {})
+            target.bindings = [
+                binding for binding in target.bindings
+                if (binding.queue, binding.routing_key, binding.arguments) != (queue, routing_key, arguments)
+            ]
+
+    def queue_delete(self, name: str, if_unused: bool = False, if_empty: bool = False) -> int:
+        with self._lock:
+            queue = self._queues.get(name)
+            if queue is None:
+                return 0
+            if if_unused and queue.consumers:
+                raise PreconditionFailed(f"PRECONDITION_FAILED - queue '{name}' in use")
+            if if_empty and queue.messages:
+                raise PreconditionFailed(f"PRECONDITION_FAILED - queue '{name}' not empty")
+            return self._delete_queue(queue)
+
+    def queue_purge(self, name: str) -> int:
+        with self._lock:
+            queue = self._get_queue(name)
+            count = len(queue.messages)
+            queue.messages.clear()
+            return count
+
+    def _delete_queue(self, queue: Queue) -> int:
+        for consumer in list(queue.consumers):
+            self.basic_cancel(consumer.channel, consumer.tag)
+        for exchange in self._exchanges.values():
+            exchange.bindings = [binding for binding in exchange.bindings if binding.queue != queue.name]
+        self._queues.pop(queue.name, None)
+        return len(queue.messages)
+
+    def _get_exchange(self, name: str) -> Exchange:
+        exchange = self._exchanges.get(name)
+        if exchange is None:
+            raise NotFound(f"NOT_FOUND - no exchange '{name}'")
+        return exchange
+
+    def _get_queue(self, name: str) -> Queue:
+        queue = self._queues.get(name)
+        if queue is None:
+            raise NotFound(f"NOT_FOUND - no queue '{name}'")
+        return queue
+
+    # Публикация и маршрутизация
+
+    def route(self, exchange: Exchange, routing_key: str, headers: Optional[dict[str, Any]]) -> list[Queue]:
+        """Возвращает очереди, в которые обменник направит сообщение (без повторов)."""
+        names: dict[str, None] = {}
+        for binding in exchange.bindings:
+            if exchange.type == EXCHANGE_FANOUT:
+                matched = True
+            elif exchange.type == EXCHANGE_DIRECT:
+                matched = binding.routing_key == routing_key
+            elif exchange.type == EXCHANGE_TOPIC:
+                matched = topic_matches(binding.routing_key, routing_key)
+            else:
+                matched = headers_match(binding.arguments, headers)
+            if matched:
+                names[binding.queue] = None
+        return [self._queues[name] for name in names if name in self._queues]
+
+    def publish(
+            self,
+            exchange: str,
+            routing_key: str,
+            body: bytes,
+            properties: Optional[Properties] = None,
+            channel: Optional[ChannelState] = None,
+    ) -> bool:
+        """
+        Публикует сообщение.
+
+        :param channel: Канал публикации, нужен для reply_to=amq.rabbitmq.reply-to.
+        :return: True, если сообщение попало хотя бы в одну очередь.
+        """
+        properties = properties or Properties()
+        with self._lock:
+            if properties.reply_to == DIRECT_REPLY_TO:
+                if channel is None or channel.reply_queue not in self._queues:
+                    raise PreconditionFailed("PRECONDITION_FAILED - fast reply consumer does not exist")
+                # Как в RabbitMQ: получатель видит адрес, по которому ответ попадёт в этот канал.
+                properties = replace(properties, reply_to=channel.reply_queue)
+            queues = self.route(self._get_exchange(exchange), routing_key, properties.headers)
+            for queue in queues:
+                message = StoredMessage(
+                    body=bytes(body),
+                    properties=replace(properties, headers=dict(properties.headers or {})),
+                    exchange=exchange,
+                    routing_key=routing_key,
+                )
+                self._enqueue(queue, message)
+            return bool(queues)
+
+    def _enqueue(self, queue: Queue, message: StoredMessage) -> None:
+        ttl = self._ttl_ms(queue, message)
+        if ttl is not None:
+            message.expires_at = time.monotonic() + ttl / 1000
+            self._schedule_expiry(queue, message.expires_at)
+        message.position = next(self._positions)
+        if "x-max-priority" in queue.arguments:
+            index = bisect.bisect(
+                queue.messages, self._order(queue, message), key=lambda queued: self._order(queue, queued),
+            )
+            queue.messages.insert(index, message)
+        else:
+            queue.messages.append(message)
+        self._dispatch(queue)
+
+    @staticmethod
+    def _order(queue: Queue, message: StoredMessage) -> tuple[int, int]:
+        """
+        Место сообщения в очереди.
+
+        В очереди с x-max-priority сообщения с большим приоритетом (не выше x-max-priority)
+        доставляются раньше, с одинаковым - в порядке публикации.
+        """
+        max_priority = queue.arguments.get("x-max-priority")
+        if max_priority is None:
+            return 0, message.position
+        return -min(message.properties.priority or 0, int(max_priority)), message.position
+
+    @staticmethod
+    def _ttl_ms(queue: Queue, message: StoredMessage) -> Optional[float]:
+        ttls = []
+        if message.properties.expiration is not None:
+            ttls.append(float(message.properties.expiration))
+        if "x-message-ttl" in queue.arguments:
+            ttls.append(float(queue.arguments["x-message-ttl"]))
+        return min(ttls) if ttls else None
+
+    # TTL
+
+    def _schedule_expiry(self, queue: Queue, at: float) -> None:
+        heapq.heappush(self._expiry, (at, next(self._expiry_seq), queue.name))
+        if self._expiry_thread is None:
+            self._expiry_thread = threading.Thread(
+                target=self._expiry_loop, name=f"memory-broker-{self.name}-ttl", daemon=True,
+            )
+            self._expiry_thread.start()
+        self._expiry_wakeup.notify()
+
+    def _expiry_loop(self) -> None:
+        with self._lock:
+            while True:
+                if not self._expiry:
+                    self._expiry_wakeup.wait()
+                    continue
+                at, _, name = self._expiry[0]
+                delay = at - time.monotonic()
+                if delay > 0:
+                    self._expiry_wakeup.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._expiry)
+                queue = self._queues.get(name)
+                if queue is not None:
+                    self._expire(queue)
+                    self._dispatch(queue)
+
+    def _expire(self, queue: Queue) -> None:
+        """Удаляет просроченные сообщения из головы очереди (как RabbitMQ) с dead-letter маршрутизацией."""
+        now = time.monotonic()
+        while queue.messages and queue.messages[0].expires_at is not None and queue.messages[0].expires_at <= now:
+            self._dead_letter(queue, queue.messages.popleft(), "expired")
+
+    # Доставка
+
+    def _dispatch(self, queue: Queue) -> None:
+        while queue.messages and queue.consumers:
+            self._expire(queue)
+            if not queue.messages:
+                return
+            consumer = self._next_consumer(queue)
+            if consumer is None:
+                return
+            message = queue.messages.popleft()
+            message.expires_at = None
+            tag = next(consumer.channel.tags)
+            if not consumer.no_ack:
+                consumer.channel.unacked[tag] = (queue, message, consumer)
+                consumer.unacked += 1
+                consumer.channel.consumer_unacked += 1
+            consumer.deliver(tag, message)
+
+    def _next_consumer(self, queue: Queue) -> Optional[Consumer]:
+        """
+        Выбирает consumer'а по кругу среди тех, у кого не исчерпан prefetch.
+
+        Для очереди с x-single-active-consumer сообщения получает только первый подписавшийся
+        consumer, после его отмены - следующий.
+        """
+        if queue.arguments.get("x-single-active-consumer"):
+            active = queue.consumers[0]
+            return active if active.can_accept() else None
+        count = len(queue.consumers)
+        for offset in range(count):
+            index = (queue.next_consumer + offset) % count
+            consumer = queue.consumers[index]
+            if consumer.can_accept():
+                queue.next_consumer = (index + 1) % count
+                return consumer
+        return None
+
+    def basic_qos(self, channel: ChannelState, prefetch_count: int, global_qos: bool = False) -> None:
+        """
+        Устанавливает prefetch для consumer'ов канала.
+
+        Как в RabbitMQ, без global_qos лимит задаётся каждому consumer'у, созданному после вызова,
+        а с global_qos - общий лимит всех consumer'ов канала, действующий и на уже запущенных.
+        Действуют оба лимита: доставка ждёт, пока не освободится место и у consumer'а, и у канала.
+        """
+        with self._lock:
+            if not global_qos:
+                channel.prefetch_count = prefetch_count
+                return
+            channel.global_prefetch_count = prefetch_count
+            self._dispatch_channel(channel)
+
+    def basic_consume(
+            self,
+            channel: ChannelState,
+            queue: str,
+            deliver: Callable[[int, StoredMessage], None],
+            no_ack: bool = False,
+            exclusive: bool = False,
+            consumer_tag: Optional[str] = None,
+    ) -> str:
+        with self._lock:
+            if queue == DIRECT_REPLY_TO:
+                target = self._reply_queue(channel, no_ack)
+            else:
+                target = self._get_queue(queue)
+            if target.exclusive and target.owner != channel.connection_id:
+                raise ResourceLocked(f"RESOURCE_LOCKED - cannot obtain exclusive access to queue '{queue}'")
+            if exclusive and target.consumers:
+                raise ResourceLocked(f"ACCESS_REFUSED - queue '{queue}' in exclusive use")
+            tag = consumer_tag or f"ctag-{uuid.uuid4().hex}"
+            consumer = Consumer(
+                tag=tag,
+                queue=target,
+                channel=channel,
+                deliver=deliver,
+                no_ack=no_ack,
+                prefetch_count=channel.prefetch_count,
+            )
+            channel.consumers[tag] = consumer
+            target.consumers.append(consumer)
+            target.had_consumers = True
+            self._dispatch(target)
+            return tag
+
+    def _reply_queue(self, channel: ChannelState, no_ack: bool) -> Queue:
+        """
+        Скрытая очередь direct reply-to канала.
+
+        Ответы публикуются в обменник по умолчанию с ключом из reply_to запроса и доставляются
+        consumer'у канала, пока он не отменён.
+        """
+        if not no_ack:
+            raise PreconditionFailed("PRECONDITION_FAILED - reply consumer cannot acknowledge")
+        if channel.reply_queue in self._queues:
+            raise PreconditionFailed("PRECONDITION_FAILED - reply consumer already set")
+        name = f"{DIRECT_REPLY_TO}.{uuid.uuid4().hex}"
+        self.queue_declare(name, exclusive=True, auto_delete=True, connection_id=channel.connection_id)
+        channel.reply_queue = name
+        return self._queues[name]
+
+    def basic_cancel(self, channel: ChannelState, consumer_tag: str) -> None:
+        with self._lock:
+            consumer = channel.consumers.pop(consumer_tag, None)
+            if consumer is None:
+                return
+            queue = consumer.queue
+            queue.consumers.remove(consumer)
+            queue.next_consumer = 0
+            if queue.auto_delete and queue.had_consumers and not queue.consumers:
+                self._delete_queue(queue)
+            else:
+                self._dispatch(queue)
+
+    def basic_get(self, channel: ChannelState, queue: str, no_ack: bool = False) -> Optional[tuple[int, StoredMessage, int]]:
+        """
+        Забирает одно сообщение из очереди.
+
+        :return: Тег доставки, сообщение и количество оставшихся сообщений или None, если очередь пуста.
+        """
+        with self._lock:
+            target = self._get_queue(queue)
+            self._expire(target)
+            if not target.messages:
+                return None
+            message = target.messages.popleft()
+            message.expires_at = None
+            tag = next(channel.tags)
+            if not no_ack:
+                channel.unacked[tag] = (target, message, None)
+            return tag, message, len(target.messages)
+
+    def message_count(self, queue: str) -> int:
+        with self._lock:
+            target = self._get_queue(queue)
+            self._expire(target)
+            return len(target.messages)
+
+    # Подтверждения
+
+    def _settled_tags(self, channel: ChannelState, delivery_tag: int, multiple: bool) -> list[int]:
+        if multiple:
+            tags = [tag for tag in channel.unacked if tag <= delivery_tag or delivery_tag == 0]
+        elif delivery_tag in channel.unacked:
+            tags = [delivery_tag]
+        else:
+            tags = []
+        if not tags and (delivery_tag or not multiple):
+            raise PreconditionFailed(f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+        return tags
+
+    def _release(self, channel: ChannelState, tag: int) -> tuple[Queue, StoredMessage]:
+        queue, message, consumer = channel.unacked.pop(tag)
+        if consumer is not None:
+            consumer.unacked -= 1
+            channel.consumer_unacked -= 1
+        return queue, message
+
+    def _dispatch_channel(self, channel: ChannelState) -> None:
+        """Доставляет сообщения consumer'ам канала, если у канала освободилось место по global qos."""
+        if not channel.global_prefetch_count:
+            return
+        queues = {id(consumer.queue): consumer.queue for consumer in channel.consumers.values()}
+        for queue in queues.values():
+            self._dispatch(queue)
+
+    def ack(self, channel: ChannelState, delivery_tag: int, multiple: bool = False) -> None:
+        with self._lock:
+            queues: dict[int, Queue] = {}
+            for tag in self._settled_tags(channel, delivery_tag, multiple):
+                queue, _ = self._release(channel, tag)
+                queues[id(queue)] = queue
+            for queue in queues.values():
+                self._dispatch(queue)
+            self._dispatch_channel(channel)
+
+    def nack(self, channel: ChannelState, delivery_tag: int, multiple: bool = False, requeue: bool = True) -> None:
+        with self._lock:
+            tags = self._settled_tags(channel, delivery_tag, multiple)
+            if requeue:
+                self._requeue(channel, tags)
+                return
+            queues: dict[int, Queue] = {}
+            for tag in tags:
+                queue, message = self._release(channel, tag)
+                self._dead_letter(queue, message, "rejected")
+                queues[id(queue)] = queue
+            for queue in queues.values():
+                self._dispatch(queue)
+            self._dispatch_channel(channel)
+
+    def reject(self, channel: ChannelState, delivery_tag: int, requeue: bool = True) -> None:
+        self.nack(channel, delivery_tag, multiple=False, requeue=requeue)
+
+    def _requeue(self, channel: ChannelState, tags: list[int]) -> None:
+        """Возвращает сообщения на их исходные места в очередях, как RabbitMQ."""
+        queues: dict[int, Queue] = {}
+        for tag in tags:
+            queue, message = self._release(channel, tag)
+            message.redelivered = True
+            if queue.name in self._queues:
+                index = bisect.bisect(
+                    queue.messages, self._order(queue, message), key=lambda queued: self._order(queue, queued),
+                )
+                queue.messages.insert(index, message)
+                queues[id(queue)] = queue
+        for queue in queues.values():
+            self._dispatch(queue)
+        if not channel.closed:
+            self._dispatch_channel(channel)
+
+    # Dead letters
+
+    def _dead_letter(self, queue: Queue, message: StoredMessage, reason: str) -> None:
+        """Публикует отклонённое или просроченное сообщение в x-dead-letter-exchange очереди."""
+        dead_letter_exchange = queue.arguments.get("x-dead-letter-exchange")
+        if dead_letter_exchange is None or dead_letter_exchange not in self._exchanges:
+            return
+        routing_key = queue.arguments.get("x-dead-letter-routing-key", message.routing_key)
+        headers = dict(message.properties.headers or {})
+        deaths = [dict(death) for death in headers.get("x-death", [])]
+        for death in deaths:
+            if death.get("queue") == queue.name and death.get("reason") == reason:
+                death["count"] = death.get("count", 1) + 1
+                deaths.remove(death)
+                deaths.insert(0, death)
+                break
+        else:
+            deaths.insert(0, {
+                "count": 1,
+                "reason": reason,
+                "queue": queue.name,
+                "time": int(time.time()),
+                "exchange": message.exchange,
+                "routing-keys": [message.routing_key],
+            })
+        headers["x-death"] = deaths
+        headers.setdefault("x-first-death-reason", reason)
+        headers.setdefault("x-first-death-queue", queue.name)
+        headers.setdefault("x-first-death-exchange", message.exchange)
+        headers["x-last-death-reason"] = reason
+        headers["x-last-death-queue"] = queue.name
+        headers["x-last-death-exchange"] = message.exchange
+        properties = replace(message.properties, headers=headers, expiration=None)
+        self.publish(dead_letter_exchange, routing_key, message.body, properties)
+
+
+_brokers: dict[str, MemoryBroker] = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker(name: str = "default") -> MemoryBroker:
+    """Возвращает брокер с указанным именем, создавая его при первом обращении."""
+    with _brokers_lock:
+        broker = _brokers.get(name)
+        if broker is None:
+            broker = MemoryBroker(name)
+            _brokers[name] = broker
+        return broker
+
+
+def broker_from_url(url: str) -> MemoryBroker:
+    """Возвращает брокер по URL вида `memory://<имя>` (по умолчанию `memory://`)."""
+    if not url.startswith(MEMORY_URL_SCHEME):
+        raise ValueError(f"Not a memory broker URL: {url}")
+    name = url[len(MEMORY_URL_SCHEME):].strip("/") or "default"
+    return get_broker(name)
+
+
+def reset_brokers() -> None:
+    """Удаляет все брокеры (например, между тестами или прогонами бенчмарков)."""
+    with _brokers_lock:
+        _brokers.clear()
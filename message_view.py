@@ -0,0 +1,133 @@
+"""
+Ленивое представление входящего сообщения для обработчиков pika и aio_pika.
+
+MessageView не копирует и не декодирует тело при доставке: `body` - memoryview над
+полученными байтами, `text` и `data` вычисляются при первом обращении и кэшируются,
+а заголовки отдаются в том виде, в каком их разобрал клиент, без копирования.
+Обработчик, который маршрутизирует или фильтрует сообщения только по заголовкам,
+не платит за декодирование тела.
+
+Обработчик подключается обёрткой: `viewing(callback)` для pika (тело заменяется на
+MessageView) и `viewing_async(callback)` для aio_pika. Остальные атрибуты (correlation_id,
+delivery_tag, ack/nack у aio_pika и т.п.) берутся из свойств или сообщения.
+"""
+import functools
+import logging
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Mapping, Optional
+
+from serializers import LazyPayload
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractIncomingMessage
+    from pika.adapters.blocking_connection import BlockingChannel
+    from pika.spec import Basic, BasicProperties
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHARSET = "utf-8"
+
+_EMPTY_HEADERS: Mapping[str, Any] = {}
+
+
+class MessageView:
+    """
+    Тело и свойства входящего сообщения с ленивым декодированием.
+
+    :param body: Тело сообщения (уже распакованное, если оно было сжато).
+    :param source: Свойства pika (BasicProperties) или сообщение aio_pika, из которых берутся
+        content_type, headers и остальные атрибуты.
+    """
+    __slots__ = ("_body", "_source", "_payload", "_text")
+
+    def __init__(self, body: bytes, source: Any):
+        self._body = body
+        self._source = source
+        self._payload: Optional[LazyPayload] = None
+        self._text: Optional[str] = None
+
+    @property
+    def body(self) -> memoryview:
+        """Тело без копирования."""
+        return memoryview(self._body)
+
+    @property
+    def raw(self) -> bytes:
+        """Исходные байты тела (без копирования)."""
+        return self._body
+
+    @property
+    def text(self) -> str:
+        """Тело, декодированное в кодировке из content_type (по умолчанию utf-8)."""
+        if self._text is None:
+            self._text = self._body.decode(self.charset)
+        return self._text
+
+    @property
+    def data(self) -> Any:
+        """Тело, разобранное кодеком для content_type (см. `serializers`); для незарегистрированного типа - UnknownContentTypeError."""
+        if self._payload is None:
+            self._payload = LazyPayload(self._body, self._source.content_type)
+        return self._payload.value
+
+    @property
+    def charset(self) -> str:
+        content_type = self._source.content_type or ""
+        for parameter in content_type.split(";")[1:]:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "charset" and value.strip():
+                return value.strip().strip('"')
+        return DEFAULT_CHARSET
+
+    @property
+    def headers(self) -> Mapping[str, Any]:
+        """Заголовки сообщения в том виде, в каком их разобрал клиент (без копирования)."""
+        return self._source.headers or _EMPTY_HEADERS
+
+    def header(self, name: str, default: Any = None) -> Any:
+        """Значение заголовка; байтовые строки декодируются."""
+        value = self.headers.get(name, default)
+        if isinstance(value, bytes):
+            return value.decode(DEFAULT_CHARSET, errors="replace")
+        return value
+
+    def preview(self, limit: int = 64) -> str:
+        """Начало тела для логов: декодируется не больше limit байт."""
+        text = bytes(self.body[:limit]).decode(self.charset, errors="replace")
+        return text if len(self._body) <= limit else f"{text}... ({len(self._body)} bytes)"
+
+    def __str__(self) -> str:
+        # Логирование через %s форматирует тело только при выводе записи и не больше начала тела.
+        return self.preview()
+
+    def __len__(self) -> int:
+        return len(self._body)
+
+    def __repr__(self) -> str:
+        return f"<MessageView {len(self._body)} bytes content_type={self._source.content_type!r}>"
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._source, item)
+
+
+def viewing(
+        on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", MessageView], Any],
+) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], Any]:
+    """Оборачивает pika callback: вместо тела передаётся MessageView."""
+
+    @functools.wraps(on_message_callback)
+    def wrapper(channel, method, properties, body):
+        return on_message_callback(channel, method, properties, MessageView(body, properties))
+
+    return wrapper
+
+
+def viewing_async(
+        on_message_callback: Callable[[MessageView], Awaitable[Any]],
+) -> Callable[["AbstractIncomingMessage"], Awaitable[Any]]:
+    """Оборачивает aio_pika обработчик: вместо сообщения передаётся MessageView (ack/nack доступны через него)."""
+
+    @functools.wraps(on_message_callback)
+    async def wrapper(message):
+        return await on_message_callback(MessageView(message.body, message))
+
+    return wrapper
@@ -0,0 +1,287 @@
+"""
+Метрики consumer'ов и publisher'ов в формате Prometheus.
+
+По умолчанию включён режим без записи (NullMetrics): обработчики не оборачиваются
+и горячий путь не меняется. `enable_metrics()` включает сбор, `start_http_server()`
+отдаёт метрики по HTTP на /metrics. Используется и pika, и aio_pika клиентами.
+"""
+import functools
+import logging
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+
+from delivery import settle_hooks_channel
+
+if TYPE_CHECKING:
+    from pika.adapters.blocking_connection import BlockingChannel
+    from pika.spec import Basic, BasicProperties
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    """Экранирует значение метки для текстового формата Prometheus: обратную косую черту, кавычки и перевод строки."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Iterable[tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            return [f"{self.name}_total{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # Для каждого набора меток: счётчики по корзинам, сумма и количество наблюдений.
+        self._values: dict[LabelKey, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            totals[0] += value
+            totals[1] += 1
+
+    def count(self, **labels: Any) -> int:
+        values = self._values.get(_label_key(labels))
+        return int(values[1][1]) if values else 0
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, (total, count)) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {int(count)}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {int(count)}")
+        return lines
+
+
+class Metrics:
+    """Набор метрик горячего пути. Метки: queue для consumer'ов, exchange для publisher'ов."""
+    enabled = True
+
+    def __init__(self, namespace: str = "mq"):
+        self.delivered = Counter(f"{namespace}_messages_delivered", "Доставлено сообщений обработчику")
+        self.acked = Counter(f"{namespace}_messages_acked", "Подтверждено сообщений (ack)")
+        self.nacked = Counter(f"{namespace}_messages_nacked", "Отклонено сообщений через nack")
+        self.rejected = Counter(f"{namespace}_messages_rejected", "Отклонено сообщений через reject")
+        self.requeued = Counter(f"{namespace}_messages_requeued", "Возвращено в очередь (requeue=True)")
+        self.dead_lettered = Counter(
+            f"{namespace}_messages_dead_lettered", "Отклонено без возврата в очередь (уходит в DLX, если он задан)",
+        )
+        self.duplicates = Counter(f"{namespace}_messages_duplicate", "Пропущено повторных доставок (дедупликация)")
+        self.handler_errors = Counter(f"{namespace}_handler_errors", "Исключения в обработчиках")
+        self.handler_seconds = Histogram(f"{namespace}_handler_duration_seconds", "Время работы обработчика")
+        self.queue_wait_seconds = Histogram(
+            f"{namespace}_queue_wait_seconds", "Время от timestamp сообщения до доставки обработчику",
+        )
+        self.publish_confirm_seconds = Histogram(
+            f"{namespace}_publish_confirm_seconds", "Время от публикации до подтверждения брокера",
+        )
+        self.published = Counter(f"{namespace}_messages_published", "Опубликовано сообщений с подтверждением брокера")
+        self.publish_failed = Counter(
+            f"{namespace}_messages_publish_failed", "Не опубликовано сообщений (Basic.Nack, ошибка или блокировка)",
+        )
+        self.in_flight = Gauge(f"{namespace}_messages_in_flight", "Сообщений в обработке")
+
+    def all(self) -> list:
+        return [value for value in vars(self).values() if isinstance(value, (Counter, Histogram))]
+
+    def render(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self.all():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def record_settle(self, method: str, requeue: bool, **labels: Any) -> None:
+        """Учитывает ack/nack/reject сообщения."""
+        if method == "ack":
+            self.acked.inc(**labels)
+            return
+        (self.nacked if method == "nack" else self.rejected).inc(**labels)
+        (self.requeued if requeue else self.dead_lettered).inc(**labels)
+
+
+class _NullMetric:
+    def inc(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    dec = set = observe = inc
+
+
+class NullMetrics(Metrics):
+    """Метрики без записи: все операции ничего не делают."""
+    enabled = False
+
+    def __init__(self, namespace: str = "mq"):
+        super().__init__(namespace)
+        for name in list(vars(self)):
+            setattr(self, name, _NullMetric())
+
+    def all(self) -> list:
+        return []
+
+    def record_settle(self, method: str, requeue: bool, **labels: Any) -> None:
+        pass
+
+
+_metrics: Metrics = NullMetrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def enable_metrics(metrics: Optional[Metrics] = None) -> Metrics:
+    """Включает сбор метрик для всех клиентов процесса."""
+    global _metrics
+    _metrics = metrics or Metrics()
+    return _metrics
+
+
+def disable_metrics() -> None:
+    global _metrics
+    _metrics = NullMetrics()
+
+
+def start_http_server(port: int = 9100, addr: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Запускает в фоновом потоке HTTP-сервер, отдающий метрики на /metrics."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = get_metrics().render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics endpoint started on %s:%d/metrics", addr, port)
+    return server
+
+
+def queue_wait(timestamp: Any) -> Optional[float]:
+    """Время ожидания в очереди по свойству timestamp (секунды или datetime)."""
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    return max(0.0, time.time() - float(timestamp))
+
+
+def settle_recorder(metrics: Metrics, queue: str) -> Callable[[str, bool], None]:
+    """Хук для обёрток `delivery`, учитывающий ack/nack/reject в метриках очереди."""
+
+    def record(method: str, requeue: bool) -> None:
+        metrics.record_settle(method, requeue, queue=queue)
+
+    return record
+
+
+def instrumented(
+        on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+        queue: str,
+) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None]:
+    """
+    Оборачивает pika callback сбором метрик.
+
+    Если метрики выключены, callback возвращается без изменений.
+    """
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return on_message_callback
+
+    @functools.wraps(on_message_callback)
+    def wrapper(channel, method, properties, body):
+        metrics.delivered.inc(queue=queue)
+        wait = queue_wait(properties.timestamp)
+        if wait is not None:
+            metrics.queue_wait_seconds.observe(wait, queue=queue)
+        metrics.in_flight.inc(queue=queue)
+        started = time.perf_counter()
+        try:
+            return on_message_callback(
+                settle_hooks_channel(channel, settle_recorder(metrics, queue)), method, properties, body,
+            )
+        except Exception:
+            metrics.handler_errors.inc(queue=queue)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, queue=queue)
+            metrics.in_flight.dec(queue=queue)
+
+    return wrapper
@@ -0,0 +1,159 @@
+"""
+Адаптивный prefetch_count по наблюдаемому времени обработки и задержке до брокера.
+
+Чтобы обработчики не простаивали, в канале должно быть столько неподтверждённых сообщений,
+сколько обработчики успевают обработать за время, пока ack доходит до брокера и следующая
+доставка возвращается обратно (bandwidth-delay product):
+
+    prefetch = concurrency * (1 + rtt / service_time) * headroom
+
+Слишком маленький prefetch заставляет быстрые обработчики ждать доставок, слишком большой
+копит сообщения на одном медленном consumer'е, пока другие свободны. Время обработки и RTT
+сглаживаются экспоненциальным средним, значение пересчитывается не чаще interval секунд и
+меняется только при отклонении больше чем на tolerance.
+
+Контроллер не зависит от клиента: pika (`adaptive_prefetch`) и aio_pika (`QueueRabbitClient.consume`)
+сообщают ему время обработки и время запроса basic.qos и применяют предложенное значение.
+"""
+import functools
+import logging
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from pika.adapters.blocking_connection import BlockingChannel
+    from pika.spec import Basic, BasicProperties
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePrefetch:
+    """
+    :param min_prefetch: Нижняя граница prefetch_count.
+    :param max_prefetch: Верхняя граница prefetch_count.
+    :param concurrency: Количество одновременно работающих обработчиков.
+    :param interval: Минимальный интервал между изменениями prefetch_count в секундах.
+    :param tolerance: Относительное отклонение, при котором prefetch_count меняется.
+    :param headroom: Запас сверх расчётного значения на разброс времени обработки.
+    :param alpha: Вес нового наблюдения в экспоненциальном среднем.
+    :param initial_rtt: RTT в секундах до первого измерения.
+    """
+
+    def __init__(
+            self,
+            min_prefetch: int = 1,
+            max_prefetch: int = 500,
+            concurrency: int = 1,
+            interval: float = 5.0,
+            tolerance: float = 0.2,
+            headroom: float = 1.25,
+            alpha: float = 0.2,
+            initial_rtt: float = 0.001,
+    ):
+        if not 1 <= min_prefetch <= max_prefetch:
+            raise ValueError("Expected 1 <= min_prefetch <= max_prefetch")
+        self.min_prefetch = min_prefetch
+        self.max_prefetch = max_prefetch
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.tolerance = tolerance
+        self.headroom = headroom
+        self.alpha = alpha
+        self.service_time: Optional[float] = None
+        self.rtt = initial_rtt
+        self.prefetch_count = min_prefetch
+        self._updating = False
+        self._last_change = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _smooth(self, current: Optional[float], value: float) -> float:
+        return value if current is None else current + self.alpha * (value - current)
+
+    def observe(self, service_time: float) -> None:
+        """Учитывает время обработки одного сообщения в секундах."""
+        with self._lock:
+            self.service_time = self._smooth(self.service_time, max(service_time, 1e-6))
+
+    def observe_rtt(self, rtt: float) -> None:
+        """Учитывает время синхронного запроса к брокеру (например, basic.qos) в секундах."""
+        with self._lock:
+            self.rtt = self._smooth(self.rtt, max(rtt, 0.0))
+
+    def target(self) -> int:
+        """Расчётный prefetch_count для текущих оценок."""
+        if self.service_time is None:
+            return self.prefetch_count
+        value = self.concurrency * (1 + self.rtt / self.service_time) * self.headroom
+        return max(self.min_prefetch, min(self.max_prefetch, math.ceil(value)))
+
+    def suggest(self) -> Optional[int]:
+        """
+        Возвращает новый prefetch_count, если его пора изменить, иначе None.
+
+        После ненулевого ответа следующие вызовы возвращают None, пока не будет вызван `applied`.
+        """
+        with self._lock:
+            if self._updating or time.monotonic() - self._last_change < self.interval:
+                return None
+            target = self.target()
+            if abs(target - self.prefetch_count) <= self.prefetch_count * self.tolerance:
+                return None
+            self._updating = True
+            return target
+
+    def applied(self, prefetch_count: Optional[int], rtt: Optional[float] = None) -> None:
+        """
+        Сообщает результат изменения prefetch_count.
+
+        :param prefetch_count: Установленное значение или None, если изменить не удалось.
+        :param rtt: Время запроса basic.qos в секундах.
+        """
+        if rtt is not None:
+            self.observe_rtt(rtt)
+        with self._lock:
+            if prefetch_count is not None:
+                logger.info(
+                    "Prefetch %d -> %d (service time %.4fs, rtt %.4fs)",
+                    self.prefetch_count, prefetch_count, self.service_time or 0.0, self.rtt,
+                )
+                self.prefetch_count = prefetch_count
+            self._last_change = time.monotonic()
+            self._updating = False
+
+
+def adaptive_prefetch(
+        on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+        controller: AdaptivePrefetch,
+) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None]:
+    """
+    Оборачивает pika callback: измеряет время обработки и меняет prefetch_count канала.
+
+    basic_qos выполняется в потоке соединения через add_callback_threadsafe, поэтому обёртку
+    можно использовать и внутри ThreadedCallback. Лимит задаётся для всего канала (global_qos):
+    так RabbitMQ применяет его и к уже запущенным consumer'ам.
+    """
+
+    def apply(channel: "BlockingChannel", prefetch_count: int) -> None:
+        started = time.perf_counter()
+        try:
+            channel.basic_qos(prefetch_count=prefetch_count, global_qos=True)
+        except Exception as e:
+            logger.warning("Failed to change prefetch to %d: %s", prefetch_count, e)
+            controller.applied(None)
+            return
+        controller.applied(prefetch_count, rtt=time.perf_counter() - started)
+
+    @functools.wraps(on_message_callback)
+    def wrapper(channel, method, properties, body):
+        started = time.perf_counter()
+        try:
+            return on_message_callback(channel, method, properties, body)
+        finally:
+            controller.observe(time.perf_counter() - started)
+            prefetch_count = controller.suggest()
+            if prefetch_count is not None:
+                channel.connection.add_callback_threadsafe(functools.partial(apply, channel, prefetch_count))
+
+    return wrapper
@@ -0,0 +1,124 @@
+import logging
+import time
+import uuid
+from typing import Optional
+
+import pika
+
+from compression import compress
+from consumers_models.consumer_base import mq_connection_params
+from rabbitmq_conf import EventLogger
+from rate_limit import PublishThrottle
+from serializers import encode
+from sharding import Sharding
+from spool import PublishSpool
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+events = EventLogger(logger)
+
+
+class ProducerMixin:
+    """
+    Класс-миксин с публикацией сообщений для клиентов на основе `RabbitMQClientBase`.
+
+    Сообщение сериализуется, при необходимости сжимается, получает message_id и заголовки
+    трассировки, после чего дописывается в журнал (spool) или публикуется в канал.
+
+    Если задан throttle, канал переводится в режим подтверждений (confirm_delivery): basic_publish
+    возвращается после Basic.Ack брокера и бросает исключение при Basic.Nack, и только тогда
+    место неподтверждённой публикации освобождается. Так max_unconfirmed ограничивает публикации
+    всех потоков и producer'ов, разделяющих один throttle.
+    """
+
+    def __init__(
+            self,
+            connection_params: pika.ConnectionParameters = mq_connection_params,
+            use_pool: bool = False,
+            spool: Optional[PublishSpool] = None,
+            throttle: Optional[PublishThrottle] = None,
+    ) -> None:
+        """
+        Аргументы:
+            spool (PublishSpool | None): Если задан, сообщения дописываются в локальный журнал,
+                а в RabbitMQ их отправляет SpoolDrainer; соединение для publish не требуется.
+            throttle (PublishThrottle | None): Если задан, публикации ограничиваются по скорости
+                и числу неподтверждённых и приостанавливаются, пока брокер блокирует соединение.
+        """
+        super().__init__(connection_params=connection_params, use_pool=use_pool)
+        self.spool = spool
+        self.throttle = throttle
+
+    def __enter__(self):
+        super().__enter__()
+        if self.throttle is not None:
+            self.channel.confirm_delivery()
+        return self
+
+    def produce_message(
+            self,
+            exchange,
+            routing_key,
+            body,
+            index: int,
+            compression: Optional[str] = None,
+            headers: Optional[dict] = None,
+            delivery_mode: Optional[int] = None,
+    ):
+        """Producer. Если задан compression, тела больше порога сжимаются этим алгоритмом."""
+        message = {
+            f"message-{index:02d}": body,
+        }
+        body_to_queue, content_type = encode(message)
+        body_to_queue, content_encoding = compress(body_to_queue, compression)
+        tracer = get_tracer()
+        properties = pika.BasicProperties(
+            content_type=content_type,
+            content_encoding=content_encoding,
+            # Ключ дедупликации consumer'ов: одинаковые тела - разные сообщения.
+            message_id=uuid.uuid4().hex,
+            headers=tracer.inject(headers),
+            delivery_mode=delivery_mode,
+        )
+        if self.spool is not None:
+            self.spool.append(exchange, routing_key, body_to_queue, properties)
+            events.info("message_spooled", exchange=exchange, message_id=properties.message_id, body=body)
+            return
+        if self.throttle is not None:
+            self.throttle.attach(self.connection)
+            # Ожидание обслуживает соединение, чтобы дошли heartbeat'ы и connection.unblocked.
+            self.throttle.acquire_blocking(sleep=self.connection.sleep)
+        started = time.perf_counter()
+        try:
+            self.channel.basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body_to_queue,
+                properties=properties,
+            )
+        finally:
+            # В режиме подтверждений сюда попадаем после Basic.Ack или Basic.Nack.
+            if self.throttle is not None:
+                self.throttle.confirmed()
+        tracer.published(properties.headers, time.perf_counter() - started, exchange=exchange)
+        # В лог попадает исходное тело, а не сериализованное и сжатое body_to_queue.
+        events.info("message_published", exchange=exchange, message_id=properties.message_id, body=body)
+
+    def produce_sharded_message(
+            self,
+            sharding: Sharding,
+            key,
+            body,
+            index: int,
+            compression: Optional[str] = None,
+            headers: Optional[dict] = None,
+            delivery_mode: Optional[int] = None,
+    ):
+        """
+        Публикует сообщение в шард, соответствующий ключу (см. `produce_message`).
+
+        Сообщения с одним ключом попадают в один шард и обрабатываются по порядку. Топология
+        шардов (`sharding.topology()`) должна быть объявлена заранее.
+        """
+        exchange, routing_key = sharding.route(key)
+        self.produce_message(exchange, routing_key, body, index, compression, headers, delivery_mode)
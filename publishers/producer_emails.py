@@ -1,47 +1,33 @@
-import json
 import logging
-import time
 
 from consumers_models.consumer_email_update_kyc import EmailUpdateRabbit
-from rabbitmq_conf import MQ_EMAIL_UPDATE_EXCHANGE_NAME, config_logging
+from publishers.producer_base import ProducerMixin
+from rabbitmq_conf import MQ_EMAIL_UPDATE_EXCHANGE_NAME, MQ_PUBLISH_RATE, config_logging
+from rate_limit import PublishThrottle
 
 logger = logging.getLogger(__name__)
 
 
-class ProducerEmails(EmailUpdateRabbit):
-
-    def produce_message(
-            self,
-            exchange,
-            routing_key,
-            body,
-            index: int
-    ):
-        """Producer."""
-        message = {
-            f"message-{index:02d}": body,
-        }
-        body_to_queue = json.dumps(message)
-        self.channel.basic_publish(
-            exchange=exchange,
-            routing_key=routing_key,
-            body=body_to_queue.encode(),
-        )
-        logger.info("Message sent to RabbitMQ : %s", body_to_queue)
+class ProducerEmails(ProducerMixin, EmailUpdateRabbit):
+    """Producer на основе `EmailUpdateRabbit`, см. `ProducerMixin`."""
 
 
 def main() -> None:
     config_logging()
-    with ProducerEmails() as mq:
+    with ProducerEmails(throttle=PublishThrottle(rate=MQ_PUBLISH_RATE)) as mq:
         mq.declare_email_update_exchange()
+        mq.declare_email_update_shards()
+        sharding = mq.email_update_sharding()
         for index in range(10):
+            user_id = f"user-{index % 3}"
             mq.produce_message(
                 routing_key="",
                 body="Hello world again!",
                 index=index,
                 exchange=MQ_EMAIL_UPDATE_EXCHANGE_NAME,
             )
-            time.sleep(2)
+            # Обновления одного пользователя обрабатываются по порядку в его шарде.
+            mq.produce_sharded_message(sharding, key=user_id, body=user_id, index=index)
 
 
 if __name__ == '__main__':
@@ -1,15 +1,21 @@
-import json
 import logging
 import sys
 import os
+import time
+import uuid
+from typing import Optional
 
 import pika
 from pika.adapters.blocking_connection import BlockingChannel
 
+from compression import compress
 from consumers_models.consumer_base import RabbitMQClientBase
-from rabbitmq_conf import config_logging
+from rabbitmq_conf import EventLogger, config_logging
+from serializers import encode
+from tracing import get_tracer
 
 logger = logging.getLogger(__name__)
+events = EventLogger(logger)
 
 
 def declare_queue(channel: "BlockingChannel", ) -> None:
@@ -25,23 +31,33 @@ def produce_message(
         exchange,
         routing_key,
         body,
-    index: int
+    index: int,
+    compression: Optional[str] = None,
 ):
-    """Producer."""
+    """Producer. Если задан compression, тела больше порога сжимаются этим алгоритмом."""
     message = {
         f"message-{index:02d}": body,
     }
-    body_to_queue = json.dumps(message)
+    body_to_queue, content_type = encode(message)
+    body_to_queue, content_encoding = compress(body_to_queue, compression)
+    tracer = get_tracer()
+    headers = tracer.inject()
+    started = time.perf_counter()
     channel.basic_publish(
         exchange=exchange,
         routing_key=routing_key,
-        body=body_to_queue.encode(),
+        body=body_to_queue,
         properties=pika.BasicProperties(
+            content_type=content_type,
+            message_id=uuid.uuid4().hex,
+            content_encoding=content_encoding,
+            headers=headers,
             delivery_mode=pika.DeliveryMode.Persistent,  # type: ignore # Делает сообщение persistent, не пропадают, если сервер перезагрузится.
             expiration='5000'  # TTL сообщения (в миллисекундах)
         )
     )
-    logger.info("Сообщение отправлено в RabbitMQ : %s", body_to_queue)
+    tracer.published(headers, time.perf_counter() - started, exchange=exchange)
+    events.info("message_published", exchange=exchange, body=body)
 
 
 def main() -> None:
@@ -1,5 +1,11 @@
-import pika
+import atexit
+import itertools
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Mapping, Optional
+
+import pika
 
 FORMAT_LOG_DEFAULT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
@@ -21,12 +27,161 @@ def get_connection() -> pika.BlockingConnection:
     return pika.BlockingConnection(parameters=connection_params)
 
 
-def config_logging(level: int = logging.INFO):
+def config_logging(level: int = logging.INFO, background: bool = False):
+    """
+    Настраивает корневой логгер.
+
+    :param level: Уровень логирования.
+    :param background: Выводить записи в отдельном потоке. Обработчики корневого логгера переносятся
+        в QueueListener, а поток, который логирует (цикл consumer'а), только кладёт запись в очередь;
+        форматирование сообщения тоже выполняется в потоке вывода.
+    """
+    global _listener
     logging.basicConfig(level=level,
                         format=FORMAT_LOG_DEFAULT,
                         datefmt='%Y-%m-%d %H:%M:%S')
+    if not background or _listener is not None:
+        return
+    root = logging.getLogger()
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = QueueListener(records, *root.handlers, respect_handler_level=True)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(records))
+    _listener.start()
+    # Записи, оставшиеся в очереди, выводятся при завершении процесса.
+    atexit.register(_listener.stop)
+
+
+_listener: Optional[QueueListener] = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в потоке логирующего.
+
+    Стандартный QueueHandler.prepare форматирует сообщение до постановки в очередь; здесь запись
+    передаётся как есть, и аргументы %s форматируются в QueueListener. Поэтому аргументы не должны
+    меняться после вызова логирования (тела сообщений - неизменяемые bytes).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Сколько символов тела сообщения попадает в лог.
+LOG_BODY_LIMIT = 256
+
+
+class LogBody:
+    """
+    Тело сообщения для логирования через %s: декодируется и обрезается только при выводе записи.
+
+    :param body: Тело (bytes, memoryview, str или MessageView).
+    :param limit: Сколько байт (символов) тела выводить.
+    """
+    __slots__ = ("body", "limit")
+
+    def __init__(self, body: Any, limit: int = LOG_BODY_LIMIT):
+        self.body = body
+        self.limit = limit
+
+    def __str__(self) -> str:
+        body = self.body
+        if hasattr(body, "preview"):
+            return body.preview(self.limit)
+        if isinstance(body, str):
+            text, size = body[:self.limit], len(body)
+        else:
+            view = memoryview(body)
+            text, size = bytes(view[:self.limit]).decode("utf-8", errors="replace"), view.nbytes
+        return text if size <= self.limit else f"{text}... ({size} bytes)"
+
+
+class _EventFields:
+    """Поля события, которые форматируются в "key=value ..." только при выводе записи."""
+    __slots__ = ("fields", "limit")
+
+    def __init__(self, fields: Mapping[str, Any], limit: int):
+        self.fields = fields
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return " ".join(f"{name}={_field(value, self.limit)}" for name, value in self.fields.items())
+
+
+def _field(value: Any, limit: int) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview, str)) or hasattr(value, "preview"):
+        return LogBody(value, limit)
+    return value
+
+
+class EventLogger:
+    """
+    Логирование событий в обработчиках сообщений: ленивое форматирование, выборка и обрезка тел.
+
+    Запись события - "<event> key=value ...". Поля форматируются только при выводе записи
+    (в потоке вывода, если логирование настроено с background=True), тела и строки обрезаются
+    до body_limit. Из событий с частотой выборки rate < 1 пишется каждое round(1 / rate)-е;
+    выборка выполняется до создания записи, поэтому пропущенное событие почти ничего не стоит.
+    Имя события, поля и частота доступны форматтерам в атрибутах записи event, fields и sample_rate.
+
+    :param logger: Логгер модуля.
+    :param sample_rates: Частота выборки по имени события (от 0 до 1); события без частоты пишутся все.
+    :param body_limit: Сколько байт (символов) тел и строковых полей выводить.
+    """
+
+    def __init__(
+            self,
+            logger: logging.Logger,
+            sample_rates: Optional[Mapping[str, float]] = None,
+            body_limit: int = LOG_BODY_LIMIT,
+    ):
+        self.logger = logger
+        self.sample_rates = dict(sample_rates or {})
+        self.body_limit = body_limit
+        self._counters: dict[str, itertools.count] = {}
+
+    def _sampled(self, event: str, rate: float) -> bool:
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        counter = self._counters.get(event)
+        if counter is None:
+            counter = self._counters.setdefault(event, itertools.count())
+        return next(counter) % round(1 / rate) == 0
+
+    def log(self, level: int, event: str, exc_info: Any = None, **fields: Any) -> None:
+        self._log(level, event, exc_info, fields)
+
+    def _log(self, level: int, event: str, exc_info: Any, fields: dict[str, Any]) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = self.sample_rates.get(event, 1.0)
+        if not self._sampled(event, rate):
+            return
+        self.logger.log(
+            level, "%s %s", event, _EventFields(fields, self.body_limit), exc_info=exc_info,
+            extra={"event": event, "fields": fields, "sample_rate": rate}, stacklevel=3,
+        )
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, None, fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self._log(logging.INFO, event, None, fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self._log(logging.WARNING, event, None, fields)
+
+    def error(self, event: str, exc_info: Any = None, **fields: Any) -> None:
+        self._log(logging.ERROR, event, exc_info, fields)
 
 
 MQ_EMAIL_UPDATE_EXCHANGE_NAME = "email_update_exchange"
 MQ_EMAIL_NAME_UPDATE_QUEUE_KYC = "email_update_kyc"
 MQ_EMAIL_NAME_UPDATE_NAW_LETTERS_QUEUE_KYC = "email_new_letters_update_kyc"
+MQ_EMAIL_UPDATE_SHARDS = 8
+# Лимит публикаций producer'ов в секунду.
+MQ_PUBLISH_RATE = 200.0
@@ -0,0 +1,244 @@
+"""
+Ограничение скорости публикации.
+
+TokenBucket пополняется со скоростью rate токенов в секунду до capacity. Запрос токенов
+не блокирует других: токены резервируются сразу (баланс может уйти в минус), а вызывающий
+ждёт столько, сколько нужно для погашения долга. Так несколько задач или потоков делят
+общий лимит без очереди ожидания.
+
+PublishThrottle добавляет к лимиту скорости обратное давление: publisher'ы
+приостанавливаются, пока брокер заблокировал соединение (connection.blocked) или пока
+неподтверждённых публикаций больше max_unconfirmed, вместо того чтобы копить сообщения
+в буферах клиента.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    import pika
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверяется снятие паузы, когда ожидание обслуживает соединение pika (connection.sleep).
+PAUSE_POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """
+    :param rate: Скорость пополнения, токенов в секунду.
+    :param capacity: Максимальный запас токенов (по умолчанию равен rate, то есть секунда нагрузки).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Резервирует токены и возвращает, сколько секунд нужно подождать перед их использованием."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Забирает токены, только если они доступны сейчас."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    async def acquire(self, tokens: float = 1) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self, tokens: float = 1) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class PublishBlockedError(RuntimeError):
+    """Публикация приостановлена дольше допустимого срока ожидания."""
+
+
+class PublishThrottle:
+    """
+    Ограничение скорости и обратное давление для publisher'ов.
+
+    Перед каждой публикацией вызывается `acquire` (или `acquire_blocking`), после подтверждения
+    брокера или неудачной публикации - `confirmed`. Один экземпляр можно разделять между
+    потоками, задачами и publisher'ами процесса.
+
+    :param rate: Лимит публикаций в секунду (None - без ограничения скорости).
+    :param capacity: Допустимый всплеск публикаций (по умолчанию равен rate).
+    :param max_unconfirmed: Сколько публикаций может ждать подтверждения одновременно (None - без ограничения).
+        Когда брокер не успевает подтверждать, publisher'ы останавливаются на этом пороге.
+    :param max_wait: Сколько секунд ждать снятия паузы по умолчанию, затем PublishBlockedError (None - без срока).
+    """
+
+    def __init__(
+            self,
+            rate: Optional[float] = None,
+            capacity: Optional[float] = None,
+            max_unconfirmed: Optional[int] = None,
+            max_wait: Optional[float] = None,
+    ):
+        if max_unconfirmed is not None and max_unconfirmed < 1:
+            raise ValueError("max_unconfirmed must be greater than 0")
+        self.bucket = TokenBucket(rate, capacity) if rate else None
+        self.max_unconfirmed = max_unconfirmed
+        self.max_wait = max_wait
+        self._unconfirmed = 0
+        self._blocked: Optional[str] = None
+        self._condition = threading.Condition()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._attached: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+    @property
+    def blocked(self) -> bool:
+        """Заблокировал ли брокер соединение."""
+        return self._blocked is not None
+
+    @property
+    def unconfirmed(self) -> int:
+        """Количество публикаций, ожидающих подтверждения."""
+        return self._unconfirmed
+
+    @property
+    def paused(self) -> bool:
+        """Приостановлены ли публикации."""
+        return self._blocked is not None or (
+            self.max_unconfirmed is not None and self._unconfirmed >= self.max_unconfirmed
+        )
+
+    def block(self, reason: str = "") -> None:
+        """Приостанавливает публикации до `unblock` (например, по connection.blocked)."""
+        with self._condition:
+            if self._blocked is None:
+                logger.warning("Publishing paused: connection blocked by broker (%s)", reason or "no reason")
+            self._blocked = reason
+
+    def unblock(self) -> None:
+        with self._condition:
+            if self._blocked is not None:
+                logger.info("Publishing resumed: connection unblocked")
+            self._blocked = None
+            self._notify()
+
+    def confirmed(self, count: int = 1) -> None:
+        """Освобождает место публикаций, подтверждённых брокером или завершившихся ошибкой."""
+        with self._condition:
+            self._unconfirmed = max(0, self._unconfirmed - count)
+            self._notify()
+
+    def _notify(self) -> None:
+        self._condition.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _try_reserve(self) -> bool:
+        if self.paused:
+            return False
+        self._unconfirmed += 1
+        return True
+
+    def attach(self, connection: "pika.BlockingConnection") -> None:
+        """
+        Приостанавливает публикации, пока брокер блокирует соединение pika (повторный вызов ничего не меняет).
+
+        Уведомления обрабатываются в потоке соединения, поэтому ожидание в `acquire_blocking`
+        должно обслуживать соединение: sleep=connection.sleep.
+        """
+        if connection in self._attached:
+            return
+        self._attached.add(connection)
+        connection.add_on_connection_blocked_callback(
+            lambda _, frame: self.block(getattr(frame.method, "reason", "")),
+        )
+        connection.add_on_connection_unblocked_callback(lambda *_: self.unblock())
+
+    def acquire_blocking(
+            self,
+            tokens: float = 1,
+            timeout: Optional[float] = None,
+            sleep: Optional[Callable[[float], None]] = None,
+    ) -> None:
+        """
+        Ждёт снятия паузы и лимита скорости, резервирует место неподтверждённой публикации.
+
+        :param tokens: Сколько токенов скорости расходует публикация.
+        :param timeout: Срок ожидания снятия паузы (по умолчанию max_wait).
+        :param sleep: Функция ожидания, например connection.sleep pika, чтобы во время паузы
+            соединение обрабатывало heartbeat'ы и connection.unblocked (по умолчанию time.sleep).
+        :raises PublishBlockedError: Пауза не снята за timeout.
+        """
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self._try_reserve():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PublishBlockedError(f"Publishing paused for more than {timeout}s")
+                if sleep is None:
+                    self._condition.wait(remaining)
+                    continue
+                self._condition.release()
+                try:
+                    sleep(PAUSE_POLL_INTERVAL if remaining is None else min(PAUSE_POLL_INTERVAL, remaining))
+                finally:
+                    self._condition.acquire()
+        if self.bucket is not None:
+            delay = self.bucket.reserve(tokens)
+            if delay > 0:
+                (sleep or time.sleep)(delay)
+
+    async def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> None:
+        """
+        Асинхронный вариант `acquire_blocking`.
+
+        :raises PublishBlockedError: Пауза не снята за timeout (по умолчанию max_wait).
+        """
+        timeout = self.max_wait if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._condition:
+                if self._try_reserve():
+                    break
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                raise PublishBlockedError(f"Publishing paused for more than {timeout}s") from None
+        if self.bucket is not None:
+            await self.bucket.acquire(tokens)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
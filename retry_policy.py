@@ -0,0 +1,79 @@
+"""
+Политика повторной обработки сообщений через очереди задержки.
+
+Вместо немедленного возврата в очередь (requeue=True) неудачное сообщение публикуется
+в очередь задержки своего уровня. Очередь задержки не имеет consumer'ов: по истечении
+x-message-ttl сообщение через dead-letter маршрутизацию возвращается в основную очередь.
+Номер попытки определяется по заголовку x-death, после max_attempts сообщение отклоняется
+без возврата и попадает в dead-letter очередь основной очереди.
+"""
+from dataclasses import dataclass
+from typing import Any, Optional
+
+DEFAULT_RETRY_EXCHANGE = "retry-exchange"
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    :param delays_ms: Задержки уровней в миллисекундах, попытка N ждёт delays_ms[N] (последний уровень повторяется).
+    :param max_attempts: Максимальное количество повторов (по умолчанию равно количеству уровней).
+    :param retry_exchange: Обменник, через который сообщения попадают в очереди задержки.
+    """
+    delays_ms: tuple[int, ...] = (1_000, 10_000, 60_000)
+    max_attempts: Optional[int] = None
+    retry_exchange: str = DEFAULT_RETRY_EXCHANGE
+
+    def __post_init__(self):
+        if not self.delays_ms:
+            raise ValueError("delays_ms must not be empty")
+
+    @property
+    def attempts(self) -> int:
+        return self.max_attempts if self.max_attempts is not None else len(self.delays_ms)
+
+    @staticmethod
+    def delay_queue_prefix(queue: str) -> str:
+        return f"{queue}.retry."
+
+    def delay_queue_name(self, queue: str, delay_ms: int) -> str:
+        return f"{self.delay_queue_prefix(queue)}{delay_ms}ms"
+
+    def delay_queues(self, queue: str) -> list[tuple[str, dict[str, Any]]]:
+        """
+        Возвращает имена и аргументы очередей задержки для основной очереди.
+
+        Истёкшие сообщения направляются через обменник по умолчанию прямо в основную очередь,
+        чтобы не попасть в другие очереди, привязанные к основному fanout-обменнику.
+        """
+        return [
+            (
+                self.delay_queue_name(queue, delay_ms),
+                {
+                    "x-message-ttl": delay_ms,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": queue,
+                },
+            )
+            for delay_ms in dict.fromkeys(self.delays_ms)
+        ]
+
+    def retry_count(self, queue: str, headers: Optional[dict[str, Any]]) -> int:
+        """Количество уже выполненных повторов по записям x-death очередей задержки."""
+        prefix = self.delay_queue_prefix(queue)
+        deaths = (headers or {}).get("x-death") or []
+        return sum(
+            int(death.get("count", 1))
+            for death in deaths
+            if str(death.get("queue", "")).startswith(prefix) and death.get("reason") == "expired"
+        )
+
+    def next_delay_queue(self, queue: str, headers: Optional[dict[str, Any]]) -> Optional[str]:
+        """
+        Возвращает очередь задержки для следующей попытки или None, если попытки исчерпаны.
+        """
+        attempt = self.retry_count(queue, headers)
+        if attempt >= self.attempts:
+            return None
+        delay_ms = self.delays_ms[min(attempt, len(self.delays_ms) - 1)]
+        return self.delay_queue_name(queue, delay_ms)
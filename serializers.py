@@ -0,0 +1,145 @@
+"""
+Реестр кодеков для тел сообщений.
+
+Кодек выбирается по свойству content_type сообщения: при публикации тело кодируется
+и content_type записывается в свойства, при получении тело декодируется лениво.
+Используется и pika, и aio_pika клиентами.
+"""
+import json
+from functools import cached_property
+from typing import Any, Optional, Protocol
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_RAW = "application/octet-stream"
+
+DEFAULT_CONTENT_TYPE = CONTENT_TYPE_JSON
+
+
+class UnknownContentTypeError(ValueError):
+    """Для content_type не зарегистрирован кодек."""
+
+
+class Codec(Protocol):
+    content_type: str
+
+    def encode(self, payload: Any) -> bytes:
+        ...
+
+    def decode(self, body: bytes) -> Any:
+        ...
+
+
+class JsonCodec:
+    """JSON через стандартную библиотеку."""
+    content_type = CONTENT_TYPE_JSON
+
+    def encode(self, payload: Any) -> bytes:
+        return json.dumps(payload).encode()
+
+    def decode(self, body: bytes) -> Any:
+        return json.loads(body)
+
+
+class OrjsonCodec:
+    """JSON через orjson: кодирует сразу в bytes, без промежуточной строки."""
+    content_type = CONTENT_TYPE_JSON
+
+    def encode(self, payload: Any) -> bytes:
+        return orjson.dumps(payload)
+
+    def decode(self, body: bytes) -> Any:
+        return orjson.loads(body)
+
+
+class MsgpackCodec:
+    """Компактный бинарный формат MessagePack."""
+    content_type = CONTENT_TYPE_MSGPACK
+
+    def encode(self, payload: Any) -> bytes:
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, body: bytes) -> Any:
+        return msgpack.unpackb(body, raw=False)
+
+
+class RawCodec:
+    """Тело передаётся как есть."""
+    content_type = CONTENT_TYPE_RAW
+
+    def encode(self, payload: Any) -> bytes:
+        if not isinstance(payload, (bytes, bytearray, memoryview)):
+            raise TypeError(f"{CONTENT_TYPE_RAW} payload must be bytes-like, not {type(payload).__name__}")
+        return bytes(payload)
+
+    def decode(self, body: bytes) -> Any:
+        return body
+
+
+_codecs: dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """Регистрирует кодек для его content_type, заменяя ранее зарегистрированный."""
+    _codecs[codec.content_type] = codec
+
+
+def get_codec(content_type: Optional[str]) -> Codec:
+    """
+    Возвращает кодек для content_type.
+
+    Сообщения без content_type считаются сырыми байтами.
+
+    :raises UnknownContentTypeError: Для content_type не зарегистрирован кодек (например, опечатка в типе).
+    """
+    if not content_type:
+        return _codecs[CONTENT_TYPE_RAW]
+    codec = _codecs.get(content_type.split(";", 1)[0].strip())
+    if codec is None:
+        raise UnknownContentTypeError(f"No codec registered for content type {content_type!r}")
+    return codec
+
+
+def encode(payload: Any, content_type: str = DEFAULT_CONTENT_TYPE) -> tuple[bytes, str]:
+    """
+    Кодирует payload кодеком для content_type.
+
+    :return: Тело сообщения и content_type, который нужно записать в свойства сообщения.
+    """
+    codec = get_codec(content_type)
+    return codec.encode(payload), codec.content_type
+
+
+def decode(body: bytes, content_type: Optional[str]) -> Any:
+    """Декодирует тело сообщения кодеком для content_type."""
+    return get_codec(content_type).decode(body)
+
+
+class LazyPayload:
+    """
+    Тело сообщения, которое декодируется только при первом обращении к value.
+    """
+
+    def __init__(self, body: bytes, content_type: Optional[str]) -> None:
+        self.body = body
+        self.content_type = content_type
+
+    @cached_property
+    def value(self) -> Any:
+        return decode(self.body, self.content_type)
+
+
+register_codec(RawCodec())
+register_codec(OrjsonCodec() if orjson is not None else JsonCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
@@ -0,0 +1,196 @@
+"""
+Шардирование очереди по ключу сообщения с сохранением порядка для одного ключа.
+
+Сообщения публикуются в direct-обменник шардов с ключом маршрутизации - номером шарда,
+который вычисляется consistent hash (jump hash) от ключа сообщения, например id пользователя.
+Все сообщения одного ключа попадают в одну очередь-шард и обрабатываются последовательно,
+а разные шарды обрабатываются параллельно разными consumer'ами, процессами и узлами.
+
+Шарды распределяются между экземплярами consumer'ов без внешнего координатора: экземпляры
+раз в heartbeat_interval рассылают heartbeat через fanout-обменник участников, и каждый
+по одному и тому же списку живых участников вычисляет одинаковое распределение
+(rendezvous hashing с ограничением нагрузки). При появлении или пропаже участника
+перемещается только часть шардов.
+
+Очереди шардов объявляются с x-single-active-consumer: пока прежний владелец не отменил
+consumer'а, новый не получает сообщений, поэтому при перераспределении шард не
+обрабатывается двумя экземплярами одновременно.
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+
+from topology import Topology
+
+logger = logging.getLogger(__name__)
+
+EVENT_ALIVE = "alive"
+EVENT_LEAVE = "leave"
+
+
+def stable_hash(value: Union[str, bytes]) -> int:
+    """64-битный хэш, одинаковый во всех процессах (в отличие от встроенного hash)."""
+    if isinstance(value, str):
+        value = value.encode()
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+
+
+def jump_hash(key: Union[str, bytes, int], buckets: int) -> int:
+    """
+    Номер корзины для ключа (Lamping, Veach. A Fast, Minimal Memory, Consistent Hash Algorithm).
+
+    При увеличении количества корзин с n до n + 1 в новую корзину переходит 1 / (n + 1) ключей,
+    остальные остаются на месте.
+    """
+    if buckets < 1:
+        raise ValueError("buckets must be greater than 0")
+    key = key & 0xFFFFFFFFFFFFFFFF if isinstance(key, int) else stable_hash(key)
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def assign_shards(shards: int, members: list[str]) -> dict[str, list[int]]:
+    """
+    Распределяет шарды между участниками.
+
+    Каждый шард достаётся участнику с наибольшим весом hash(участник, шард), у которого ещё
+    не набрано ceil(shards / участники) шардов. Результат зависит только от списка участников,
+    поэтому все экземпляры вычисляют одно и то же распределение.
+    """
+    members = sorted(set(members))
+    assignment: dict[str, list[int]] = {member: [] for member in members}
+    if not members:
+        return assignment
+    capacity = math.ceil(shards / len(members))
+    for shard in range(shards):
+        ranked = sorted(members, key=lambda member: stable_hash(f"{member}:{shard}"), reverse=True)
+        owner = next(member for member in ranked if len(assignment[member]) < capacity)
+        assignment[owner].append(shard)
+    return assignment
+
+
+@dataclass(frozen=True)
+class Sharding:
+    """
+    Шардированная очередь.
+
+    :param name: Базовое имя: обменник `<name>.shards`, очереди `<name>.shard.<номер>`.
+    :param shards: Количество шардов. Изменение количества переназначает часть ключей на другие шарды,
+        поэтому порядок сообщений одного ключа на время перехода не гарантируется.
+    :param durable: Устойчивые ли обменник и очереди.
+    """
+    name: str
+    shards: int = 8
+    durable: bool = True
+
+    def __post_init__(self):
+        if self.shards < 1:
+            raise ValueError("shards must be greater than 0")
+
+    @property
+    def exchange(self) -> str:
+        return f"{self.name}.shards"
+
+    @property
+    def members_exchange(self) -> str:
+        return f"{self.name}.members"
+
+    def queue_name(self, shard: int) -> str:
+        return f"{self.name}.shard.{shard}"
+
+    @staticmethod
+    def routing_key(shard: int) -> str:
+        return str(shard)
+
+    def shard_for(self, key: Union[str, bytes, int]) -> int:
+        return jump_hash(key, self.shards)
+
+    def route(self, key: Union[str, bytes, int]) -> tuple[str, str]:
+        """Обменник и ключ маршрутизации для сообщения с ключом key."""
+        return self.exchange, self.routing_key(self.shard_for(key))
+
+    def topology(self) -> Topology:
+        """Обменник шардов, очереди шардов и их привязки."""
+        topology = Topology().exchange(self.exchange, "direct", durable=self.durable)
+        for shard in range(self.shards):
+            queue = self.queue_name(shard)
+            topology.queue(queue, durable=self.durable, arguments={"x-single-active-consumer": True})
+            topology.bind(queue, self.exchange, self.routing_key(shard))
+        return topology
+
+    def membership_topology(self) -> Topology:
+        """Обменник участников и личная очередь экземпляра для heartbeat'ов (имя задаёт брокер)."""
+        return (
+            Topology()
+            .exchange(self.members_exchange, "fanout")
+            .queue("", exclusive=True, auto_delete=True)
+            .bind("", self.members_exchange)
+        )
+
+
+class ShardMembership:
+    """
+    Живые участники группы consumer'ов по heartbeat'ам.
+
+    :param member_id: Идентификатор этого экземпляра (по умолчанию случайный).
+    :param ttl: Через сколько секунд без heartbeat'а участник считается ушедшим.
+    """
+
+    def __init__(self, member_id: Optional[str] = None, ttl: float = 15.0):
+        self.member_id = member_id or uuid.uuid4().hex
+        self.ttl = ttl
+        self._seen: dict[str, float] = {self.member_id: time.monotonic()}
+        self._lock = threading.Lock()
+
+    @property
+    def members(self) -> list[str]:
+        with self._lock:
+            return sorted(self._seen)
+
+    def heartbeat(self) -> bytes:
+        """Сообщение о том, что экземпляр жив."""
+        return json.dumps({"member": self.member_id, "event": EVENT_ALIVE}).encode()
+
+    def leave(self) -> bytes:
+        """Сообщение об уходе экземпляра."""
+        return json.dumps({"member": self.member_id, "event": EVENT_LEAVE}).encode()
+
+    def handle(self, body: bytes) -> bool:
+        """Учитывает heartbeat другого участника, возвращает True, если состав группы изменился."""
+        try:
+            event: dict[str, Any] = json.loads(body)
+            member = str(event["member"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed membership message: %r", body)
+            return False
+        with self._lock:
+            if event.get("event") == EVENT_LEAVE:
+                return member != self.member_id and self._seen.pop(member, None) is not None
+            known = member in self._seen
+            self._seen[member] = time.monotonic()
+            return not known
+
+    def expire(self) -> bool:
+        """Удаляет участников без heartbeat'а дольше ttl, возвращает True, если состав изменился."""
+        now = time.monotonic()
+        with self._lock:
+            self._seen[self.member_id] = now
+            expired = [member for member, seen in self._seen.items() if now - seen > self.ttl]
+            for member in expired:
+                del self._seen[member]
+                logger.info("Member %s expired", member)
+            return bool(expired)
+
+    def assigned(self, sharding: Sharding) -> list[int]:
+        """Шарды этого экземпляра при текущем составе группы."""
+        return assign_shards(sharding.shards, self.members)[self.member_id]
@@ -0,0 +1,468 @@
+"""
+Локальный журнал публикаций (write-ahead spool) для pika publisher'ов.
+
+Publisher дописывает сообщение в отображённый в память (mmap) сегмент на диске и сразу
+возвращает управление, не дожидаясь брокера. Фоновый поток SpoolDrainer читает сегменты
+по порядку и публикует сообщения порциями в транзакции канала (tx_select/tx_commit): брокер
+подтверждает всю порцию одним Tx.CommitOk, а не каждое сообщение отдельно, как синхронный
+confirm_delivery BlockingChannel. После фиксации позиция сохраняется в файле checkpoint,
+полностью отправленные сегменты удаляются. Если брокер недоступен, сообщения копятся
+на диске (не больше max_bytes) и отправляются после переподключения.
+
+Запись, которую брокер раз за разом отклоняет (например, exchange удалён) или которую
+не удаётся разобрать, не должна останавливать журнал: после max_attempts неудачных попыток
+она переносится в журнал недоставленных записей (подкаталог `dead-letter`) того же формата,
+и отправка продолжается со следующей записи.
+
+Формат сегмента `<номер>.seg` фиксированного размера:
+
+    [длина: uint32][crc32: uint32][метаданные: uint16 длина + JSON][тело] ...
+
+Длина записывается последней, поэтому читатель не видит недописанную запись; 0 означает
+конец данных, SEALED - что запись в сегмент закончена и нужно переходить к следующему.
+После перезапуска писатель всегда начинает новый сегмент.
+
+Гарантия доставки - at-least-once: сообщение, подтверждённое брокером до сохранения
+checkpoint, после перезапуска будет опубликовано повторно. Заголовки сохраняются в JSON,
+поэтому значения, не представимые в JSON, записываются строкой.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Iterator, NamedTuple, Optional
+
+import pika
+from pika.exceptions import AMQPChannelError, AMQPError
+
+from consumers_models.connection_pool import open_blocking_connection
+from rate_limit import PublishBlockedError, PublishThrottle
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint"
+DEAD_LETTER_DIRECTORY = "dead-letter"
+DEFAULT_MAX_ATTEMPTS = 5
+
+_RECORD_HEADER = struct.Struct("<II")
+_META_LENGTH = struct.Struct("<H")
+_POSITION = struct.Struct("<QQ")
+SEALED = 0xFFFFFFFF
+
+_PROPERTY_NAMES = (
+    "content_type", "content_encoding", "headers", "delivery_mode", "priority", "correlation_id",
+    "reply_to", "expiration", "message_id", "timestamp", "type", "user_id", "app_id", "cluster_id",
+)
+
+
+class SpoolFullError(RuntimeError):
+    """Сообщение не помещается в пустой сегмент или журнал занял max_bytes на диске."""
+
+
+class SpooledMessage(NamedTuple):
+    exchange: str
+    routing_key: str
+    body: bytes
+    properties: pika.BasicProperties
+
+
+class Position(NamedTuple):
+    segment: int
+    offset: int
+
+
+def _encode(exchange: str, routing_key: str, body: bytes, properties: Optional[pika.BasicProperties]) -> bytes:
+    props = {}
+    if properties is not None:
+        props = {name: getattr(properties, name) for name in _PROPERTY_NAMES if getattr(properties, name) is not None}
+    meta = json.dumps({"e": exchange, "r": routing_key, "p": props}, default=str).encode()
+    return _META_LENGTH.pack(len(meta)) + meta + body
+
+
+def _decode(payload: bytes) -> SpooledMessage:
+    (meta_length,) = _META_LENGTH.unpack_from(payload)
+    meta = json.loads(payload[_META_LENGTH.size:_META_LENGTH.size + meta_length])
+    body = payload[_META_LENGTH.size + meta_length:]
+    return SpooledMessage(meta["e"], meta["r"], body, pika.BasicProperties(**meta["p"]))
+
+
+class _Segment:
+    """Отображённый в память файл сегмента."""
+
+    def __init__(self, path: str, size: int, create: bool = False):
+        self.path = path
+        if create:
+            with open(path, "wb") as file:
+                file.truncate(size)
+        self._file = open(path, "r+b")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.map = mmap.mmap(self._file.fileno(), self.size)
+
+    def close(self) -> None:
+        self.map.close()
+        self._file.close()
+
+
+class PublishSpool:
+    """
+    Журнал сообщений для публикации.
+
+    :param directory: Каталог сегментов (создаётся при необходимости).
+    :param segment_size: Размер сегмента в байтах, ограничивает максимальный размер сообщения.
+    :param sync: Сбрасывать ли сегмент на диск (msync) после каждой записи. Без этого данные
+        переживают падение процесса, но не падение ОС.
+    :param max_bytes: Предельный объём сегментов на диске (None - без ограничения). Когда для
+        нового сегмента нет места, append бросает SpoolFullError, пока SpoolDrainer не отправит
+        и не удалит старые сегменты.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            sync: bool = False,
+            max_bytes: Optional[int] = None,
+    ):
+        if max_bytes is not None and max_bytes < segment_size:
+            raise ValueError("max_bytes must be at least segment_size")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self._closed = False
+        segments = self.segments()
+        self._writer = self._open_segment((segments[-1] + 1) if segments else 0)
+        self._write_offset = 0
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, segment: int) -> tuple[int, _Segment]:
+        return segment, _Segment(self._path(segment), self.segment_size, create=True)
+
+    def segments(self) -> list[int]:
+        """Номера сегментов на диске по возрастанию."""
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def disk_usage(self) -> int:
+        """Объём сегментов на диске в байтах."""
+        return len(self.segments()) * self.segment_size
+
+    def append(
+            self,
+            exchange: str,
+            routing_key: str,
+            body: bytes,
+            properties: Optional[pika.BasicProperties] = None,
+    ) -> None:
+        """
+        Дописывает сообщение в журнал.
+
+        :raises SpoolFullError: Сообщение больше сегмента или журнал достиг max_bytes.
+        """
+        self.append_record(_encode(exchange, routing_key, body, properties))
+
+    def append_record(self, payload: bytes) -> None:
+        """Дописывает уже закодированную запись (например, перенесённую из другого журнала)."""
+        record_size = _RECORD_HEADER.size + len(payload)
+        # В конце сегмента всегда остаётся место под отметку SEALED.
+        if record_size + _RECORD_HEADER.size > self.segment_size:
+            raise SpoolFullError(f"Record of {len(payload)} bytes does not fit into a spool segment")
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Spool is closed")
+            segment_number, segment = self._writer
+            if self._write_offset + record_size + _RECORD_HEADER.size > segment.size:
+                if self.max_bytes is not None and self.disk_usage() + self.segment_size > self.max_bytes:
+                    raise SpoolFullError(f"Spool reached its disk limit of {self.max_bytes} bytes")
+                self._seal()
+                segment_number, segment = self._writer
+            offset = self._write_offset
+            data_offset = offset + _RECORD_HEADER.size
+            segment.map[data_offset:data_offset + len(payload)] = payload
+            # Заголовок пишется последним: до этого читатель видит 0 и считает, что данных нет.
+            segment.map[offset:data_offset] = _RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+            self._write_offset = data_offset + len(payload)
+            if self.sync:
+                segment.map.flush()
+            self._appended.notify_all()
+
+    def _seal(self) -> None:
+        segment_number, segment = self._writer
+        segment.map[self._write_offset:self._write_offset + 4] = struct.pack("<I", SEALED)
+        segment.map.flush()
+        segment.close()
+        self._writer = self._open_segment(segment_number + 1)
+        self._write_offset = 0
+
+    def flush(self) -> None:
+        with self._lock:
+            self._writer[1].map.flush()
+
+    def wait(self, timeout: float) -> None:
+        """Ждёт новую запись не дольше timeout секунд."""
+        with self._lock:
+            self._appended.wait(timeout)
+
+    def wake(self) -> None:
+        """Прерывает ожидание в wait."""
+        with self._lock:
+            self._appended.notify_all()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._writer[1].map.flush()
+            self._writer[1].close()
+            self._appended.notify_all()
+
+    def load_checkpoint(self) -> Position:
+        """Позиция первого неподтверждённого сообщения."""
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE), "rb") as file:
+                return Position(*_POSITION.unpack(file.read(_POSITION.size)))
+        except (FileNotFoundError, struct.error):
+            segments = self.segments()
+            return Position(segments[0] if segments else 0, 0)
+
+    def commit(self, position: Position) -> None:
+        """Сохраняет позицию и удаляет сегменты, все сообщения которых подтверждены."""
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "wb") as file:
+            file.write(_POSITION.pack(*position))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        for segment in self.segments():
+            if segment >= position.segment:
+                break
+            os.remove(self._path(segment))
+
+    def read(self, position: Position, limit: int) -> Iterator[tuple[SpooledMessage, Position]]:
+        """
+        Читает до limit сообщений начиная с position.
+
+        Возвращает пары (сообщение, позиция после него).
+        """
+        for payload, next_position in self.read_records(position, limit):
+            yield _decode(payload), next_position
+
+    def read_records(self, position: Position, limit: int) -> Iterator[tuple[bytes, Position]]:
+        """Как `read`, но возвращает записи без разбора."""
+        count = 0
+        while count < limit:
+            segments = self.segments()
+            if position.segment not in segments:
+                later = [segment for segment in segments if segment > position.segment]
+                if not later:
+                    return
+                position = Position(later[0], 0)
+            segment = _Segment(self._path(position.segment), self.segment_size)
+            try:
+                offset = position.offset
+                while count < limit and offset + _RECORD_HEADER.size <= segment.size:
+                    length, crc = _RECORD_HEADER.unpack_from(segment.map, offset)
+                    if length == SEALED:
+                        break
+                    end = offset + _RECORD_HEADER.size + length
+                    payload = segment.map[offset + _RECORD_HEADER.size:end] if length else b""
+                    if not length or end > segment.size or zlib.crc32(payload) != crc:
+                        # Конец данных: сегмент дописывается сейчас или запись оборвалась при падении.
+                        if any(other > position.segment for other in self.segments()):
+                            break
+                        return
+                    offset = end
+                    count += 1
+                    yield payload, Position(position.segment, offset)
+                else:
+                    if count >= limit:
+                        return
+            finally:
+                segment.close()
+            position = Position(position.segment + 1, 0)
+
+
+class SpoolDrainer(threading.Thread):
+    """
+    Фоновая отправка сообщений из журнала в RabbitMQ.
+
+    :param spool: Журнал сообщений.
+    :param connection_params: Параметры подключения (или MemoryConnectionParameters).
+    :param batch_size: Сколько сообщений публикуется одной транзакцией между сохранениями checkpoint.
+    :param retry_interval: Пауза перед переподключением после ошибки в секундах.
+    :param throttle: Если задан, отправка ограничивается по скорости и приостанавливается,
+        пока брокер блокирует соединение; сообщения тем временем остаются в журнале.
+        Неподтверждёнными считаются сообщения текущей транзакции: при max_unconfirmed
+        меньше batch_size транзакция фиксируется раньше.
+    :param max_attempts: После скольких отклонённых брокером публикаций запись переносится
+        в dead_letter.
+    :param dead_letter: Журнал недоставленных записей (по умолчанию подкаталог `dead-letter`
+        журнала spool, создаётся при первой такой записи).
+    """
+
+    def __init__(
+            self,
+            spool: PublishSpool,
+            connection_params: pika.ConnectionParameters,
+            batch_size: int = 100,
+            retry_interval: float = 1.0,
+            throttle: Optional[PublishThrottle] = None,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            dead_letter: Optional[PublishSpool] = None,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        super().__init__(name="spool-drainer", daemon=True)
+        self.spool = spool
+        self.connection_params = connection_params
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.throttle = throttle
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+        self._owns_dead_letter = dead_letter is None
+        self.published = 0
+        self.quarantined = 0
+        self._stopping = threading.Event()
+        self._connection: Optional[pika.BlockingConnection] = None
+        self._channel = None
+        # После ошибки канала порция отправляется по одной записи до этой позиции, чтобы найти виновную.
+        self._probe_until: Optional[Position] = None
+        self._failures: tuple[Optional[Position], int] = (None, 0)
+
+    def _connect(self) -> None:
+        self._connection = open_blocking_connection(self.connection_params)
+        self._channel = self._connection.channel()
+        self._channel.tx_select()
+
+    def _disconnect(self) -> None:
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except AMQPError:
+                pass
+
+    def _commit(self, position: Position, count: int) -> None:
+        """Фиксирует транзакцию из count сообщений и сохраняет позицию после них."""
+        try:
+            if count:
+                self._channel.tx_commit()
+        finally:
+            if self.throttle is not None and count:
+                self.throttle.confirmed(count)
+        self.spool.commit(position)
+        self.published += count
+
+    def _quarantine(self, payload: bytes, next_position: Position, reason: str) -> None:
+        """Переносит запись в журнал недоставленных и сдвигает checkpoint за неё."""
+        if self.dead_letter is None:
+            self.dead_letter = PublishSpool(
+                os.path.join(self.spool.directory, DEAD_LETTER_DIRECTORY), self.spool.segment_size,
+            )
+        self.dead_letter.append_record(payload)
+        self.dead_letter.flush()
+        self.spool.commit(next_position)
+        self.quarantined += 1
+        logger.error("Spool record moved to %s: %s", self.dead_letter.directory, reason)
+
+    def drain_once(self) -> int:
+        """
+        Публикует одну порцию сообщений и сохраняет позицию.
+
+        Возвращает количество обработанных записей: отправленных и перенесённых в dead_letter.
+        """
+        checkpoint = self.spool.load_checkpoint()
+        if self._probe_until is not None and checkpoint >= self._probe_until:
+            self._probe_until = None
+        if self._failures[0] != checkpoint:
+            self._failures = (checkpoint, 0)
+        limit = self.batch_size if self._probe_until is None else 1
+        position, pending, handled = checkpoint, 0, 0
+        record: Optional[tuple[bytes, Position]] = None
+        try:
+            for record in self.spool.read_records(checkpoint, limit):
+                payload, next_position = record
+                try:
+                    message = _decode(payload)
+                except (ValueError, KeyError, TypeError, struct.error) as e:
+                    # Повтор не поможет: запись сразу переносится, отправленное до неё фиксируется.
+                    count, pending = pending, 0
+                    self._commit(position, count)
+                    self._quarantine(payload, next_position, f"undecodable record: {e!r}")
+                    handled += count + 1
+                    position = next_position
+                    continue
+                if self._channel is None:
+                    self._connect()
+                if self.throttle is not None:
+                    self.throttle.attach(self._connection)
+                    if pending and self.throttle.paused:
+                        # Места неподтверждённых публикаций освобождает только фиксация транзакции.
+                        count, pending = pending, 0
+                        self._commit(position, count)
+                        handled += count
+                    self.throttle.acquire_blocking(sleep=self._connection.sleep)
+                pending += 1
+                self._channel.basic_publish(
+                    exchange=message.exchange,
+                    routing_key=message.routing_key,
+                    body=message.body,
+                    properties=message.properties,
+                )
+                position = next_position
+            count, pending = pending, 0
+            self._commit(position, count)
+            handled += count
+        except AMQPChannelError as e:
+            # Канал закрыт брокером из-за одной из записей порции (или записи checkpoint при поиске).
+            if self.throttle is not None and pending:
+                self.throttle.confirmed(pending)
+            self._disconnect()
+            if limit > 1:
+                self._probe_until = record[1] if record is not None else None
+                raise
+            failed_at, attempts = self._failures
+            self._failures = (failed_at, attempts + 1)
+            if attempts + 1 < self.max_attempts:
+                raise
+            self._quarantine(record[0], record[1], f"rejected {attempts + 1} times: {e!r}")
+            handled += 1
+        except BaseException:
+            if self.throttle is not None and pending:
+                self.throttle.confirmed(pending)
+            raise
+        return handled
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if not self.drain_once():
+                    self.spool.wait(self.retry_interval)
+            except (AMQPError, OSError, PublishBlockedError) as e:
+                logger.warning("Spool drain failed, retrying in %.1fs: %s", self.retry_interval, e)
+                self._disconnect()
+                self._stopping.wait(self.retry_interval)
+        self._disconnect()
+        if self._owns_dead_letter and self.dead_letter is not None:
+            self.dead_letter.close()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Останавливает поток, неотправленные сообщения остаются в журнале."""
+        self._stopping.set()
+        self.spool.wake()
+        self.join(timeout)
@@ -0,0 +1,27 @@
+import uuid
+
+import pytest
+
+from memory_broker.blocking import MemoryConnectionParameters
+from memory_broker.broker import MemoryBroker, get_broker
+
+
+@pytest.fixture
+def broker_name() -> str:
+    """Отдельный брокер в памяти на тест: состояние тестов не пересекается."""
+    return uuid.uuid4().hex
+
+
+@pytest.fixture
+def memory_url(broker_name: str) -> str:
+    return f"memory://{broker_name}"
+
+
+@pytest.fixture
+def memory_params(memory_url: str) -> MemoryConnectionParameters:
+    return MemoryConnectionParameters(memory_url)
+
+
+@pytest.fixture
+def broker(broker_name: str) -> MemoryBroker:
+    return get_broker(broker_name)
@@ -0,0 +1,75 @@
+"""Сериализация и сжатие тел сообщений."""
+import zlib
+
+import pika
+import pytest
+
+from compression import (
+    DEFAULT_ENCODING, ENCODING_DEFLATE, DecompressionError, UnsupportedEncodingError, compress, decompress,
+    decompressing)
+from consumers_models.connection_pool import open_blocking_connection
+from serializers import CONTENT_TYPE_RAW, UnknownContentTypeError, decode, encode, get_codec
+
+
+def test_default_encoding_does_not_depend_on_installed_libraries():
+    assert DEFAULT_ENCODING == ENCODING_DEFLATE
+
+
+def test_compress_round_trip_and_small_bodies_stay_plain():
+    body = b"x" * 4096
+    compressed, encoding = compress(body, ENCODING_DEFLATE)
+    assert encoding == ENCODING_DEFLATE
+    assert decompress(compressed, encoding) == body
+    assert compress(b"tiny", ENCODING_DEFLATE) == (b"tiny", None)
+    assert compress(body, None) == (body, None)
+
+
+@pytest.mark.parametrize("encoding", [None, "", "identity"])
+def test_decompress_passes_plain_bodies_through(encoding):
+    assert decompress(b"body", encoding) == b"body"
+
+
+def test_decompress_rejects_unknown_encoding():
+    with pytest.raises(UnsupportedEncodingError):
+        decompress(b"body", "brotli")
+
+
+def test_decompress_wraps_corrupt_data():
+    with pytest.raises(DecompressionError):
+        decompress(b"garbage", ENCODING_DEFLATE)
+
+
+def test_decompressing_rejects_undecodable_pika_message(memory_params, broker):
+    connection = open_blocking_connection(memory_params)
+    channel = connection.channel()
+    channel.queue_declare("q", arguments={"x-dead-letter-exchange": "dlx"})
+    channel.exchange_declare("dlx", "fanout")
+    channel.queue_declare("dlq")
+    channel.queue_bind("dlq", "dlx")
+    received = []
+    callback = decompressing(lambda ch, method, properties, body: received.append(body))
+    for body, encoding in ((zlib.compress(b"hello"), "deflate"), (b"zzz", "brotli"), (b"garbage", "deflate")):
+        channel.basic_publish("", "q", body, pika.BasicProperties(content_encoding=encoding))
+        method, properties, body = channel.basic_get("q")
+        callback(channel, method, properties, body)
+    connection.close()
+    assert received == [b"hello"]
+    assert broker.message_count("dlq") == 2
+
+
+def test_unknown_content_type_is_an_error():
+    with pytest.raises(UnknownContentTypeError):
+        get_codec("application/jsn")
+    with pytest.raises(UnknownContentTypeError):
+        decode(b"{}", "application/x-unknown")
+    assert get_codec(None).content_type == CONTENT_TYPE_RAW
+
+
+def test_json_round_trip_with_parameters():
+    body, content_type = encode({"a": 1})
+    assert decode(body, f"{content_type}; charset=utf-8") == {"a": 1}
+
+
+def test_raw_codec_requires_bytes():
+    with pytest.raises(TypeError):
+        encode({"a": 1}, CONTENT_TYPE_RAW)
@@ -0,0 +1,27 @@
+"""Отбор сообщений dead letter очереди для повторной публикации."""
+import zlib
+from types import SimpleNamespace
+
+import pytest
+
+from asyncmq.dead_letter_replay import ReplayFilter
+
+
+def _dead(body: bytes, content_encoding=None):
+    return SimpleNamespace(
+        body=body,
+        content_encoding=content_encoding,
+        message_id="m-1",
+        headers={"x-death": [{"reason": "rejected", "queue": "main-queue", "count": 1}]},
+    )
+
+
+@pytest.mark.parametrize("body, content_encoding, expected", [
+    (zlib.compress(b"order 42"), "deflate", True),
+    (zlib.compress(b"order 7"), "deflate", False),
+    (b"garbage", "deflate", False),
+    (b"order 42", "brotli", False),
+])
+def test_predicate_sees_decompressed_body(body, content_encoding, expected):
+    replay_filter = ReplayFilter(reasons={"rejected"}, predicate=lambda body, headers: b"42" in body)
+    assert replay_filter.matches(_dead(body, content_encoding)) is expected
@@ -0,0 +1,46 @@
+"""Pika consumer с dead letter очередью и повторами на брокере в памяти."""
+import pika
+
+from consumers_models.consumer_email_simple_dead_letter_exchange import RabbitMQWithDeadLetters
+from retry_policy import RetryPolicy
+
+
+def test_retry_skips_messages_settled_by_handler(memory_params, broker):
+    retry_policy = RetryPolicy(delays_ms=(60000,))
+
+    def handler(channel, method, properties, body):
+        if body != b"fails":
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+        if body == b"stop":
+            channel.stop_consuming()
+        raise RuntimeError(body)
+
+    with RabbitMQWithDeadLetters(connection_params=memory_params, retry_policy=retry_policy) as client:
+        client.setup_infrastructure()
+        for body in (b"fails", b"acked", b"stop"):
+            client.channel.basic_publish(client.main_exchange, "", body, pika.BasicProperties())
+        client.run(handler)
+    # Повтор запланирован только для сообщения, которое обработчик не завершил.
+    assert broker.message_count(retry_policy.delay_queue_name(client.main_queue, 60000)) == 1
+    assert broker.message_count(client.main_queue) == 0
+    assert broker.message_count(client.dead_letter_queue) == 0
+
+
+def test_main_consumer_prefetch_is_limited(memory_params):
+    peak = 0
+    handled = 0
+
+    with RabbitMQWithDeadLetters(connection_params=memory_params) as client:
+        def handler(channel, method, properties, body):
+            nonlocal peak, handled
+            peak = max(peak, client.channel._state.consumer_unacked)
+            handled += 1
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            if handled == 10:
+                channel.stop_consuming()
+
+        client.setup_infrastructure()
+        for index in range(10):
+            client.channel.basic_publish(client.main_exchange, "", b"%d" % index, pika.BasicProperties())
+        client.run(handler, prefetch_count=3)
+    assert peak == 3
@@ -0,0 +1,77 @@
+"""Пропуск повторных доставок."""
+import pika
+import pytest
+
+from consumers_models.connection_pool import open_blocking_connection
+from dedup import REPLAY_COUNT_HEADER, MemoryDedupStore, dedup_key, deduplicating
+
+
+@pytest.fixture
+def channel(memory_params):
+    connection = open_blocking_connection(memory_params)
+    channel = connection.channel()
+    channel.queue_declare("q")
+    yield channel
+    connection.close()
+
+
+def _deliver(channel, message_id):
+    channel.basic_publish("", "q", b"body", pika.BasicProperties(message_id=message_id))
+    return channel.basic_get("q")
+
+
+def test_key_is_released_when_handler_fails(channel):
+    store = MemoryDedupStore()
+    calls = []
+
+    def handler(ch, method, properties, body):
+        calls.append(properties.message_id)
+        if len(calls) == 1:
+            raise RuntimeError("handler failed")
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    callback = deduplicating(handler, store)
+    with pytest.raises(RuntimeError):
+        callback(channel, *_deliver(channel, "m-1"))
+    assert "m-1" not in store
+    callback(channel, *_deliver(channel, "m-1"))
+    callback(channel, *_deliver(channel, "m-1"))
+    assert calls == ["m-1", "m-1"]
+    assert "m-1" in store
+
+
+def test_key_is_released_when_handler_requeues(channel):
+    store = MemoryDedupStore()
+
+    def handler(ch, method, properties, body):
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+    deduplicating(handler, store)(channel, *_deliver(channel, "m-1"))
+    assert "m-1" not in store
+
+
+def test_distinct_message_ids_with_equal_bodies_are_not_duplicates(channel):
+    store = MemoryDedupStore()
+    calls = []
+
+    def handler(ch, method, properties, body):
+        calls.append(body)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    callback = deduplicating(handler, store)
+    callback(channel, *_deliver(channel, "m-1"))
+    callback(channel, *_deliver(channel, "m-2"))
+    assert calls == [b"body", b"body"]
+
+
+def test_dead_letter_round_trip_is_a_new_attempt():
+    assert dedup_key("m-1", b"") == "m-1"
+    assert dedup_key("m-1", b"", {"x-death": [{"count": 1}]}) == "m-1#1.0"
+    assert dedup_key("m-1", b"", {REPLAY_COUNT_HEADER: 2}) == "m-1#0.2"
+
+
+def test_memory_store_evicts_oldest_keys():
+    store = MemoryDedupStore(max_size=2, ttl=None)
+    assert store.add("a") and store.add("b") and store.add("c")
+    assert "a" not in store
+    assert not store.add("c")
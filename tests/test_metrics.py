@@ -0,0 +1,32 @@
+"""Метрики: текстовый формат Prometheus и учёт публикаций."""
+import asyncio
+
+from aio_pika import Message
+
+from asyncmq.batch_publisher import BatchPublisher
+from asyncmq.worker import QueueRabbitClient
+from metrics import Metrics, disable_metrics, enable_metrics
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.published.inc(exchange='a\\b "c"\nd')
+    assert 'mq_messages_published_total{exchange="a\\\\b \\"c\\"\\nd"} 1' in metrics.render().splitlines()
+
+
+def test_batch_publisher_counts_only_confirmed_publishes(memory_url):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            await client.declare_exchange("x")
+            async with BatchPublisher(client, "x") as publisher:
+                assert (await publisher.publish(Message(b"ok"))).confirmed
+                await client.channel.exchange_delete("x")
+                assert not (await publisher.publish(Message(b"lost"))).confirmed
+
+    metrics = enable_metrics(Metrics())
+    try:
+        asyncio.run(main())
+    finally:
+        disable_metrics()
+    assert metrics.published.value(exchange="x") == 1
+    assert metrics.publish_failed.value(exchange="x") == 1
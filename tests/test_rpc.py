@@ -0,0 +1,73 @@
+"""RPC поверх direct reply-to."""
+import asyncio
+import json
+
+import pytest
+
+from asyncmq.rpc import RpcClient, RpcError, RpcServer, RpcTimeoutError
+from asyncmq.worker import QueueRabbitClient
+
+
+def _run_with_server(memory_url, handler, scenario):
+    async def main():
+        async with QueueRabbitClient(memory_url) as server_client, QueueRabbitClient(memory_url) as client:
+            await server_client.set_prefetch(10)
+            serving = asyncio.create_task(RpcServer(server_client).serve("lookup", handler))
+            await asyncio.sleep(0.05)
+            try:
+                async with RpcClient(client, timeout=2) as rpc:
+                    return await scenario(rpc)
+            finally:
+                server_client.request_shutdown()
+                await serving
+
+    return asyncio.run(main())
+
+
+async def _lookup(message):
+    request = json.loads(message.body)
+    if request["id"] == 13:
+        raise ValueError("unknown id")
+    if request["id"] == 42:
+        await asyncio.sleep(1)
+    return json.dumps({"id": request["id"]}).encode()
+
+
+def test_concurrent_calls_get_their_own_replies(memory_url):
+    async def scenario(rpc):
+        replies = await asyncio.gather(*(rpc.call("lookup", json.dumps({"id": i}).encode()) for i in range(20)
+                                         if i != 13))
+        return [json.loads(reply)["id"] for reply in replies], rpc.pending
+
+    ids, pending = _run_with_server(memory_url, _lookup, scenario)
+    assert ids == [i for i in range(20) if i != 13]
+    assert pending == 0
+
+
+def test_server_error_is_raised_on_client(memory_url):
+    async def scenario(rpc):
+        with pytest.raises(RpcError, match="unknown id"):
+            await rpc.call("lookup", b'{"id": 13}')
+
+    _run_with_server(memory_url, _lookup, scenario)
+
+
+def test_timeout_without_server(memory_url):
+    async def scenario(rpc):
+        with pytest.raises(RpcTimeoutError) as error:
+            await rpc.call("nobody", b"{}", timeout=0.1)
+        assert isinstance(error.value, asyncio.TimeoutError)
+        return rpc.pending
+
+    assert _run_with_server(memory_url, _lookup, scenario) == 0
+
+
+def test_late_reply_after_timeout_is_dropped(memory_url):
+    async def scenario(rpc):
+        with pytest.raises(RpcTimeoutError):
+            await rpc.call("lookup", b'{"id": 42}', timeout=0.1)
+        # Опоздавший ответ не попадает в следующий вызов.
+        reply = await rpc.call("lookup", b'{"id": 1}')
+        return json.loads(reply), rpc.pending
+
+    assert _run_with_server(memory_url, _lookup, scenario) == ({"id": 1}, 0)
@@ -0,0 +1,123 @@
+"""Шардирование: распределение шардов и перебалансировка при смене состава группы."""
+import asyncio
+import collections
+import json
+
+import pytest
+from aio_pika import Message
+
+from asyncmq.batch_publisher import BatchPublisher
+from asyncmq.worker import QueueRabbitClient
+from publishers.producer_emails import ProducerEmails
+from sharding import Sharding, ShardMembership, assign_shards, jump_hash
+
+
+def test_jump_hash_moves_minimal_share_of_keys():
+    moved = sum(jump_hash(f"user{i}", 8) != jump_hash(f"user{i}", 9) for i in range(9000))
+    # В новую корзину переходит около 1/9 ключей.
+    assert 700 < moved < 1300
+
+
+def test_assignment_is_balanced_and_deterministic():
+    assignment = assign_shards(8, ["b", "a", "c"])
+    assert assignment == assign_shards(8, ["a", "b", "c"])
+    assert sorted(shard for shards in assignment.values() for shard in shards) == list(range(8))
+    assert all(len(shards) <= 3 for shards in assignment.values())
+
+
+def test_membership_tracks_join_and_leave():
+    membership = ShardMembership("a")
+    other = ShardMembership("b")
+    assert membership.handle(other.heartbeat())
+    assert not membership.handle(other.heartbeat())
+    assert membership.members == ["a", "b"]
+    assert membership.handle(other.leave())
+    assert membership.members == ["a"]
+
+
+def test_rebalance_keeps_every_message_and_per_key_order(memory_url):
+    sharding = Sharding("s", shards=6, durable=False)
+
+    async def main():
+        seen: dict[str, list[int]] = collections.defaultdict(list)
+        handled_by: collections.Counter = collections.Counter()
+
+        def handler_for(name):
+            async def handler(message):
+                payload = json.loads(message.body)
+                seen[payload["key"]].append(payload["n"])
+                handled_by[name] += 1
+                await asyncio.sleep(0.001)
+                await message.ack()
+            return handler
+
+        async with QueueRabbitClient(memory_url) as first, QueueRabbitClient(memory_url) as second:
+            await first.set_prefetch(4)
+            await second.set_prefetch(4)
+            first_task = asyncio.create_task(
+                first.consume_shards(sharding, handler_for("first"), member_id="m1", heartbeat_interval=0.05),
+            )
+            await asyncio.sleep(0.05)
+            second_task = asyncio.create_task(
+                second.consume_shards(sharding, handler_for("second"), member_id="m2", heartbeat_interval=0.05),
+            )
+            await asyncio.sleep(0.3)
+            exchange = await first.channel.get_exchange(sharding.exchange)
+            for n in range(300):
+                key = f"user{n % 10}"
+                await exchange.publish(Message(json.dumps({"key": key, "n": n}).encode()),
+                                       routing_key=sharding.route(key)[1])
+                if n % 10 == 0:
+                    await asyncio.sleep(0.01)
+                if n == 150:
+                    # Второй экземпляр уходит, его шарды забирает первый.
+                    second.request_shutdown()
+            await asyncio.sleep(1.0)
+            first.request_shutdown()
+            await asyncio.gather(first_task, second_task)
+        return seen, handled_by
+
+    seen, handled_by = asyncio.run(main())
+    assert sum(len(numbers) for numbers in seen.values()) == 300
+    assert all(numbers == sorted(numbers) for numbers in seen.values())
+    assert handled_by["first"] > 0 and handled_by["second"] > 0
+
+
+def test_producer_routes_keys_to_shards(memory_params, broker):
+    sharding = Sharding("s", shards=4, durable=False)
+    with ProducerEmails(connection_params=memory_params) as mq:
+        mq.declare_topology(sharding.topology())
+        for index in range(20):
+            mq.produce_sharded_message(sharding, key=f"user{index % 5}", body="update", index=index)
+    expected = collections.Counter(sharding.shard_for(f"user{index % 5}") for index in range(20))
+    assert {shard: broker.message_count(sharding.queue_name(shard)) for shard in expected} == expected
+
+
+def test_batch_publisher_feeds_consume_shards(memory_url):
+    sharding = Sharding("s", shards=4, durable=False)
+
+    async def main():
+        seen: dict[str, list[int]] = collections.defaultdict(list)
+
+        async def handler(message):
+            payload = json.loads(message.body)
+            seen[payload["key"]].append(payload["n"])
+            await message.ack()
+
+        async with QueueRabbitClient(memory_url) as client:
+            await client.declare_topology(sharding.topology())
+            async with BatchPublisher(client, sharding.exchange) as publisher:
+                for n in range(40):
+                    key = f"user{n % 4}"
+                    message = Message(json.dumps({"key": key, "n": n}).encode())
+                    assert (await publisher.publish_sharded(sharding, key, message, index=n)).confirmed
+                with pytest.raises(ValueError):
+                    await publisher.publish_sharded(Sharding("other", shards=2), "user0", Message(b""))
+            task = asyncio.create_task(client.consume_shards(sharding, handler, heartbeat_interval=0.05))
+            await asyncio.sleep(0.3)
+            client.request_shutdown()
+            await task
+        return seen
+
+    seen = asyncio.run(main())
+    assert seen == {f"user{k}": list(range(k, 40, 4)) for k in range(4)}
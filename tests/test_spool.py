@@ -0,0 +1,97 @@
+"""Журнал публикаций: восстановление после перезапуска, карантин записей, лимит диска."""
+import os
+import time
+
+import pytest
+
+from consumers_models.connection_pool import open_blocking_connection
+from rate_limit import PublishThrottle
+from spool import DEAD_LETTER_DIRECTORY, PublishSpool, SpoolDrainer, SpoolFullError
+
+SEGMENT_SIZE = 4096
+
+
+def _wait(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queue(memory_params):
+    connection = open_blocking_connection(memory_params)
+    connection.channel().queue_declare("q")
+    yield "q"
+    connection.close()
+
+
+def test_messages_survive_restart_and_are_sent_once(tmp_path, memory_params, broker, queue):
+    spool = PublishSpool(str(tmp_path), segment_size=SEGMENT_SIZE)
+    for index in range(100):
+        spool.append("", queue, b"m%d" % index)
+    drainer = SpoolDrainer(spool, memory_params, batch_size=30)
+    drainer.start()
+    _wait(lambda: drainer.published == 100)
+    drainer.stop(2)
+    # Записи, сделанные без drainer'а, отправляются после перезапуска; отправленные - повторно не уходят.
+    for index in range(100, 110):
+        spool.append("", queue, b"m%d" % index)
+    spool.close()
+
+    restarted = PublishSpool(str(tmp_path), segment_size=SEGMENT_SIZE)
+    drainer = SpoolDrainer(restarted, memory_params)
+    drainer.start()
+    _wait(lambda: drainer.published == 10)
+    drainer.stop(2)
+    restarted.close()
+    assert broker.message_count(queue) == 110
+    # Сегменты до checkpoint удалены.
+    assert restarted.segments()[0] == restarted.load_checkpoint().segment
+
+
+def test_poison_records_are_quarantined(tmp_path, memory_params, broker, queue):
+    spool = PublishSpool(str(tmp_path), segment_size=SEGMENT_SIZE)
+    for index in range(30):
+        if index == 7:
+            spool.append("missing-exchange", queue, b"poison")
+        elif index == 12:
+            spool.append_record(b"\x05\x00{bad}junk")
+        else:
+            spool.append("", queue, b"m%d" % index)
+    drainer = SpoolDrainer(spool, memory_params, batch_size=10, retry_interval=0.01, max_attempts=3)
+    drainer.start()
+    _wait(lambda: drainer.published == 28 and drainer.quarantined == 2)
+    drainer.stop(2)
+    spool.close()
+    # Порция с отклонённой записью не публикуется частично, поэтому дубликатов нет.
+    assert broker.message_count(queue) == 28
+    dead_letter = PublishSpool(os.path.join(str(tmp_path), DEAD_LETTER_DIRECTORY), segment_size=SEGMENT_SIZE)
+    records = [record for record, _ in dead_letter.read_records(dead_letter.load_checkpoint(), 10)]
+    dead_letter.close()
+    assert len(records) == 2
+    assert records[0].endswith(b"poison")
+
+
+def test_unconfirmed_limit_flushes_transaction_early(tmp_path, memory_params, broker, queue):
+    spool = PublishSpool(str(tmp_path), segment_size=SEGMENT_SIZE)
+    for index in range(25):
+        spool.append("", queue, b"m%d" % index)
+    throttle = PublishThrottle(max_unconfirmed=4)
+    drainer = SpoolDrainer(spool, memory_params, batch_size=10, throttle=throttle)
+    assert drainer.drain_once() == 10
+    drainer._disconnect()
+    spool.close()
+    assert throttle.unconfirmed == 0
+    assert broker.message_count(queue) == 10
+
+
+def test_disk_limit(tmp_path):
+    spool = PublishSpool(str(tmp_path), segment_size=SEGMENT_SIZE, max_bytes=2 * SEGMENT_SIZE)
+    with pytest.raises(SpoolFullError):
+        for _ in range(1000):
+            spool.append("", "q", b"x" * 100)
+    assert spool.disk_usage() == 2 * SEGMENT_SIZE
+    spool.close()
+    with pytest.raises(ValueError):
+        PublishSpool(str(tmp_path), segment_size=SEGMENT_SIZE, max_bytes=SEGMENT_SIZE - 1)
@@ -0,0 +1,35 @@
+"""Масштабирование процессов-воркеров супервизора."""
+import signal
+import time
+
+from consumers_models.supervisor import ConsumerSupervisor
+
+
+def slow_stopping_worker() -> None:
+    """Воркер, который после SIGTERM ещё полсекунды дорабатывает сообщение."""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    while not stopping:
+        time.sleep(0.01)
+    time.sleep(0.5)
+
+
+def test_scale_down_drains_workers_outside_target(memory_params):
+    supervisor = ConsumerSupervisor(slow_stopping_worker, "q", connection_params=memory_params, shutdown_timeout=5)
+    try:
+        supervisor.scale(2)
+        time.sleep(0.5)
+        first, stopped = supervisor.workers
+        supervisor.scale(1)
+        supervisor.scale(1)
+        assert supervisor.workers == [first]
+        assert supervisor.draining == [stopped]
+        # Останавливаемый воркер не занимает место в target: новый запускается сразу.
+        supervisor.scale(2)
+        assert len(supervisor.workers) == 2 and stopped.is_alive()
+        stopped.join(timeout=5)
+        supervisor.reap()
+        assert stopped.exitcode == 0
+        assert len(supervisor.workers) == 2 and supervisor.draining == []
+    finally:
+        supervisor.shutdown()
@@ -0,0 +1,65 @@
+"""Pika consumer с обработкой в пуле потоков."""
+import threading
+
+import pika
+import pytest
+
+from consumers_models.consumer_email_update_kyc import EmailUpdateRabbit
+from consumers_models.threaded_consumer import DEFAULT_MAX_WORKERS, ThreadedCallback, worker_count
+from memory_broker.blocking import BlockingConnection
+
+
+def test_worker_count():
+    assert worker_count(8) == 8
+    assert worker_count(0) == DEFAULT_MAX_WORKERS
+    assert worker_count(0, workers=3) == 3
+    with pytest.raises(ValueError):
+        worker_count(0, workers=0)
+
+
+def test_threaded_consumer_with_unlimited_prefetch(memory_params, broker):
+    handled = []
+    lock = threading.Lock()
+
+    def handler(channel, method, properties, body):
+        with lock:
+            handled.append(body)
+            done = len(handled) == 20
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        if done:
+            channel.connection.add_callback_threadsafe(channel.stop_consuming)
+
+    with EmailUpdateRabbit(connection_params=memory_params) as client:
+        client.channel.queue_declare("q")
+        for index in range(20):
+            client.channel.basic_publish("", "q", b"%d" % index, pika.BasicProperties())
+        client.consume_messages(handler, exclusive=False, prefetch_count=0, queue_name="q", threaded=True)
+    assert len(handled) == 20
+    assert broker.message_count("q") == 0
+
+
+def test_close_after_connection_lost_waits_for_handlers(memory_params, broker):
+    release = threading.Event()
+    finished = []
+
+    def handler(channel, method, properties, body):
+        release.wait()
+        finished.append(body)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    callback = ThreadedCallback(handler)
+    connection = BlockingConnection(memory_params)
+    channel = connection.channel()
+    channel.queue_declare("q")
+    channel.basic_publish("", "q", b"body", pika.BasicProperties())
+    channel.basic_consume("q", callback)
+    connection.process_data_events(time_limit=0)
+    assert callback.in_flight == 1
+
+    connection.close()
+    threading.Timer(0.05, release.set).start()
+    callback.close(connection)
+    assert finished == [b"body"]
+    assert callback.in_flight == 0
+    # Без подтверждения сообщение возвращается в очередь при закрытии соединения.
+    assert broker.message_count("q") == 1
@@ -0,0 +1,225 @@
+"""QueueRabbitClient на брокере в памяти: остановка, prefetch, повторы, дедупликация, распаковка."""
+import asyncio
+import zlib
+
+import pytest
+from aio_pika import Message
+
+from asyncmq.scheduler import QueueSource
+from asyncmq.worker import DeadLetterQueueClient, QueueRabbitClient
+from dedup import MemoryDedupStore
+from prefetch import AdaptivePrefetch
+from retry_policy import RetryPolicy
+
+
+async def _publish(client: QueueRabbitClient, routing_key: str, count: int, **properties) -> None:
+    for index in range(count):
+        await client.channel.default_exchange.publish(Message(str(index).encode(), **properties), routing_key=routing_key)
+
+
+async def _consume_for(client: QueueRabbitClient, seconds: float, consume):
+    task = asyncio.create_task(consume)
+    await asyncio.sleep(seconds)
+    client.request_shutdown()
+    return await task
+
+
+def test_shutdown_drains_in_flight_and_returns_buffered(memory_url, broker):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            await client.set_prefetch(10)
+            queue = await client.declare_queue("q")
+            await _publish(client, "q", 30)
+            acked = []
+
+            async def handler(message):
+                await asyncio.sleep(0.2)
+                await message.ack()
+                acked.append(message.body)
+
+            report = await _consume_for(client, 0.05, client.consume(queue, handler, max_in_flight=2))
+            return report, acked
+
+    report, acked = asyncio.run(main())
+    assert len(acked) == 2
+    assert report.drained == 2
+    assert report.returned == 8
+    assert broker.message_count("q") == 28
+
+
+@pytest.mark.parametrize("many", [False, True])
+def test_prefetch_zero_is_unbounded(memory_url, many):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            await client.set_prefetch(0)
+            queue = await client.declare_queue("q")
+            await _publish(client, "q", 5)
+            handled = []
+
+            async def handler(message):
+                handled.append(message.body)
+                await message.ack()
+
+            consume = client.consume_many([QueueSource(queue, handler)]) if many else client.consume(queue, handler)
+            await _consume_for(client, 0.1, consume)
+            return handled
+
+    assert len(asyncio.run(main())) == 5
+
+
+@pytest.mark.parametrize("max_in_flight", [0, -1])
+def test_max_in_flight_must_be_positive(memory_url, max_in_flight):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            queue = await client.declare_queue("q")
+            with pytest.raises(ValueError):
+                await client.consume(queue, lambda message: None, max_in_flight=max_in_flight)
+
+    asyncio.run(main())
+
+
+def test_adaptive_prefetch_grows_past_initial_limit(memory_url):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            await client.set_prefetch(4)
+            queue = await client.declare_queue("q")
+            await _publish(client, "q", 400)
+            controller = AdaptivePrefetch(min_prefetch=4, max_prefetch=64, interval=0.05, initial_rtt=0.05)
+            peak = 0
+
+            async def handler(message):
+                nonlocal peak
+                peak = max(peak, client.channel._state.consumer_unacked)
+                await asyncio.sleep(0.005)
+                await message.ack()
+
+            await _consume_for(
+                client, 1.0, client.consume(queue, handler, max_in_flight=4, prefetch_controller=controller),
+            )
+            return client.prefetch_count, peak
+
+    prefetch_count, peak = asyncio.run(main())
+    assert prefetch_count > 4
+    assert peak > 4
+
+
+def test_retry_policy_moves_message_to_dead_letter_queue(memory_url, broker):
+    async def main():
+        client = DeadLetterQueueClient(memory_url, retry_policy=RetryPolicy(delays_ms=(20,), max_attempts=2))
+        async with client:
+            main_queue, _ = await client.setup_infrastructure()
+            exchange = await client.channel.get_exchange(client.main_exchange)
+            await exchange.publish(Message(b"fails"), routing_key="")
+            attempts = []
+
+            async def handler(message):
+                attempts.append(message.body)
+                await client.retry(message)
+
+            await _consume_for(client, 0.5, client.consume(main_queue, handler))
+            return attempts
+
+    attempts = asyncio.run(main())
+    assert attempts == [b"fails"] * 3
+    assert broker.message_count("dead-letter-queue") == 1
+    assert broker.message_count("main-queue") == 0
+
+
+def test_retry_skips_messages_settled_by_handler(memory_url, broker):
+    async def main():
+        client = DeadLetterQueueClient(memory_url, retry_policy=RetryPolicy(delays_ms=(60000,)))
+        async with client:
+            await client.set_prefetch(1)
+            main_queue, _ = await client.setup_infrastructure()
+            exchange = await client.channel.get_exchange(client.main_exchange)
+            await exchange.publish(Message(b"fails"), routing_key="")
+            await exchange.publish(Message(b"acked"), routing_key="")
+
+            async def handler(message):
+                if message.body == b"acked":
+                    await message.ack()
+                raise RuntimeError(message.body)
+
+            await _consume_for(client, 0.2, client.consume(main_queue, client.retrying(handler)))
+            return client.retry_policy.delay_queue_name(client.main_queue, 60000)
+
+    delay_queue = asyncio.run(main())
+    assert broker.message_count(delay_queue) == 1
+    assert broker.message_count("main-queue") == 0
+
+
+def test_dedup_releases_key_when_handler_requeues(memory_url):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            await client.set_prefetch(1)
+            queue = await client.declare_queue("q")
+            await _publish(client, "q", 1, message_id="m-1")
+            await _publish(client, "q", 1, message_id="m-1")
+            calls = []
+
+            async def handler(message):
+                calls.append(message.redelivered)
+                if len(calls) == 1:
+                    await message.nack(requeue=True)
+                else:
+                    await message.ack()
+
+            store = MemoryDedupStore()
+            await _consume_for(client, 0.2, client.consume(queue, handler, dedup_store=store))
+            return calls, store
+
+    calls, store = asyncio.run(main())
+    # Первая доставка вернулась в очередь - ключ освобождён и повтор обработан;
+    # копия с тем же message_id после успешной обработки пропущена.
+    assert calls == [False, True]
+    assert "m-1" in store
+
+
+def test_unknown_content_encoding_is_dead_lettered(memory_url, broker):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            dead_letters = await client.declare_exchange("dlx")
+            dlq = await client.declare_queue("dlq")
+            await client.bind_queue(dlq, dead_letters.name)
+            queue = await client.declare_queue("q", arguments={"x-dead-letter-exchange": "dlx"})
+            exchange = client.channel.default_exchange
+            await exchange.publish(Message(zlib.compress(b"hello"), content_encoding="deflate"), routing_key="q")
+            await exchange.publish(Message(b"zzz", content_encoding="brotli"), routing_key="q")
+            received = []
+
+            async def handler(message):
+                received.append((message.body, message.content_encoding))
+                await message.ack()
+
+            await _consume_for(client, 0.1, client.consume(queue, handler))
+            return received
+
+    received = asyncio.run(main())
+    assert received == [(b"hello", None)]
+    assert broker.message_count("dlq") == 1
+
+
+def test_corrupt_compressed_body_is_dead_lettered(memory_url, broker):
+    async def main():
+        async with QueueRabbitClient(memory_url) as client:
+            await client.set_prefetch(1)
+            dead_letters = await client.declare_exchange("dlx")
+            dlq = await client.declare_queue("dlq")
+            await client.bind_queue(dlq, dead_letters.name)
+            queue = await client.declare_queue("q", arguments={"x-dead-letter-exchange": "dlx"})
+            exchange = client.channel.default_exchange
+            await exchange.publish(Message(b"garbage", content_encoding="deflate"), routing_key="q")
+            await exchange.publish(Message(zlib.compress(b"hello"), content_encoding="deflate"), routing_key="q")
+            received = []
+
+            async def handler(message):
+                received.append(message.body)
+                await message.ack()
+
+            # С prefetch 1 второе сообщение доставляется, только если первое освободило слот.
+            await _consume_for(client, 0.1, client.consume(queue, handler))
+            return received
+
+    assert asyncio.run(main()) == [b"hello"]
+    assert broker.message_count("dlq") == 1
+    assert broker.message_count("q") == 0
@@ -0,0 +1,339 @@
+"""
+Декларативное описание топологии RabbitMQ: обменники, очереди и привязки.
+
+Топология задаётся в коде или загружается из YAML/словаря и применяется одним проходом:
+сначала обменники, затем очереди, затем привязки. Уже объявленные процессом сущности
+запоминаются в TopologyCache и повторно не объявляются:
+
+* устойчивые (durable, без auto_delete) - на уровне брокера, поэтому переподключения
+  и повторные запуски consumer'ов в том же процессе не делают лишних RPC;
+* остальные - на время жизни соединения, на котором они объявлены.
+
+Если сущность удалили на брокере в обход процесса, кэш сбрасывается через `invalidate()`.
+Используется и pika (`apply_blocking`), и aio_pika (`apply_async`) клиентами.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, Hashable, Optional, Union
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractChannel
+    from pika.adapters.blocking_connection import BlockingChannel
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExchangeSpec:
+    name: str
+    type: str = "fanout"
+    durable: bool = False
+    auto_delete: bool = False
+    internal: bool = False
+    arguments: dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Допускаются перечисления ExchangeType из pika и aio_pika.
+        self.type = getattr(self.type, "value", self.type)
+
+    @property
+    def key(self) -> tuple:
+        return ("exchange", self.name)
+
+    @property
+    def persistent(self) -> bool:
+        return self.durable and not self.auto_delete
+
+
+@dataclass
+class QueueSpec:
+    name: str
+    durable: bool = False
+    exclusive: bool = False
+    auto_delete: bool = False
+    arguments: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key(self) -> tuple:
+        return ("queue", self.name)
+
+    @property
+    def persistent(self) -> bool:
+        return self.durable and not self.exclusive and not self.auto_delete
+
+
+@dataclass
+class BindingSpec:
+    queue: str
+    exchange: str
+    routing_key: str = ""
+    arguments: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key(self) -> tuple:
+        return ("binding", self.queue, self.exchange, self.routing_key, tuple(sorted(self.arguments.items())))
+
+
+Spec = Union[ExchangeSpec, QueueSpec, BindingSpec]
+
+
+@dataclass
+class Topology:
+    """
+    Набор обменников, очередей и привязок.
+
+    Очередь с пустым именем объявляется с именем, сгенерированным брокером, и никогда не кэшируется;
+    привязки с пустым именем очереди относятся к ней. В топологии может быть только одна такая очередь.
+    """
+    exchanges: list[ExchangeSpec] = field(default_factory=list)
+    queues: list[QueueSpec] = field(default_factory=list)
+    bindings: list[BindingSpec] = field(default_factory=list)
+
+    def exchange(self, name: str, type: str = "fanout", **kwargs: Any) -> "Topology":
+        self.exchanges.append(ExchangeSpec(name, type, **kwargs))
+        return self
+
+    def queue(self, name: str, **kwargs: Any) -> "Topology":
+        self.queues.append(QueueSpec(name, **kwargs))
+        return self
+
+    def bind(self, queue: str, exchange: str, routing_key: str = "", **kwargs: Any) -> "Topology":
+        self.bindings.append(BindingSpec(queue, exchange, routing_key, **kwargs))
+        return self
+
+    def merge(self, other: "Topology") -> "Topology":
+        return Topology(
+            exchanges=self.exchanges + other.exchanges,
+            queues=self.queues + other.queues,
+            bindings=self.bindings + other.bindings,
+        )
+
+    def specs(self) -> list[Spec]:
+        """Все сущности в порядке объявления."""
+        return [*self.exchanges, *self.queues, *self.bindings]
+
+    def validate(self) -> None:
+        if sum(1 for queue in self.queues if not queue.name) > 1:
+            raise ValueError("Topology may contain at most one server-named queue")
+
+    def to_dict(self) -> dict[str, list[dict[str, Any]]]:
+        return {
+            "exchanges": [asdict(spec) for spec in self.exchanges],
+            "queues": [asdict(spec) for spec in self.queues],
+            "bindings": [asdict(spec) for spec in self.bindings],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Topology":
+        return cls(
+            exchanges=[ExchangeSpec(**item) for item in data.get("exchanges") or []],
+            queues=[QueueSpec(**item) for item in data.get("queues") or []],
+            bindings=[BindingSpec(**item) for item in data.get("bindings") or []],
+        )
+
+    @classmethod
+    def from_yaml(cls, path: str) -> "Topology":
+        """
+        Загружает топологию из YAML-файла вида:
+
+            exchanges:
+              - {name: main-exchange, type: fanout, durable: true}
+            queues:
+              - name: main-queue
+                durable: true
+                arguments: {x-dead-letter-exchange: dead-letter-exchange}
+            bindings:
+              - {queue: main-queue, exchange: main-exchange}
+        """
+        if yaml is None:
+            raise RuntimeError("PyYAML is required to load topology from YAML")
+        with open(path) as file:
+            return cls.from_dict(yaml.safe_load(file) or {})
+
+
+class TopologyCache:
+    """Сущности, уже объявленные процессом: по брокеру для устойчивых и по соединению для остальных."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._brokers: dict[Hashable, dict[tuple, Spec]] = {}
+        self._connections: "weakref.WeakKeyDictionary[Any, dict[tuple, Spec]]" = weakref.WeakKeyDictionary()
+
+    def _declared(self, broker_key: Hashable, connection: Any) -> dict[tuple, Spec]:
+        declared = dict(self._brokers.get(broker_key, {}))
+        declared.update(self._connections.get(connection, {}))
+        return declared
+
+    def plan(self, topology: Topology, broker_key: Hashable, connection: Any) -> list[Spec]:
+        """
+        Возвращает сущности топологии, которые нужно объявить.
+
+        Пропускаются сущности, объявленные ранее с теми же параметрами. Сущность с изменёнными
+        параметрами объявляется повторно, чтобы брокер сообщил о несовпадении (PRECONDITION_FAILED).
+        """
+        topology.validate()
+        with self._lock:
+            declared = self._declared(broker_key, connection)
+        pending = []
+        for spec in topology.specs():
+            if isinstance(spec, QueueSpec) and not spec.name:
+                pending.append(spec)
+            elif isinstance(spec, BindingSpec) and not spec.queue:
+                pending.append(spec)
+            elif declared.get(spec.key) != spec:
+                pending.append(spec)
+                declared[spec.key] = spec
+        return pending
+
+    def remember(self, specs: list[Spec], topology: Topology, broker_key: Hashable, connection: Any) -> None:
+        """Запоминает объявленные сущности."""
+        exchanges = {spec.name: spec for spec in topology.exchanges}
+        queues = {spec.name: spec for spec in topology.queues}
+        with self._lock:
+            durable = self._brokers.setdefault(broker_key, {})
+            transient = self._connections.setdefault(connection, {})
+            for spec in specs:
+                if isinstance(spec, QueueSpec) and not spec.name or isinstance(spec, BindingSpec) and not spec.queue:
+                    continue
+                if isinstance(spec, BindingSpec):
+                    # Привязка живёт, пока живы очередь и обменник (обменник по умолчанию вечен).
+                    queue = queues.get(spec.queue) or durable.get(("queue", spec.queue))
+                    exchange = exchanges.get(spec.exchange) or durable.get(("exchange", spec.exchange))
+                    persistent = bool(
+                        queue and queue.persistent and (not spec.exchange or exchange and exchange.persistent)
+                    )
+                else:
+                    persistent = spec.persistent
+                (durable if persistent else transient)[spec.key] = spec
+
+    def invalidate(self, broker_key: Optional[Hashable] = None) -> None:
+        """Сбрасывает кэш брокера (или весь кэш, если broker_key не указан)."""
+        with self._lock:
+            if broker_key is None:
+                self._brokers.clear()
+                self._connections.clear()
+            else:
+                self._brokers.pop(broker_key, None)
+
+
+_cache = TopologyCache()
+
+
+def get_topology_cache() -> TopologyCache:
+    return _cache
+
+
+def invalidate(broker_key: Optional[Hashable] = None) -> None:
+    _cache.invalidate(broker_key)
+
+
+def apply_blocking(
+        channel: "BlockingChannel",
+        topology: Topology,
+        broker_key: Hashable,
+        cache: Optional[TopologyCache] = None,
+) -> dict[str, str]:
+    """
+    Объявляет недостающие сущности топологии через канал pika.
+
+    Возвращает:
+        dict[str, str]: Соответствие имён очередей топологии объявленным именам
+            (для очереди с пустым именем - имя, сгенерированное брокером).
+    """
+    cache = cache or _cache
+    connection = channel.connection
+    pending = cache.plan(topology, broker_key, connection)
+    names = {queue.name: queue.name for queue in topology.queues}
+    for spec in pending:
+        if isinstance(spec, ExchangeSpec):
+            channel.exchange_declare(
+                exchange=spec.name,
+                exchange_type=spec.type,
+                durable=spec.durable,
+                auto_delete=spec.auto_delete,
+                internal=spec.internal,
+                arguments=spec.arguments or None,
+            )
+        elif isinstance(spec, QueueSpec):
+            declared = channel.queue_declare(
+                queue=spec.name,
+                durable=spec.durable,
+                exclusive=spec.exclusive,
+                auto_delete=spec.auto_delete,
+                arguments=spec.arguments or None,
+            )
+            names[spec.name] = declared.method.queue
+        else:
+            channel.queue_bind(
+                queue=names.get(spec.queue, spec.queue),
+                exchange=spec.exchange,
+                routing_key=spec.routing_key,
+                arguments=spec.arguments or None,
+            )
+    cache.remember(pending, topology, broker_key, connection)
+    if pending:
+        logger.debug("Declared %d of %d topology entities", len(pending), len(topology.specs()))
+    return names
+
+
+async def apply_async(
+        channel: "AbstractChannel",
+        topology: Topology,
+        broker_key: Hashable,
+        cache: Optional[TopologyCache] = None,
+) -> dict[str, str]:
+    """
+    Объявляет недостающие сущности топологии через канал aio_pika.
+
+    Привязки выполняются по имени обменника, без запроса get_exchange.
+
+    Возвращает:
+        dict[str, str]: Соответствие имён очередей топологии объявленным именам
+            (для очереди с пустым именем - имя, сгенерированное брокером).
+    """
+    cache = cache or _cache
+    connection = channel
+    # Для aio_pika кэш неустойчивых сущностей привязан к каналу: robust-канал сам восстанавливает
+    # объявленные на нём сущности после переподключения.
+    pending = cache.plan(topology, broker_key, connection)
+    names = {queue.name: queue.name for queue in topology.queues}
+
+    async def declare_exchange(spec: ExchangeSpec) -> None:
+        await channel.declare_exchange(
+            name=spec.name,
+            type=spec.type,
+            durable=spec.durable,
+            auto_delete=spec.auto_delete,
+            internal=spec.internal,
+            arguments=spec.arguments or None,
+        )
+
+    async def declare_queue(spec: QueueSpec) -> None:
+        declared = await channel.declare_queue(
+            name=spec.name or None,
+            durable=spec.durable,
+            exclusive=spec.exclusive,
+            auto_delete=spec.auto_delete,
+            arguments=spec.arguments or None,
+        )
+        names[spec.name] = declared.name
+
+    async def bind(spec: BindingSpec) -> None:
+        queue = await channel.get_queue(names.get(spec.queue, spec.queue), ensure=False)
+        await queue.bind(exchange=spec.exchange, routing_key=spec.routing_key, arguments=spec.arguments or None)
+
+    # Сущности одного вида не зависят друг от друга, поэтому запросы отправляются без ожидания ответов.
+    for kind, declare in ((ExchangeSpec, declare_exchange), (QueueSpec, declare_queue), (BindingSpec, bind)):
+        await asyncio.gather(*(declare(spec) for spec in pending if isinstance(spec, kind)))
+    cache.remember(pending, topology, broker_key, connection)
+    if pending:
+        logger.debug("Declared %d of %d topology entities", len(pending), len(topology.specs()))
+    return names
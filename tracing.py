@@ -0,0 +1,325 @@
+"""
+Трассировка сообщений: заголовки трассы и время каждого этапа.
+
+При публикации в headers сообщения добавляются идентификатор трассы, время публикации
+и номер перехода (hop). Сообщение, опубликованное из обработчика другого сообщения,
+продолжает его трассу с hop + 1. При получении заголовки извлекаются, и для каждого
+этапа в sink отправляется Span:
+
+* publish - от вызова publish до подтверждения брокера (сообщение записано в очередь);
+* queue - от публикации до доставки обработчику (часы publisher'а и consumer'а должны
+  быть синхронизированы);
+* handler - работа обработчика;
+* ack - от завершения работы обработчика (вызова ack/nack/reject или возврата из него)
+  до подтверждения ack/nack/reject.
+
+Длительности этапов на стороне consumer'а измеряются по time.perf_counter, unix time
+используется только для начала span'а и для этапа queue, который пересекает процессы.
+
+Трассировка выключена по умолчанию, как и метрики: `enable_tracing(sink)` включает её для
+всех клиентов процесса, в том числе для уже запущенных consumer'ов. Sink - любой объект с методом `emit(span)`, например LoggingSink
+или MemorySink, по которому можно посчитать перцентили этапов.
+"""
+import contextvars
+import functools
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional, Protocol
+
+from delivery import settle_hooks_channel, settle_hooks_message
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractIncomingMessage
+    from pika.adapters.blocking_connection import BlockingChannel
+    from pika.spec import Basic, BasicProperties
+
+logger = logging.getLogger(__name__)
+
+TRACE_ID_HEADER = "x-trace-id"
+PUBLISHED_AT_HEADER = "x-published-at-ms"
+HOP_HEADER = "x-hop"
+
+STAGE_PUBLISH = "publish"
+STAGE_QUEUE = "queue"
+STAGE_HANDLER = "handler"
+STAGE_ACK = "ack"
+
+
+@dataclass
+class Span:
+    """
+    Время одного этапа обработки сообщения.
+
+    :param trace_id: Идентификатор трассы.
+    :param stage: Этап: publish, queue, handler или ack.
+    :param start: Начало этапа (unix time, секунды).
+    :param duration: Длительность этапа в секундах.
+    :param hop: Номер перехода сообщения в трассе.
+    :param attributes: Очередь или обменник, исход обработки и т.п.
+    """
+    trace_id: str
+    stage: str
+    start: float
+    duration: float
+    hop: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class TraceContext:
+    trace_id: str
+    hop: int = 0
+    published_at: Optional[float] = None
+
+
+class SpanSink(Protocol):
+
+    def emit(self, span: Span) -> None:
+        ...
+
+
+class LoggingSink:
+    """Пишет span'ы в лог."""
+
+    def __init__(self, log: logging.Logger = logger, level: int = logging.INFO):
+        self.log = log
+        self.level = level
+
+    def emit(self, span: Span) -> None:
+        self.log.log(
+            self.level, "span trace=%s hop=%d stage=%s duration=%.6fs %s",
+            span.trace_id, span.hop, span.stage, span.duration, span.attributes,
+        )
+
+
+class MemorySink:
+    """Хранит последние max_spans span'ов в памяти."""
+
+    def __init__(self, max_spans: int = 100_000):
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def durations(self, stage: str) -> list[float]:
+        with self._lock:
+            return [span.duration for span in self.spans if span.stage == stage]
+
+    def percentile(self, stage: str, q: float) -> Optional[float]:
+        """Перцентиль длительности этапа (q от 0 до 1) или None, если данных нет."""
+        durations = sorted(self.durations(stage))
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, max(0, math.ceil(q * len(durations)) - 1))]
+
+
+_current: contextvars.ContextVar[Optional[TraceContext]] = contextvars.ContextVar("mq_trace", default=None)
+
+
+def current_trace() -> Optional[TraceContext]:
+    """Трасса обрабатываемого сообщения или None вне обработчика."""
+    return _current.get()
+
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, sink: SpanSink):
+        self.sink = sink
+
+    def inject(self, headers: Optional[dict[str, Any]] = None) -> Optional[dict[str, Any]]:
+        """
+        Возвращает копию headers с заголовками трассы.
+
+        Трасса берётся из заголовков (повторная публикация того же сообщения), из обрабатываемого
+        сообщения или создаётся новая.
+        """
+        headers = dict(headers or {})
+        parent = self.extract(headers) if TRACE_ID_HEADER in headers else current_trace()
+        if parent is None:
+            headers[TRACE_ID_HEADER] = uuid.uuid4().hex
+            headers[HOP_HEADER] = 0
+        else:
+            headers[TRACE_ID_HEADER] = parent.trace_id
+            headers[HOP_HEADER] = parent.hop + 1
+        headers[PUBLISHED_AT_HEADER] = int(time.time() * 1000)
+        return headers
+
+    @staticmethod
+    def extract(headers: Optional[dict[str, Any]]) -> Optional[TraceContext]:
+        """Трасса из заголовков сообщения или None, если их нет."""
+        headers = headers or {}
+        trace_id = headers.get(TRACE_ID_HEADER)
+        if not trace_id:
+            return None
+        if isinstance(trace_id, bytes):
+            trace_id = trace_id.decode()
+        published_at = headers.get(PUBLISHED_AT_HEADER)
+        return TraceContext(
+            trace_id=str(trace_id),
+            hop=int(headers.get(HOP_HEADER) or 0),
+            published_at=published_at / 1000 if published_at is not None else None,
+        )
+
+    def emit(self, stage: str, context: TraceContext, start: float, duration: float, **attributes: Any) -> None:
+        try:
+            self.sink.emit(Span(context.trace_id, stage, start, max(0.0, duration), context.hop, attributes))
+        except Exception as e:
+            logger.warning("Failed to emit %s span: %s", stage, e)
+
+    def published(self, headers: Optional[dict[str, Any]], duration: float, **attributes: Any) -> None:
+        """Записывает span публикации сообщения с заголовками, полученными от `inject`."""
+        context = self.extract(headers)
+        if context is not None:
+            self.emit(STAGE_PUBLISH, context, context.published_at or time.time() - duration, duration, **attributes)
+
+    def delivered(self, headers: Optional[dict[str, Any]], delivered_at: float, **attributes: Any) -> TraceContext:
+        """Записывает span ожидания в очереди и возвращает трассу сообщения (новую, если заголовков нет)."""
+        context = self.extract(headers)
+        if context is None:
+            return TraceContext(trace_id=uuid.uuid4().hex)
+        if context.published_at is not None:
+            self.emit(STAGE_QUEUE, context, context.published_at, delivered_at - context.published_at, **attributes)
+        return context
+
+
+class NullTracer(Tracer):
+    """Трассировка выключена: заголовки не добавляются, span'ы не записываются."""
+    enabled = False
+
+    def __init__(self):
+        super().__init__(sink=None)  # type: ignore[arg-type]
+
+    def inject(self, headers: Optional[dict[str, Any]] = None) -> Optional[dict[str, Any]]:
+        return headers
+
+    def emit(self, stage: str, context: TraceContext, start: float, duration: float, **attributes: Any) -> None:
+        pass
+
+
+_tracer: Tracer = NullTracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def enable_tracing(sink: Optional[SpanSink] = None) -> Tracer:
+    """Включает трассировку для всех клиентов процесса (по умолчанию span'ы пишутся в лог)."""
+    global _tracer
+    _tracer = Tracer(sink or LoggingSink())
+    return _tracer
+
+
+def disable_tracing() -> None:
+    global _tracer
+    _tracer = NullTracer()
+
+
+class _SettleTiming:
+    """Хук для обёрток `delivery`, запоминающий метод и момент завершения первого ack/nack/reject."""
+
+    def __init__(self):
+        self.settled: Optional[tuple[str, float]] = None
+
+    def __call__(self, method: str, requeue: bool) -> None:
+        self.settled = self.settled or (method, time.perf_counter())
+
+
+def _finish(
+        tracer: Tracer,
+        context: TraceContext,
+        delivered_at: float,
+        started: float,
+        settle_started: Optional[float],
+        settled: Optional[tuple[str, float]],
+        error: bool,
+        queue: str,
+) -> None:
+    """
+    Записывает span'ы handler и ack.
+
+    delivered_at - unix time доставки, остальные моменты - time.perf_counter; начало span'а ack
+    переводится в unix time относительно started.
+    """
+    finished = time.perf_counter()
+    tracer.emit(STAGE_HANDLER, context, delivered_at, finished - started, queue=queue, error=error)
+    if settled is not None:
+        method, settled_at = settled
+        # Обработчик обычно подтверждает сообщение сам: его работа заканчивается вызовом ack.
+        done = min(finished, settle_started) if settle_started is not None else finished
+        tracer.emit(STAGE_ACK, context, delivered_at + (done - started), settled_at - done, queue=queue, method=method)
+
+
+def traced(
+        on_message_callback: Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None],
+        queue: str,
+) -> Callable[["BlockingChannel", "Basic.Deliver", "BasicProperties", bytes], None]:
+    """
+    Оборачивает pika callback трассировкой.
+
+    Трассировщик берётся при каждой доставке, поэтому `enable_tracing` действует и на callback,
+    обёрнутый раньше; пока трассировка выключена, callback вызывается напрямую.
+    """
+
+    @functools.wraps(on_message_callback)
+    def wrapper(channel, method, properties, body):
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return on_message_callback(channel, method, properties, body)
+        delivered_at, started = time.time(), time.perf_counter()
+        context = tracer.delivered(properties.headers, delivered_at, queue=queue)
+        token = _current.set(context)
+        timing = _SettleTiming()
+        channel = settle_hooks_channel(channel, timing)
+        error = False
+        try:
+            return on_message_callback(channel, method, properties, body)  # type: ignore[arg-type]
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current.reset(token)
+            _finish(tracer, context, delivered_at, started, channel.settle_started, timing.settled, error, queue)
+
+    return wrapper
+
+
+def traced_async(
+        on_message_callback: Callable[["AbstractIncomingMessage"], Awaitable[Any]],
+        queue: str,
+) -> Callable[["AbstractIncomingMessage"], Awaitable[Any]]:
+    """
+    Оборачивает aio_pika обработчик трассировкой.
+
+    Как и в `traced`, трассировщик берётся при каждой доставке.
+    """
+
+    @functools.wraps(on_message_callback)
+    async def wrapper(message):
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return await on_message_callback(message)
+        delivered_at, started = time.time(), time.perf_counter()
+        context = tracer.delivered(message.headers, delivered_at, queue=queue)
+        token = _current.set(context)
+        timing = _SettleTiming()
+        message = settle_hooks_message(message, timing)
+        error = False
+        try:
+            return await on_message_callback(message)  # type: ignore[arg-type]
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current.reset(token)
+            _finish(tracer, context, delivered_at, started, message.settle_started, timing.settled, error, queue)
+
+    return wrapper